@@ -0,0 +1,204 @@
+"""Benchmarks of the stages of the runmanager globals pipeline on synthetic globals.
+
+Each stage, get_globals(), evaluate_globals(), expand_globals(), make_run_files() and
+globals_diff_groups(), is run on globals files made by synthetic_globals.py with the
+given parameters, and its time and peak memory reported::
+
+$ python benchmarks/bench_globals_pipeline.py --preset lab
+$ python benchmarks/bench_globals_pipeline.py --groups 20 --globals 200 --depth 3
+
+The time of each stage is the minimum over --repeat runs. Peak memory is measured in a
+separate run with tracemalloc, which only counts memory allocated by Python, and
+includes the stage's result. Use --json to save the results for comparison between
+versions.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+import runmanager
+
+from synthetic_globals import make_globals_files, add_workload_arguments, workload_kwargs
+
+# Workloads, as arguments to make_globals_files():
+PRESETS = {
+    'small': dict(n_files=1, n_groups=2, n_globals=50, scan_dims=1, scan_points=5),
+    'lab': dict(
+        n_files=2,
+        n_groups=10,
+        n_globals=100,
+        dependency_depth=3,
+        array_size=1000,
+        scan_dims=2,
+        scan_points=10,
+    ),
+    'large': dict(
+        n_files=4,
+        n_groups=25,
+        n_globals=200,
+        dependency_depth=5,
+        array_size=100000,
+        scan_dims=3,
+        scan_points=10,
+    ),
+}
+
+STAGES = [
+    'get_globals',
+    'evaluate_globals',
+    'expand_globals',
+    'make_run_files',
+    'globals_diff_groups',
+]
+
+SEQUENCE_ATTRS = {
+    'script_basename': 'benchmark',
+    'sequence_date': '2000-01-01',
+    'sequence_index': 0,
+    'sequence_id': '20000101T000000_benchmark',
+}
+
+
+class PipelineBenchmark(object):
+    """The stages of the globals pipeline on globals files created in folder by
+    make_globals_files(**workload). Each stage method runs one stage, with the
+    results of the previous stages as inputs, which are computed by setup() for each
+    stage so that they are not included in its measurement."""
+
+    def __init__(self, folder, workload):
+        self.folder = folder
+        self.groups = make_globals_files(os.path.join(folder, 'globals'), **workload)
+        # The same globals with some of them changed, to compare against:
+        self.other_groups = make_globals_files(
+            os.path.join(folder, 'other_globals'), perturb_fraction=0.05, **workload
+        )
+        self.run_files_folder = os.path.join(folder, 'run_files')
+
+    def setup(self, stage):
+        """Compute the inputs of stage"""
+        if stage in ('get_globals', 'globals_diff_groups'):
+            return
+        self.sequence_globals = runmanager.get_globals(self.groups)
+        if stage == 'evaluate_globals':
+            return
+        self.evaled_globals, _, _ = runmanager.evaluate_globals(self.sequence_globals)
+        if stage == 'expand_globals':
+            return
+        self.shots = runmanager.expand_globals(self.sequence_globals, self.evaled_globals)
+        shutil.rmtree(self.run_files_folder, ignore_errors=True)
+
+    def get_globals(self):
+        return runmanager.get_globals(self.groups)
+
+    def evaluate_globals(self):
+        return runmanager.evaluate_globals(self.sequence_globals)
+
+    def expand_globals(self):
+        return runmanager.expand_globals(self.sequence_globals, self.evaled_globals)
+
+    def make_run_files(self):
+        return list(
+            runmanager.make_run_files(
+                self.run_files_folder,
+                self.sequence_globals,
+                self.shots,
+                SEQUENCE_ATTRS,
+                'benchmark',
+            )
+        )
+
+    def globals_diff_groups(self):
+        return runmanager.globals_diff_groups(self.groups, self.other_groups)
+
+
+def measure(benchmark, stage, repeat):
+    """Return the minimum time over repeat runs of stage, and its peak traced
+    memory"""
+    times = []
+    for _ in range(repeat):
+        benchmark.setup(stage)
+        start_time = time.perf_counter()
+        result = getattr(benchmark, stage)()
+        times.append(time.perf_counter() - start_time)
+        del result
+    benchmark.setup(stage)
+    tracemalloc.start()
+    try:
+        result = getattr(benchmark, stage)()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return min(times), peak_memory
+
+
+def run_benchmarks(workload, stages=STAGES, repeat=3, folder=None):
+    """Run the given stages on globals made by make_globals_files(**workload), in
+    folder, or a temporary folder if not given. Return a dict {stage: {'time':
+    seconds, 'peak_memory': bytes}}, and the number of shots."""
+    with tempfile.TemporaryDirectory() as temp_folder:
+        benchmark = PipelineBenchmark(folder or temp_folder, workload)
+        results = {}
+        for stage in stages:
+            time_taken, peak_memory = measure(benchmark, stage, repeat)
+            results[stage] = {'time': time_taken, 'peak_memory': peak_memory}
+        benchmark.setup('make_run_files')
+        n_shots = len(benchmark.shots)
+    return results, n_shots
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python benchmarks/bench_globals_pipeline.py',
+        description="Benchmark the stages of the globals pipeline.",
+    )
+    parser.add_argument(
+        '--preset',
+        choices=sorted(PRESETS),
+        help="predefined workload, overriding the workload arguments",
+    )
+    add_workload_arguments(parser)
+    parser.add_argument(
+        '--stages', nargs='+', choices=STAGES, default=STAGES, help="stages to run"
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=3, help="number of timed runs of each stage"
+    )
+    parser.add_argument('--json', help="file to save the results to, as JSON")
+    args = parser.parse_args(argv)
+
+    if args.preset is not None:
+        workload = PRESETS[args.preset]
+    else:
+        workload = workload_kwargs(args)
+    results, n_shots = run_benchmarks(workload, args.stages, args.repeat)
+
+    print('Workload: %s, %d shots\n' % (workload, n_shots))
+    print('%-20s %12s %16s' % ('Stage', 'Time (s)', 'Peak memory (MB)'))
+    for stage, result in results.items():
+        print(
+            '%-20s %12.4f %16.2f'
+            % (stage, result['time'], result['peak_memory'] / 1e6)
+        )
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(
+                {
+                    'runmanager_version': runmanager.__version__,
+                    'workload': workload,
+                    'n_shots': n_shots,
+                    'results': results,
+                },
+                f,
+                indent=4,
+            )
+    return results
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,162 @@
+"""Generator of synthetic globals files for benchmarking runmanager.
+
+The files have the same layout as those made by runmanager, with parameterised
+numbers of files, groups per file and globals per group, chains of globals depending
+on one another, array-valued globals, and a number of scanned globals which determine
+the number of shots::
+
+$ python benchmarks/synthetic_globals.py output_folder --files 2 --groups 5 --globals 100
+
+"""
+import os
+import sys
+import random
+import argparse
+
+import labscript_utils.h5_lock
+import h5py
+import numpy as np
+
+import runmanager
+
+
+def global_name(file_index, group_index, global_index):
+    return 'g%d_%d_%d' % (file_index, group_index, global_index)
+
+
+def make_globals_files(
+    folder,
+    n_files=1,
+    n_groups=5,
+    n_globals=100,
+    dependency_depth=0,
+    array_size=0,
+    array_fraction=0.1,
+    scan_dims=1,
+    scan_points=10,
+    array_datasets=False,
+    perturb_fraction=0,
+    seed=0,
+):
+    """Create n_files globals files in folder, each with n_groups groups of n_globals
+    globals, and return the globals groups as a dict {group_name: globals_file}, as
+    used by runmanager.get_globals().
+
+    Within each group, globals form chains of dependency_depth + 1 globals, each but
+    the first in a chain being an expression in terms of the previous one. A fraction
+    array_fraction of the globals that are not in a chain are arrays of array_size
+    elements, if array_size is nonzero, given as expressions, or stored as datasets if
+    array_datasets is True. The first scan_dims globals that are not in a chain or
+    arrays are lists of scan_points values with outer product expansion, so that the
+    globals expand to scan_points**scan_dims shots. If perturb_fraction is nonzero,
+    the expressions of that fraction of the globals are changed, so that the files can
+    be compared with unperturbed ones by runmanager.globals_diff_groups(). The globals
+    are the same for a given seed and parameters."""
+    rng = random.Random(seed)
+    # Separate, so that perturbing does not change the other globals:
+    perturb_rng = random.Random(seed + 1)
+    os.makedirs(folder, exist_ok=True)
+    groups = {}
+    n_scanned = 0
+    for file_index in range(n_files):
+        filename = os.path.join(folder, 'globals_%d.h5' % file_index)
+        runmanager.new_globals_file(filename)
+        with h5py.File(filename, 'a') as f:
+            for group_index in range(n_groups):
+                group_name = 'group_%d_%d' % (file_index, group_index)
+                group = f['globals'].create_group(group_name)
+                units = group.create_group('units')
+                expansions = group.create_group('expansion')
+                for global_index in range(n_globals):
+                    name = global_name(file_index, group_index, global_index)
+                    expansion = ''
+                    unit = ''
+                    perturbable = True
+                    if global_index % (dependency_depth + 1):
+                        previous = global_name(file_index, group_index, global_index - 1)
+                        expression = '%s * 1.001 + %d' % (previous, global_index)
+                    elif array_size and rng.random() < array_fraction:
+                        if array_datasets:
+                            array = np.linspace(0, rng.random(), array_size)
+                            group.require_group('arrays').create_dataset(name, data=array)
+                            expression = runmanager.array_placeholder(array)
+                            perturbable = False
+                        else:
+                            expression = 'linspace(0, %r, %d)' % (rng.random(), array_size)
+                    elif n_scanned < scan_dims:
+                        expression = 'linspace(0, 1, %d)' % scan_points
+                        expansion = 'outer'
+                        perturbable = False
+                        n_scanned += 1
+                    else:
+                        expression = repr(rng.uniform(-1e6, 1e6))
+                        unit = rng.choice(['', 'Hz', 'MHz', 's', 'ms', 'V'])
+                    if perturbable and perturb_rng.random() < perturb_fraction:
+                        expression += ' + 1'
+                    group.attrs[name] = expression
+                    units.attrs[name] = unit
+                    expansions.attrs[name] = expansion
+                groups[group_name] = filename
+    return groups
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python benchmarks/synthetic_globals.py',
+        description="Create synthetic globals files for benchmarking.",
+    )
+    parser.add_argument('folder', help="folder in which to create the globals files")
+    add_workload_arguments(parser)
+    args = parser.parse_args(argv)
+    groups = make_globals_files(args.folder, **workload_kwargs(args))
+    print('Created %d globals groups in %d files' % (len(groups), args.files))
+
+
+def add_workload_arguments(parser):
+    """Add arguments for the parameters of make_globals_files() to an
+    ArgumentParser"""
+    parser.add_argument('--files', type=int, default=1, help="number of files")
+    parser.add_argument('--groups', type=int, default=5, help="groups per file")
+    parser.add_argument('--globals', type=int, default=100, help="globals per group")
+    parser.add_argument(
+        '--depth', type=int, default=0, help="length of dependency chains, minus one"
+    )
+    parser.add_argument(
+        '--array-size', type=int, default=0, help="elements in array globals"
+    )
+    parser.add_argument(
+        '--array-fraction', type=float, default=0.1, help="fraction of array globals"
+    )
+    parser.add_argument(
+        '--array-datasets',
+        action='store_true',
+        help="store array globals as datasets rather than expressions",
+    )
+    parser.add_argument(
+        '--scan-dims', type=int, default=1, help="number of scanned globals"
+    )
+    parser.add_argument(
+        '--scan-points', type=int, default=10, help="values of each scanned global"
+    )
+    parser.add_argument('--seed', type=int, default=0, help="random seed")
+
+
+def workload_kwargs(args):
+    """Return the keyword arguments for make_globals_files() from parsed
+    arguments"""
+    return dict(
+        n_files=args.files,
+        n_groups=args.groups,
+        n_globals=args.globals,
+        dependency_depth=args.depth,
+        array_size=args.array_size,
+        array_fraction=args.array_fraction,
+        scan_dims=args.scan_dims,
+        scan_points=args.scan_points,
+        array_datasets=args.array_datasets,
+        seed=args.seed,
+    )
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
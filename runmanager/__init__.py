@@ -26,6 +26,9 @@ import json
 import tokenize
 import io
 import warnings
+import hashlib
+import contextlib
+import string
 
 import labscript_utils.h5_lock
 import h5py
@@ -96,6 +99,70 @@ class ExpansionError(Exception):
     pass
 
 
+class EvaluationInterrupted(Exception):
+
+    """Raised by evaluate_globals when its interrupt callback returns True,
+    to abandon an evaluation whose results are no longer wanted"""
+    pass
+
+
+# numpy arrays at least this many bytes in size are stored in globals files as
+# datasets rather than as repr() text expressions, when set via the remote API:
+ARRAY_DATASET_THRESHOLD = 1024
+
+# Evaluated globals that are numeric numpy arrays too large to be saved as attributes
+# of the 'globals' group, which are limited to 64 kB, are saved in run files as
+# datasets in this group instead. The attribute is then an object reference to the
+# dataset. Globals that fit in an attribute are saved as attributes as always:
+GLOBAL_DATASETS_GROUP = 'globals_datasets'
+
+# Appended to a sequence's filename prefix to give the filenames of its manifest and
+# of its globals sidecar file. Neither of these is a run file, so they are not given
+# the .h5 extension, lest lyse and other tools take them for shot files:
+MANIFEST_SUFFIX = '_manifest.hdf5'
+SIDECAR_SUFFIX = '_globals.hdf5'
+SEQUENCE_FILE_SUFFIXES = (MANIFEST_SUFFIX, SIDECAR_SUFFIX)
+
+# The file in <experiment_shot_storage>/<script_basename> in which the next sequence
+# index is stored, see next_sequence_index():
+SEQUENCE_INDEX_FILENAME = '.next_sequence_index'
+
+# Number of run files per shard subfolder, if output_folder_format contains a {shard}
+# field and the shard_size labconfig setting is not set:
+DEFAULT_SHARD_SIZE = 1000
+
+
+class ArrayExpression(str):
+    """The expression of a global whose value is a numpy array stored as a dataset in
+    the globals file, rather than as text. Behaves as a string, which is a placeholder
+    describing the array, for display and comparison, whilst the array itself is
+    available as the `value` attribute. evaluate_globals() uses the array directly
+    instead of evaluating the string, and set_value() writes the array to the
+    'arrays' subgroup of the globals group."""
+
+    def __new__(cls, value, expression=None):
+        value = np.asarray(value)
+        if expression is None:
+            expression = array_placeholder(value)
+        self = str.__new__(cls, expression)
+        self.value = value
+        return self
+
+    def __add__(self, other):
+        # So that comments may be appended as for ordinary expressions:
+        return ArrayExpression(self.value, str(self) + other)
+
+    def __reduce__(self):
+        return (ArrayExpression, (self.value, str(self)))
+
+
+def array_placeholder(value):
+    """Return the placeholder expression displayed for a global whose value is the
+    given array stored as a dataset"""
+    digest = hashlib.sha1(np.ascontiguousarray(value).view(np.uint8)).hexdigest()
+    return '<array dataset: %s %s sha1 %s>' % (value.dtype, value.shape, digest[:12])
+
+
 class TraceDictionary(dict):
 
     def __init__(self, *args, **kwargs):
@@ -279,6 +346,8 @@ def rename_global(filename, groupname, oldglobalname, newglobalname):
         del group.attrs[oldglobalname]
         del group['units'].attrs[oldglobalname]
         del group['expansion'].attrs[oldglobalname]
+        if 'arrays' in group and oldglobalname in group['arrays']:
+            group['arrays'].move(oldglobalname, newglobalname)
 
 
 def get_value(filename, groupname, globalname):
@@ -291,8 +360,17 @@ def get_value(filename, groupname, globalname):
 
 
 def set_value(filename, groupname, globalname, value):
+    """Set the expression of a global. If value is an ArrayExpression, its array is
+    stored as a dataset, otherwise any dataset previously storing the global's value is
+    deleted."""
     with h5py.File(filename, 'a') as f:
-        f['globals'][groupname].attrs[globalname] = value
+        group = f['globals'][groupname]
+        if 'arrays' in group and globalname in group['arrays']:
+            del group['arrays'][globalname]
+        if isinstance(value, ArrayExpression):
+            group.require_group('arrays').create_dataset(globalname, data=value.value)
+            value = str(value)
+        group.attrs[globalname] = value
 
 
 def get_units(filename, groupname, globalname):
@@ -323,10 +401,22 @@ def set_expansion(filename, groupname, globalname, expansion):
         f['globals'][groupname]['expansion'].attrs[globalname] = expansion
 
 
+def set_expansions(filename, expansions):
+    """Set the expansions of many globals in a file at once. expansions should be a
+    dict {groupname: {globalname: expansion}}"""
+    with h5py.File(filename, 'a') as f:
+        for groupname, group_expansions in expansions.items():
+            attrs = f['globals'][groupname]['expansion'].attrs
+            for globalname, expansion in group_expansions.items():
+                attrs[globalname] = expansion
+
+
 def delete_global(filename, groupname, globalname):
     with h5py.File(filename, 'a') as f:
         group = f['globals'][groupname]
         del group.attrs[globalname]
+        if 'arrays' in group and globalname in group['arrays']:
+            del group['arrays'][globalname]
 
 
 def guess_expansion_type(value):
@@ -336,6 +426,280 @@ def guess_expansion_type(value):
         return u''
 
 
+class ExpansionModeGuesser(object):
+    """Guesses the expansion modes of globals from their values and dependencies, as
+    runmanager does when globals change. The evaluated globals, hierarchy and
+    expansions from each call to guess() are kept in order to detect changes in the
+    next call, so the same instance should be used for the same globals over time."""
+
+    def __init__(self):
+        self.previous_evaled_globals = {}
+        self.previous_global_hierarchy = {}
+        self.previous_expansion_types = {}
+        self.previous_expansions = {}
+
+    def copy(self):
+        """Return a new ExpansionModeGuesser with the same state as this one, which
+        can be used to guess the expansion modes of modified globals without
+        affecting this one"""
+        guesser = ExpansionModeGuesser()
+        guesser.previous_evaled_globals = self.previous_evaled_globals.copy()
+        guesser.previous_global_hierarchy = self.previous_global_hierarchy.copy()
+        guesser.previous_expansion_types = self.previous_expansion_types.copy()
+        guesser.previous_expansions = self.previous_expansions.copy()
+        return guesser
+
+    def prime(self, sequence_globals, interrupt=None):
+        """Evaluate sequence_globals, as returned by get_globals(), and record the
+        results as the previous state of the globals, without writing anything to
+        the globals files. Changes to the globals after this, such as by
+        apply_global_overrides(), are then guessed as they would be if the globals
+        files were changed. interrupt is passed to evaluate_globals()."""
+        evaled_globals, global_hierarchy, expansions = evaluate_globals(
+            sequence_globals, raise_exceptions=False, interrupt=interrupt
+        )
+        self.guess(None, evaled_globals, global_hierarchy, expansions)
+
+    def guess(self, active_groups, evaled_globals, global_hierarchy, expansions):
+        """Guess the expansion modes of the globals of active_groups, given the
+        results of evaluate_globals() on them, such that globals referencing an
+        iterable global are zipped with it rather than outer producted. This should
+        be called repeatedly, re-reading and re-evaluating the globals each time,
+        until it returns False, indicating that no expansion modes have changed.
+        Note that this method does not return what expansion types it thinks
+        globals should have - it *actually writes them to the globals HDF5 file*,
+        as well as updating expansions in place. So it is up to later code to
+        ensure it re-reads the expansion mode from the HDF5 file before
+        proceeding, see evaluate_globals_guessing_expansions(). If active_groups is
+        None, expansions is updated but nothing is written."""
+
+        # Do nothing if there were exceptions:
+        for group_name in evaled_globals:
+            for global_name in evaled_globals[group_name]:
+                value = evaled_globals[group_name][global_name]
+                if isinstance(value, Exception):
+                    # Let ExpansionErrors through through, as they occur
+                    # when the user has changed the value without changing
+                    # the expansion type:
+                    if isinstance(value, ExpansionError):
+                        continue
+                    return False
+        # Did the guessed expansion type for any of the globals change?
+        expansion_types_changed = False
+        expansion_types = {}
+        # Expansions to be written to the globals files, {(group_name, global_name):
+        # expansion}. These are written all at once at the end, opening each file
+        # only once:
+        expansions_to_write = {}
+        for group_name in evaled_globals:
+            for global_name in evaled_globals[group_name]:
+                new_value = evaled_globals[group_name][global_name]
+                try:
+                    previous_value = self.previous_evaled_globals[group_name][global_name]
+                except KeyError:
+                    # This variable is used to guess the expansion type
+                    # 
+                    # If we already have an expansion specified for this, but
+                    # don't have a previous value, then we should use the 
+                    # new_value for the guess as we are likely loading from HDF5
+                    # file for the first time (and either way, don't want to 
+                    # overwrite what the user has put in the expansion type)
+                    #
+                    # If we don't have an expansion...
+                    # then we set it to '0' which will result in an
+                    # expansion type guess of '' (emptys string) This will
+                    # either result in nothing being done to the expansion
+                    # type or the expansion type being found to be 'outer',
+                    # which will then make it go through the machinery below
+                    if global_name in expansions and expansions[global_name]:
+                        previous_value = new_value
+                    else:
+                        previous_value = 0
+
+                new_guess = guess_expansion_type(new_value)
+                previous_guess = guess_expansion_type(previous_value)
+
+                if new_guess == 'outer':
+                    expansion_types[global_name] = {'previous_guess': previous_guess,
+                                                    'new_guess': new_guess,
+                                                    'group_name': group_name,
+                                                    'value': new_value
+                                                    }
+                elif new_guess != previous_guess:
+                    expansions_to_write[group_name, global_name] = new_guess
+                    expansions[global_name] = new_guess
+                    expansion_types_changed = True
+
+        def dependency_finder(global_hierarchy, expansion_types):
+            """Return a function that finds all globals in expansion_types that
+            depend, directly or indirectly, on a given global. This is done by
+            traversing a graph of reverse dependencies, restricted to globals in
+            expansion_types, with the results cached for each global."""
+            dependents = {}
+            for name in sorted(global_hierarchy):
+                if name in expansion_types:
+                    for dependency in global_hierarchy[name]:
+                        dependents.setdefault(dependency, []).append(name)
+            cache = {}
+
+            def find_dependencies(global_name):
+                if global_name not in cache:
+                    results = set()
+                    to_visit = [global_name]
+                    while to_visit:
+                        for name in dependents.get(to_visit.pop(), []):
+                            if name not in results:
+                                results.add(name)
+                                to_visit.append(name)
+                    cache[global_name] = results
+                return cache[global_name]
+
+            return find_dependencies
+
+        def global_depends_on_global_with_outer_product(global_name, global_hierarchy, expansions):
+            if global_name not in global_hierarchy:
+                return False
+            else:
+                for dependency in global_hierarchy[global_name]:
+                    if expansions[dependency]:
+                        return True
+
+        def set_expansion_type_guess(expansion_types, expansions, global_name, expansion_to_set, new=True):
+            if new:
+                key = 'new_guess'
+            else:
+                key = 'previous_guess'
+
+            # only do this if the expansion is *not* already set to a specific zip group
+            if global_name in expansions and expansions[global_name] != '' and expansions[global_name] != 'outer':
+                expansion_types[global_name][key] = expansions[global_name]
+            else:
+                expansion_types[global_name][key] = expansion_to_set
+                expansions[global_name] = expansion_to_set
+
+        find_current_dependencies = dependency_finder(global_hierarchy, expansion_types)
+        for global_name in sorted(expansion_types):
+            # we have a global that does not depend on anything that has an
+            # expansion type of 'outer'
+            if (not global_depends_on_global_with_outer_product(global_name, global_hierarchy, expansions)
+                    and not isinstance(expansion_types[global_name]['value'], ExpansionError)):
+                current_dependencies = find_current_dependencies(global_name)
+
+                # if this global has other globals that use it, then add them
+                # all to a zip group with the name of this global
+                if current_dependencies:
+                    for dependency in sorted(current_dependencies):
+                        set_expansion_type_guess(expansion_types, expansions, dependency,  str(global_name))
+                            
+                    set_expansion_type_guess(expansion_types, expansions, global_name,  str(global_name))
+
+        find_old_dependencies = dependency_finder(self.previous_global_hierarchy, self.previous_expansion_types)
+        for global_name in sorted(self.previous_expansion_types):
+            if (not global_depends_on_global_with_outer_product(
+                global_name, self.previous_global_hierarchy, self.previous_expansions)
+                    and not isinstance(self.previous_expansion_types[global_name]['value'], ExpansionError)):
+                old_dependencies = find_old_dependencies(global_name)
+                # if this global has other globals that use it, then add them
+                # all to a zip group with the name of this global
+                if old_dependencies:
+                    for dependency in sorted(old_dependencies):
+                        if dependency in expansion_types:
+                            set_expansion_type_guess(expansion_types, self.previous_expansions, dependency, str(global_name), new=False)
+                    if global_name in expansion_types:
+                        set_expansion_type_guess(expansion_types, self.previous_expansions, global_name, str(global_name), new=False)
+
+        for global_name, guesses in expansion_types.items():
+            if guesses['new_guess'] != guesses['previous_guess']:
+                expansions_to_write[guesses['group_name'], global_name] = str(guesses['new_guess'])
+                expansions[global_name] = guesses['new_guess']
+                expansion_types_changed = True
+
+        # Now check everything that has an expansion type not equal to outer.
+        # If it has one, but is not iteratble, remove it from teh zip group
+        for group_name in evaled_globals:
+            for global_name in evaled_globals[group_name]:
+                if expansions[global_name] and expansions[global_name] != 'outer':
+                    try:
+                        iter(evaled_globals[group_name][global_name])
+                    except Exception:
+                        expansions_to_write[group_name, global_name] = ''
+                        expansions[global_name] = ''
+                        expansion_types_changed = True
+
+        # Write the expansions, one write per file:
+        expansions_by_file = {}
+        if active_groups is None:
+            expansions_to_write = {}
+        for (group_name, global_name), expansion in sorted(expansions_to_write.items()):
+            filename = active_groups[group_name]
+            file_expansions = expansions_by_file.setdefault(filename, {})
+            file_expansions.setdefault(str(group_name), {})[str(global_name)] = expansion
+        for filename, file_expansions in expansions_by_file.items():
+            set_expansions(filename, file_expansions)
+
+        self.previous_evaled_globals = evaled_globals
+        self.previous_global_hierarchy = global_hierarchy
+        self.previous_expansion_types = expansion_types
+        self.previous_expansions = expansions
+
+        return expansion_types_changed
+
+
+def evaluate_globals_guessing_expansions(
+    active_groups, guesser, raise_exceptions=True, interrupt=None, sequence_globals=None
+):
+    """Read and evaluate the globals of active_groups, a dict {group_name:
+    globals_file}, guessing their expansion modes with guesser, an
+    ExpansionModeGuesser, and re-reading and re-evaluating them until the guessed
+    expansion modes no longer change. Guessed expansion modes are written to the
+    globals files. Returns sequence_globals, evaled_globals, global_hierarchy and
+    expansions, as returned by get_globals() and evaluate_globals(). If
+    raise_exceptions is True, an exception listing the globals that could not be
+    evaluated is raised if there were any. interrupt is passed to
+    evaluate_globals().
+
+    If sequence_globals is given, as returned by get_globals() and then modified,
+    for example by apply_global_overrides(), it is evaluated instead of the globals
+    files, which are not modified: the guessed expansion modes are applied to a copy
+    of it, which is returned, and active_groups is not used. guesser should then
+    have been primed with the unmodified globals, see ExpansionModeGuesser.prime(),
+    so that expansion modes are guessed from how they have been modified."""
+    while True:
+        if sequence_globals is None:
+            current_globals = get_globals(active_groups)
+        else:
+            current_globals = sequence_globals
+        evaled_globals, global_hierarchy, expansions = evaluate_globals(
+            current_globals, raise_exceptions=False, interrupt=interrupt
+        )
+        if sequence_globals is None:
+            changed = guesser.guess(
+                active_groups, evaled_globals, global_hierarchy, expansions
+            )
+        else:
+            changed = guesser.guess(None, evaled_globals, global_hierarchy, expansions)
+            sequence_globals = {
+                group_name: {
+                    global_name: (expression, units, expansions[global_name])
+                    for global_name, (expression, units, _) in group_globals.items()
+                }
+                for group_name, group_globals in sequence_globals.items()
+            }
+            current_globals = sequence_globals
+        if not changed:
+            break
+    if raise_exceptions:
+        errors = [
+            '%s: %s: %s' % (global_name, value.__class__.__name__, value)
+            for group_globals in evaled_globals.values()
+            for global_name, value in sorted(group_globals.items())
+            if isinstance(value, Exception)
+        ]
+        if errors:
+            raise Exception('Error evaluating globals:\n' + '\n'.join(errors))
+    return current_globals, evaled_globals, global_hierarchy, expansions
+
+
 def iterator_to_tuple(iterator, max_length=1000000):
     # We want to prevent infinite length tuples, but we cannot know
     # whether they are infinite or not in advance. So we'll convert to
@@ -371,7 +735,9 @@ def get_globals(groups):
     globals out of the groups in their files.  The globals are strings
     storing python expressions at this point. All these globals are
     packed into a new dictionary, keyed by group_name, where the values
-    are dictionaries which look like {global_name: (expression, units, expansion), ...}"""
+    are dictionaries which look like {global_name: (expression, units, expansion), ...}
+    Globals whose values are arrays stored as datasets have ArrayExpression objects as
+    their expressions."""
     # get a list of filepaths:
     filepaths = set(groups.values())
     sequence_globals = {}
@@ -384,6 +750,10 @@ def get_globals(groups):
                 values = dict(globals_group.attrs)
                 units = dict(globals_group['units'].attrs)
                 expansions = dict(globals_group['expansion'].attrs)
+                if 'arrays' in globals_group:
+                    arrays = globals_group['arrays']
+                else:
+                    arrays = {}
                 for global_name, value in values.items():
                     unit = units[global_name]
                     expansion = expansions[global_name]
@@ -392,11 +762,84 @@ def get_globals(groups):
                     value = _ensure_str(value)
                     unit = _ensure_str(unit)
                     expansion = _ensure_str(expansion)
+                    if global_name in arrays:
+                        value = ArrayExpression(arrays[global_name][()], value)
                     sequence_globals[group_name][global_name] = value, unit, expansion
     return sequence_globals
 
 
-def evaluate_globals(sequence_globals, raise_exceptions=True):
+def _override_expression(value, raw):
+    if raw:
+        if not isinstance(value, (str, bytes)):
+            msg = "override values must be strings if raw=True, not %s"
+            raise TypeError(msg % value.__class__.__name__)
+        return value
+    if isinstance(value, np.ndarray) and value.nbytes >= ARRAY_DATASET_THRESHOLD:
+        return ArrayExpression(value)
+    return repr(value)
+
+
+def apply_global_overrides(sequence_globals, overrides=None, scan=None, raw=False):
+    """Return a copy of sequence_globals, as returned by get_globals(), with the
+    expressions of some globals replaced, for compiling a sequence without modifying
+    the globals files. overrides is a dict {global_name: value} of globals to set to
+    new values, and scan is a dict {global_name: values} of globals to scan over, each
+    of which is given its own outer product axis. Values are converted to expressions
+    with repr() as in the remote set_globals(), unless raw=True in which case they must
+    already be expressions. All globals must already exist in exactly one group of
+    sequence_globals. The expansion of an overridden global is guessed from its new
+    value, unless it is zipped with other globals in which case it is left as is.
+    Expansions of other globals are not changed, so globals depending on a scanned
+    global are not zipped with it as they would be in the GUI. To guess them as the
+    GUI does, pass the result to evaluate_globals_guessing_expansions() as
+    sequence_globals, with an ExpansionModeGuesser primed with the globals before
+    overriding.
+
+    Returns (sequence_globals, override_expressions), where override_expressions is a
+    dict {global_name: expression} of all overridden and scanned globals, suitable for
+    recording in run files with make_run_files()."""
+    if overrides is None:
+        overrides = {}
+    if scan is None:
+        scan = {}
+    both = set(overrides) & set(scan)
+    if both:
+        msg = 'Globals cannot be both overridden and scanned: %s'
+        raise ValueError(msg % ', '.join(sorted(both)))
+    sequence_globals = {
+        group_name: group_globals.copy()
+        for group_name, group_globals in sequence_globals.items()
+    }
+    override_expressions = {}
+    for global_name, value in list(overrides.items()) + list(scan.items()):
+        groups_with_global = [
+            group_name
+            for group_name, group_globals in sequence_globals.items()
+            if global_name in group_globals
+        ]
+        if not groups_with_global:
+            raise ValueError('Global %s not found in any active group' % global_name)
+        elif len(groups_with_global) > 1:
+            msg = 'Cannot override global %s, it is defined in multiple active groups: '
+            msg += '%s and %s'
+            raise ValueError(msg % ((global_name,) + tuple(groups_with_global[:2])))
+        group_name = groups_with_global[0]
+        _, units, expansion = sequence_globals[group_name][global_name]
+        if global_name in scan:
+            if not raw and not isinstance(value, np.ndarray):
+                value = list(value)
+            expression = _override_expression(value, raw)
+            expansion = 'outer'
+        else:
+            expression = _override_expression(value, raw)
+            if not raw and expansion in ('', 'outer'):
+                expansion = guess_expansion_type(value)
+        sequence_globals[group_name][global_name] = expression, units, expansion
+        override_expressions[global_name] = expression
+    return sequence_globals, override_expressions
+
+
+def evaluate_globals(sequence_globals, raise_exceptions=True, interrupt=None):
     """Takes a dictionary of globals as returned by get_globals. These
     globals are unevaluated strings.  Evaluates them all in the same
     namespace so that the expressions can refer to each other. Iterates
@@ -405,7 +848,10 @@ def evaluate_globals(sequence_globals, raise_exceptions=True):
     going away. The exception contains the messages of all exceptions
     which failed to be resolved. If raise_exceptions is False, any
     evaluations resulting in an exception will instead return the
-    exception object in the results dictionary"""
+    exception object in the results dictionary. If interrupt is given, it
+    is called with no arguments before evaluating each global, and if it
+    returns True, evaluation is abandoned by raising EvaluationInterrupted,
+    regardless of raise_exceptions"""
 
     # Flatten all the groups into one dictionary of {global_name:
     # expression} pairs. Also create the group structure of the results
@@ -455,11 +901,16 @@ def evaluate_globals(sequence_globals, raise_exceptions=True):
     while globals_to_eval:
         errors = []
         for global_name, expression in globals_to_eval.copy().items():
+            if interrupt is not None and interrupt():
+                raise EvaluationInterrupted()
             # start the trace to determine which globals this global depends on
             sandbox.start_trace()
             try:
-                code = compile(expression, '<string>', 'eval')
-                value = eval(code, sandbox)
+                if isinstance(expression, ArrayExpression):
+                    value = expression.value
+                else:
+                    code = compile(expression, '<string>', 'eval')
+                    value = eval(code, sandbox)
                 # Need to know the length of any generators, convert to tuple:
                 if isinstance(value, types.GeneratorType):
                     value = iterator_to_tuple(value)
@@ -518,23 +969,11 @@ def evaluate_globals(sequence_globals, raise_exceptions=True):
     return results, global_hierarchy, expansions
 
 
-def expand_globals(sequence_globals, evaled_globals, expansion_config = None, return_dimensions = False):
-    """Expands iterable globals according to their expansion
-    settings. Creates a number of 'axes' which are to be outer product'ed
-    together. Some of these axes have only one element, these are globals
-    that do not vary. Some have a set of globals being zipped together,
-    iterating in lock-step. Others contain a single global varying
-    across its values (the globals set to 'outer' expansion). Returns
-    a list of shots, each element of which is a dictionary for that
-    shot's globals."""
-
-    if expansion_config is None:
-        order = {}
-        shuffle = {}
-    else:
-        order = {k:v['order'] for k,v in expansion_config.items() if 'order' in v}
-        shuffle = {k:v['shuffle'] for k,v in expansion_config.items() if 'shuffle' in v}
-
+def _get_axes(sequence_globals, evaled_globals):
+    """Return the axes to be outer product'ed together to produce shots, as a dict
+    {axis_name: axis}, along with dicts {axis_name: global_names} and {axis_name:
+    dimension} of the globals on each axis and the length of each axis. Each axis is a
+    list of tuples of values of the globals on that axis."""
     values = {}
     expansions = {}
     for group_name in sequence_globals:
@@ -589,6 +1028,28 @@ def expand_globals(sequence_globals, evaled_globals, expansion_config = None, re
             axes['outer '+global_name] = axis
             global_names['outer '+global_name] = [global_name]
 
+    return axes, global_names, dimensions
+
+
+def expand_globals(sequence_globals, evaled_globals, expansion_config = None, return_dimensions = False):
+    """Expands iterable globals according to their expansion
+    settings. Creates a number of 'axes' which are to be outer product'ed
+    together. Some of these axes have only one element, these are globals
+    that do not vary. Some have a set of globals being zipped together,
+    iterating in lock-step. Others contain a single global varying
+    across its values (the globals set to 'outer' expansion). Returns
+    a list of shots, each element of which is a dictionary for that
+    shot's globals."""
+
+    if expansion_config is None:
+        order = {}
+        shuffle = {}
+    else:
+        order = {k:v['order'] for k,v in expansion_config.items() if 'order' in v}
+        shuffle = {k:v['shuffle'] for k,v in expansion_config.items() if 'shuffle' in v}
+
+    axes, global_names, dimensions = _get_axes(sequence_globals, evaled_globals)
+
     # add any missing items to order and dimensions
     for key, value in axes.items():
         if key not in order:
@@ -603,9 +1064,10 @@ def expand_globals(sequence_globals, evaled_globals, expansion_config = None, re
         if shuffle[axis_name]:
             random.shuffle(axis_values)
 
-    # sort axes and global names by order
-    axes = [axes.get(key) for key in sorted(order, key=order.get)]
-    global_names = [global_names.get(key) for key in sorted(order, key=order.get)]
+    # sort axes and global names by order. Ignore ordering of axes that do not exist:
+    axes_order = sorted(axes, key=order.get)
+    axes = [axes[key] for key in axes_order]
+    global_names = [global_names[key] for key in axes_order]
 
     # flatten the global names
     global_names = [global_name for global_list in global_names for global_name in global_list]
@@ -625,6 +1087,69 @@ def expand_globals(sequence_globals, evaled_globals, expansion_config = None, re
     else:
         return shots
 
+def evaluate_proposed_globals(sequence_globals, proposed_globals, raw=False):
+    """Evaluate what the sequence would be if the globals in proposed_globals, a dict
+    {global_name: value}, were set to the given values, without modifying anything.
+    sequence_globals is as returned by get_globals(), and values are converted to
+    expressions as in apply_global_overrides(), so that proposing a list for a global
+    that is not zipped with others makes it an outer product axis. proposed_globals may
+    also be a list of such dicts, in which case each is evaluated separately against
+    the same sequence_globals and a list of results is returned.
+
+    The result for each proposal is a dict with keys 'n_shots', the number of shots
+    the sequence would have, 'dimensions', a dict {axis_name: length} of the expansion
+    axes, and 'errors', a dict {global_name: message} of globals that failed to
+    evaluate. Globals with errors are excluded from n_shots and dimensions, as they are
+    in the GUI. Expansion modes are guessed as the GUI would guess them if the proposed
+    values were set in the globals files, see evaluate_globals_guessing_expansions()."""
+    if isinstance(proposed_globals, dict):
+        return evaluate_proposed_globals(sequence_globals, [proposed_globals], raw)[0]
+    expansion_mode_guesser = ExpansionModeGuesser()
+    expansion_mode_guesser.prime(sequence_globals)
+    # Which groups each global is defined in, to check proposals for unknown and
+    # multiply defined globals rather than raising exceptions for them:
+    global_groups = {}
+    for group_name, group_globals in sequence_globals.items():
+        for global_name in group_globals:
+            global_groups.setdefault(global_name, []).append(group_name)
+    results = []
+    for proposal in proposed_globals:
+        errors = {}
+        for global_name in proposal:
+            groups = global_groups.get(global_name, [])
+            if not groups:
+                errors[global_name] = 'not found in any active group'
+            elif len(groups) > 1:
+                errors[global_name] = 'defined in multiple active groups: %s' % (
+                    ', '.join(groups)
+                )
+        valid_proposal = {k: v for k, v in proposal.items() if k not in errors}
+        proposed_sequence_globals, _ = apply_global_overrides(
+            sequence_globals, valid_proposal, raw=raw
+        )
+        (
+            proposed_sequence_globals,
+            evaled_globals,
+            _,
+            _,
+        ) = evaluate_globals_guessing_expansions(
+            None,
+            expansion_mode_guesser.copy(),
+            raise_exceptions=False,
+            sequence_globals=proposed_sequence_globals,
+        )
+        for group_globals in evaled_globals.values():
+            for global_name, value in group_globals.items():
+                if isinstance(value, Exception):
+                    errors[global_name] = '%s: %s' % (value.__class__.__name__, value)
+        _, _, dimensions = _get_axes(proposed_sequence_globals, evaled_globals)
+        n_shots = 1
+        for dimension in dimensions.values():
+            n_shots *= dimension
+        results.append({'n_shots': n_shots, 'dimensions': dimensions, 'errors': errors})
+    return results
+
+
 def next_sequence_index(shot_basedir, dt, increment=True):
     """Return the next sequence index for sequences in the given base directory (i.e.
     <experiment_shot_storage>/<script_basename>) and the date of the given datetime
@@ -636,7 +1161,7 @@ def next_sequence_index(shot_basedir, dt, increment=True):
 
     DATE_FORMAT = '%Y-%m-%d'
     # The file where we store the next sequence index on disk:
-    sequence_index_file = os.path.join(shot_basedir, '.next_sequence_index')
+    sequence_index_file = os.path.join(shot_basedir, SEQUENCE_INDEX_FILENAME)
     # Open with zlock to prevent race conditions with other code:
     with Lock(path_to_agnostic(sequence_index_file), read_only=not increment):
         try:
@@ -658,6 +1183,38 @@ def next_sequence_index(shot_basedir, dt, increment=True):
         return sequence_index
 
 
+def _split_shard_format(subdir_format):
+    """Split an output_folder_format at the first path component containing a
+    {shard} field. Returns the format of the sequence's folder, and the format of
+    the shard subfolders within it, or None if there is no {shard} field. The format
+    of the sequence's folder is '' if the first component contains {shard}."""
+    components = subdir_format.replace('\\', '/').split('/')
+    for i, component in enumerate(components):
+        field_names = [field[1] for field in string.Formatter().parse(component)]
+        if 'shard' in field_names:
+            return os.path.join('', *components[:i]), os.path.join(*components[i:])
+    return subdir_format, None
+
+
+def _format_except_shard(format_string, **kwargs):
+    """Format format_string with kwargs, leaving any {shard} fields unformatted"""
+    result = []
+    for literal, field_name, spec, conversion in string.Formatter().parse(format_string):
+        result.append(literal.replace('{', '{{').replace('}', '}}'))
+        if field_name is None:
+            continue
+        field = '{' + field_name
+        if conversion:
+            field += '!' + conversion
+        if spec:
+            field += ':' + spec
+        field += '}'
+        if field_name != 'shard':
+            field = field.format(**kwargs).replace('{', '{{').replace('}', '}}')
+        result.append(field)
+    return ''.join(result)
+
+
 def new_sequence_details(script_path, config=None, increment_sequence_index=True):
     """Generate the details for a new sequence: the toplevel attrs sequence_date,
     sequence_index, sequence_id; and the the output directory and filename prefix for
@@ -667,7 +1224,18 @@ def new_sequence_details(script_path, config=None, increment_sequence_index=True
     about to be used to compile a sequence. Otherwise, set increment_sequence_index to
     False, but in that case the results are indicative only and one should call this
     function again with increment_sequence_index=True before compiling the sequence, as
-    otherwise the sequence_index may be used by other code in the meantime."""
+    otherwise the sequence_index may be used by other code in the meantime.
+
+    If the output_folder_format labconfig setting contains a {shard} field, run files
+    are to be split between subfolders of the output directory, with shard_size
+    (from labconfig, default DEFAULT_SHARD_SIZE) run files in each, {shard} being
+    run number // shard_size. The path from the first component of
+    output_folder_format containing {shard} then gives the format of the
+    subfolders, which is saved as sequence_attrs['shard_folder_format'] along with
+    sequence_attrs['shard_size'], for use by make_run_files(). The returned output
+    directory is the folder containing the shard subfolders, which is
+    <experiment_shot_storage>/<script_basename> itself if the first component of
+    output_folder_format contains {shard}."""
     if config is None:
         config = LabConfig()
     script_basename = os.path.splitext(os.path.basename(script_path))[0]
@@ -694,12 +1262,28 @@ def new_sequence_details(script_path, config=None, increment_sequence_index=True
     except (LabConfig.NoOptionError, LabConfig.NoSectionError):
         subdir_format = os.path.join('%Y', '%m', '%d', '{sequence_index:05d}')
 
+    subdir_format, shard_format = _split_shard_format(subdir_format)
+
     # Format the output directory according to the current timestamp, sequence index and
     # sequence_timestamp, if present in the format string:
     subdir = now.strftime(subdir_format).format(
         sequence_index=sequence_index, sequence_timestamp=sequence_timestamp
     )
-    shot_output_dir = os.path.join(shot_basedir, subdir)
+    if subdir:
+        shot_output_dir = os.path.join(shot_basedir, subdir)
+    else:
+        shot_output_dir = shot_basedir
+
+    if shard_format is not None:
+        sequence_attrs['shard_folder_format'] = _format_except_shard(
+            now.strftime(shard_format),
+            sequence_index=sequence_index,
+            sequence_timestamp=sequence_timestamp,
+        )
+        try:
+            sequence_attrs['shard_size'] = config.getint('runmanager', 'shard_size')
+        except (LabConfig.NoOptionError, LabConfig.NoSectionError):
+            sequence_attrs['shard_size'] = DEFAULT_SHARD_SIZE
 
     # Compute the shot filename prefix according to labconfig settings:
     try:
@@ -725,6 +1309,11 @@ def make_run_files(
     sequence_attrs,
     filename_prefix,
     shuffle=False,
+    overrides=None,
+    manifest=False,
+    sidecar=False,
+    compression=None,
+    private=False,
 ):
     """Does what it says. sequence_globals and shots are of the datatypes returned by
     get_globals and get_shots, one is a nested dictionary with string values, and the
@@ -743,43 +1332,269 @@ def make_run_files(
     the event of failed compilation of labscripts. If you want all the run files to be
     created at some point, simply convert the returned generator to a list. The
     filenames the run files are given is simply the sequence_id with increasing integers
-    appended."""
+    appended. If sequence_attrs has 'shard_folder_format' and 'shard_size' items, as
+    set by new_sequence_details() if output_folder_format contains a {shard} field,
+    the run files are created in subfolders of output_folder accordingly, whereas
+    the manifest and sidecar files are created in output_folder itself. overrides,
+    if given, is a dict {global_name: expression} of globals overridden for this
+    sequence only, as returned by apply_global_overrides(), to be recorded in the run
+    files. If manifest is True, a manifest of the sequence is written before the first
+    run file, see write_sequence_manifest(). If sidecar is True, the globals groups,
+    which are the same for every run file in the sequence, are written once to a
+    sidecar file, see make_sequence_globals_sidecar(), and the run files contain
+    external links to them instead of copies. Run files made this way must be kept in
+    the same place relative to the sidecar file for the links to resolve, though the
+    evaluated globals of each run are saved in the run file as usual and can be read
+    regardless. compression is passed to make_single_run_file(). If private is True,
+    the files are created as per new_private_h5_file()."""
     basename = os.path.join(output_folder, filename_prefix)
     nruns = len(shots)
     ndigits = int(np.ceil(np.log10(nruns)))
+    shot_order = list(range(nruns))
     if shuffle:
-        random.shuffle(shots)
-    for i, shot_globals in enumerate(shots):
-        runfilename = ('%s_%0' + str(ndigits) + 'd.h5') % (basename, i)
+        random.shuffle(shot_order)
+        shots[:] = [shots[j] for j in shot_order]
+    runfilenames = []
+    for i in range(nruns):
+        runfilename = ('%s_%0' + str(ndigits) + 'd.h5') % (filename_prefix, i)
+        if 'shard_folder_format' in sequence_attrs:
+            shard = i // sequence_attrs['shard_size']
+            shard_folder = sequence_attrs['shard_folder_format'].format(shard=shard)
+            runfilename = os.path.join(shard_folder, runfilename)
+        runfilenames.append(os.path.join(output_folder, runfilename))
+    if manifest:
+        write_sequence_manifest(
+            basename + MANIFEST_SUFFIX,
+            sequence_globals,
+            shots,
+            sequence_attrs,
+            runfilenames,
+            shot_order,
+            private=private,
+        )
+    if sidecar and sequence_globals is not None:
+        sidecar_filename = basename + SIDECAR_SUFFIX
+        make_sequence_globals_sidecar(sidecar_filename, sequence_globals, private=private)
+    else:
+        sidecar_filename = None
+    for i, (runfilename, shot_globals) in enumerate(zip(runfilenames, shots)):
         make_single_run_file(
-            runfilename, sequence_globals, shot_globals, sequence_attrs, i, nruns
+            runfilename,
+            sequence_globals,
+            shot_globals,
+            sequence_attrs,
+            i,
+            nruns,
+            overrides=overrides,
+            sidecar=sidecar_filename,
+            compression=compression,
+            private=private,
         )
         yield runfilename
 
 
-def make_single_run_file(filename, sequenceglobals, runglobals, sequence_attrs, run_no, n_runs):
+def _manifest_column(values):
+    """Return the values of a global for each run as an array that can be saved as an
+    HDF5 dataset. Strings are saved as variable length strings, and values that can't
+    be made into a regular array, such as lists of different lengths or None, as their
+    reprs."""
+    try:
+        column = np.array(values)
+    except ValueError:
+        # Ragged sequences:
+        column = None
+    if column is not None and column.dtype.kind == 'U':
+        return column.astype(h5py.string_dtype())
+    if column is None or column.dtype.kind == 'O':
+        return np.array([repr(value) for value in values], dtype=h5py.string_dtype())
+    return column
+
+
+@contextlib.contextmanager
+def new_private_h5_file(filename):
+    """Context manager to create a new HDF5 file, yielding the open h5py File. The file
+    is written under a temporary name unique to this process, and once it is closed,
+    atomically renamed to filename, replacing any existing file. Other processes
+    therefore never see a partially written file. If an exception is raised, the
+    temporary file is deleted and filename is untouched. No zlock is taken, since no
+    other process knows the temporary name, so this is only safe for files that no
+    other process opens before the rename. Any that have filename open at the time
+    keep reading the replaced file."""
+    temp_filename = '%s.%d.tmp' % (filename, os.getpid())
+    try:
+        # h5_lock's File does not take a zlock when given a file id rather than a name:
+        file_id = h5py.h5f.create(temp_filename.encode(), h5py.h5f.ACC_TRUNC)
+        with h5py.File(file_id) as f:
+            yield f
+        os.replace(temp_filename, filename)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_filename)
+        raise
+
+
+def new_h5_file(filename, private=False):
+    """Context manager to create a new HDF5 file, with new_private_h5_file() if
+    private is True, otherwise simply with h5py.File"""
+    if private:
+        return new_private_h5_file(filename)
+    return h5py.File(filename, 'w')
+
+
+def write_sequence_manifest(
+    filename, sequence_globals, shots, sequence_attrs, run_files, shot_order, private=False
+):
+    """Write a manifest of a sequence to an HDF5 file, so that the parameters of a whole
+    sequence can be loaded without opening every run file. The top-level attrs are
+    sequence_attrs and n_runs. The 'run_files' dataset has the path of each run file
+    relative to the manifest, with '/' separators, in order of run number, which is
+    just its basename unless the run files are in shard subfolders, and 'shot_order'
+    the index of each run in shots before shuffling. The 'globals' group has a
+    dataset for each global that is not the same in all runs, with its value in each
+    run, and attrs 'units' and 'expansion'. shots must be in order of run number,
+    with shot_order the permutation applied to them by shuffling, if any. Use
+    load_sequence_manifest() to read the manifest. sequence_globals may be None, in
+    which case units and expansions are not saved. If private is True, the file is
+    created as per new_private_h5_file()."""
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    units = {}
+    expansions = {}
+    if sequence_globals is not None:
+        for groupvars in sequence_globals.values():
+            for name, (_, global_units, expansion) in groupvars.items():
+                units[name] = global_units
+                expansions[name] = expansion
+    with new_h5_file(filename, private) as f:
+        f.attrs.update(sequence_attrs)
+        f.attrs['n_runs'] = len(shots)
+        f.create_dataset(
+            'run_files',
+            data=[
+                os.path.relpath(run_file, os.path.dirname(filename)).replace(os.sep, '/')
+                for run_file in run_files
+            ],
+            dtype=h5py.string_dtype(),
+        )
+        f.create_dataset('shot_order', data=np.array(shot_order, dtype=int))
+        globals_group = f.create_group('globals')
+        if not shots:
+            return
+        for name in shots[0]:
+            column = _manifest_column([shot_globals[name] for shot_globals in shots])
+            if len(column) < 2 or (column == column[0]).all():
+                continue
+            dataset = globals_group.create_dataset(name, data=column)
+            dataset.attrs['units'] = units.get(name, '')
+            dataset.attrs['expansion'] = expansions.get(name, '')
+
+
+def load_sequence_manifest(filename):
+    """Load a sequence manifest written by write_sequence_manifest(). Returns a pandas
+    DataFrame indexed by run number, with a 'run_file' column for the full path of
+    each run file, a 'shot_order' column, and a column for each global that varies
+    within the sequence. The top-level attrs of the manifest are in the DataFrame's
+    attrs."""
+    import pandas as pd
+    folder = os.path.dirname(filename)
+    with h5py.File(filename, 'r') as f:
+        attrs = dict(f.attrs)
+        data = {
+            'run_file': [
+                os.path.join(folder, *_ensure_str(name).split('/'))
+                for name in f['run_files'][:]
+            ],
+            'shot_order': f['shot_order'][:],
+        }
+        for name, dataset in f['globals'].items():
+            column = dataset[:]
+            if column.ndim > 1:
+                # Array-valued global, one array per row:
+                column = list(column)
+            elif h5py.check_string_dtype(dataset.dtype) is not None:
+                column = [_ensure_str(value) for value in column]
+            data[name] = column
+    df = pd.DataFrame(data)
+    df.index.name = 'run number'
+    df.attrs.update(attrs)
+    return df
+
+
+def _write_globals_groups(globals_group, sequenceglobals):
+    """Write the globals groups of sequenceglobals, a nested dictionary of the type
+    returned by get_globals, as subgroups of the h5py group globals_group, in the
+    same format as a globals file"""
+    for groupname, groupvars in sequenceglobals.items():
+        group = globals_group.create_group(groupname)
+        unitsgroup = group.create_group('units')
+        expansiongroup = group.create_group('expansion')
+        for name, (value, units, expansion) in groupvars.items():
+            if isinstance(value, ArrayExpression):
+                arrays = group.require_group('arrays')
+                arrays.create_dataset(name, data=value.value)
+                value = str(value)
+            group.attrs[name] = value
+            unitsgroup.attrs[name] = units
+            expansiongroup.attrs[name] = expansion
+
+
+def make_sequence_globals_sidecar(filename, sequenceglobals, private=False):
+    """Write the globals groups of sequenceglobals, a nested dictionary of the type
+    returned by get_globals, to a sidecar file for a sequence, to be linked to from
+    each of its run files by make_single_run_file(). If private is True, the file is
+    created as per new_private_h5_file()."""
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with new_h5_file(filename, private) as f:
+        _write_globals_groups(f.create_group('globals'), sequenceglobals)
+
+
+def make_single_run_file(
+    filename,
+    sequenceglobals,
+    runglobals,
+    sequence_attrs,
+    run_no,
+    n_runs,
+    overrides=None,
+    sidecar=None,
+    compression=None,
+    private=False,
+):
     """Does what it says. runglobals is a dict of this run's globals, the format being
     the same as that of one element of the list returned by expand_globals.
     sequence_globals is a nested dictionary of the type returned by get_globals.
     sequence_attrs is a dict of attributes pertaining to this sequence, as returned by
     new_sequence_details. run_no and n_runs must be provided, if this run file is part
     of a sequence, then they should reflect how many run files are being generated in
-    this sequence, all of which must have identical sequence_attrs."""
+    this sequence, all of which must have identical sequence_attrs. overrides, if given,
+    is a dict {global_name: expression} of globals overridden for this sequence only,
+    which is saved as the attributes of a top-level 'globals_overrides' group. If
+    sidecar is given, it is the filename of a file written by
+    make_sequence_globals_sidecar() for sequenceglobals, and the globals groups are
+    saved as external links to the groups in it rather than being written out in
+    full. Numeric array globals too large to be saved as attributes are saved as
+    datasets instead, see load_global_datasets(). These are contiguous so that they can be
+    memory-mapped when read, unless compression is given, such as 'gzip' or 'lzf', in
+    which case they are chunked and compressed with it. If private is True, the file
+    is created as per new_private_h5_file()."""
     os.makedirs(os.path.dirname(filename), exist_ok=True)
-    with h5py.File(filename, 'w') as f:
+    with new_h5_file(filename, private) as f:
         f.attrs.update(sequence_attrs)
         f.attrs['run number'] = run_no
         f.attrs['n_runs'] = n_runs
-        f.create_group('globals')
-        if sequenceglobals is not None:
-            for groupname, groupvars in sequenceglobals.items():
-                group = f['globals'].create_group(groupname)
-                unitsgroup = group.create_group('units')
-                expansiongroup = group.create_group('expansion')
-                for name, (value, units, expansion) in groupvars.items():
-                    group.attrs[name] = value
-                    unitsgroup.attrs[name] = units
-                    expansiongroup.attrs[name] = expansion
+        globals_group = f.create_group('globals')
+        if sequenceglobals is not None and sidecar is not None:
+            # Link relative to the run file, so the sequence's folder can be moved:
+            sidecar = os.path.relpath(sidecar, os.path.dirname(filename))
+            for groupname in sequenceglobals:
+                globals_group[groupname] = h5py.ExternalLink(
+                    sidecar, '/globals/' + groupname
+                )
+        elif sequenceglobals is not None:
+            _write_globals_groups(globals_group, sequenceglobals)
+        if overrides:
+            overrides_group = f.create_group('globals_overrides')
+            for name, expression in overrides.items():
+                overrides_group.attrs[name] = str(expression)
         for name, value in runglobals.items():
             if value is None:
                 # Store it as a null object reference:
@@ -787,6 +1602,18 @@ def make_single_run_file(filename, sequenceglobals, runglobals, sequence_attrs,
             try:
                 f['globals'].attrs[name] = value
             except Exception as e:
+                if isinstance(value, np.ndarray) and value.dtype.kind in 'biufc':
+                    # Too large for an attribute. Save it as a dataset, and store a
+                    # reference to the dataset in its place:
+                    datasets_group = f.require_group(GLOBAL_DATASETS_GROUP)
+                    if compression is not None:
+                        dataset = datasets_group.create_dataset(
+                            name, data=value, chunks=True, compression=compression
+                        )
+                    else:
+                        dataset = datasets_group.create_dataset(name, data=value)
+                    f['globals'].attrs[name] = dataset.ref
+                    continue
                 message = ('Global %s cannot be saved as an hdf5 attribute. ' % name +
                            'Globals can only have relatively simple datatypes, with no nested structures. ' +
                            'Original error was:\n' +
@@ -944,19 +1771,63 @@ def compile_labscript_with_globals_files_async(labscript_file, globals_files, ou
         t.start()
 
 
-def get_shot_globals(filepath):
+def get_shot_globals(filepath, mmap=False):
     """Returns the evaluated globals for a shot, for use by labscript or lyse.
     Simple dictionary access as in dict(h5py.File(filepath).attrs) would be fine
     except we want to apply some hacks, so it's best to do that in one place.
-    
-    Deprecated: use identical function `labscript_utils.shot_utils.get_shot_globals`
+
+    Deprecated: use `labscript_utils.shot_utils.get_shot_globals`, or
+    load_shot_globals() for run files that may have globals saved as datasets.
     """
     
     warnings.warn(
         FutureWarning("get_shot_globals has moved to labscript_utils.shot_utils. "
                       "Please update your code to import it from there."))
 
-    return labscript_utils.shot_utils.get_shot_globals(filepath)
+    return load_shot_globals(filepath, mmap=mmap)
+
+
+def load_shot_globals(filepath, mmap=False):
+    """Return the evaluated globals of the run file filepath, as
+    labscript_utils.shot_utils.get_shot_globals() does, except that globals too large
+    to have been saved as attributes, which were saved as datasets, have their arrays
+    as values rather than object references to the datasets. See
+    load_global_datasets() for the meaning of mmap."""
+    shot_globals = labscript_utils.shot_utils.get_shot_globals(filepath)
+    return load_global_datasets(filepath, shot_globals, mmap=mmap)
+
+
+def load_global_datasets(filepath, shot_globals, mmap=False):
+    """Replace the object references in shot_globals, as returned by
+    labscript_utils.shot_utils.get_shot_globals() for the run file filepath, to the
+    datasets of globals too large to be saved as attributes, with their arrays. If
+    mmap is True, uncompressed datasets are memory-mapped read-only rather than read
+    into memory; the memory maps are only valid for as long as the file is not
+    modified or replaced. Returns a new dict."""
+    shot_globals = dict(shot_globals)
+    references = {
+        name: value
+        for name, value in shot_globals.items()
+        if isinstance(value, h5py.Reference) and value
+    }
+    if not references:
+        return shot_globals
+    with h5py.File(filepath, 'r') as f:
+        for name, reference in references.items():
+            dataset = f[reference]
+            offset = dataset.id.get_offset()
+            if mmap and offset is not None and dataset.chunks is None:
+                value = np.memmap(
+                    filepath,
+                    dtype=dataset.dtype,
+                    mode='r',
+                    offset=offset,
+                    shape=dataset.shape,
+                )
+            else:
+                value = dataset[()]
+            shot_globals[name] = value
+    return shot_globals
 
 
 def dict_diff(dict1, dict2):
@@ -33,9 +33,12 @@ import time
 import contextlib
 import subprocess
 import threading
+import types
 import logging
 import ast
+import collections
 import pprint
+import reprlib
 import traceback
 import signal
 from pathlib import Path
@@ -47,26 +50,29 @@ splash.update_text('importing matplotlib')
 # GUI integration:
 import matplotlib
 matplotlib.use('Agg')
+import numpy as np
 
 from qtutils.qt import QtCore, QtGui, QtWidgets, QT_ENV
 from qtutils.qt.QtCore import pyqtSignal as Signal
 PYQT_VERSION_STR = importlib.metadata.version(QT_ENV)
 
 splash.update_text('importing labscript suite modules')
-from labscript_utils.ls_zprocess import zmq_get, ProcessTree, ZMQServer
+from labscript_utils.ls_zprocess import zmq_get, ProcessTree, Context
 from labscript_utils.labconfig import LabConfig, save_appconfig, load_appconfig
 from labscript_utils.setup_logging import setup_logging
 import labscript_utils.shared_drive as shared_drive
 from labscript_utils import dedent
 from zprocess import raise_exception_in_thread
+import zmq
 import runmanager
 import runmanager.remote
+from runmanager.staging import RunFileMover
+from runmanager.output_folder import DefaultOutputFolder
 
 from qtutils import (
     inmain,
     inmain_decorator,
     UiLoader,
-    inthread,
     DisconnectContextManager,
     qtlock,
 )
@@ -83,25 +89,6 @@ process_tree = ProcessTree.instance()
 process_tree.zlock_client.set_process_name('runmanager')
 
 
-def log_if_global(g, g_list, message):
-    """logs a message if the global name "g" is in "g_list"
-    
-    useful if you want to print out a message inside a loop over globals,
-    but only for a particular global (or set of globals).
-    
-    If g_list is empty, then it will use the hardcoded list below
-    (useful if you want to change the behaviour globally)    
-    """
-    if not isinstance(g_list, list):
-        g_list = [g_list]
-        
-    if not g_list:
-        g_list = [] # add global options here
-    
-    if g in g_list:
-        logger.info(message)  # uses global `logger` instance defined in __main__ script section
-
-
 def composite_colors(r0, g0, b0, a0, r1, g1, b1, a1):
     """composite a second colour over a first with given alpha values and return the
     result"""
@@ -136,14 +123,50 @@ def nested(*contextmanagers):
         yield
 
 
-def scroll_view_to_row_if_current(view, item):
-    """Checks to see if the item is in the row of the current item. If it is, scrolls
+class _ValueRepr(reprlib.Repr):
+    """reprlib.Repr that also abbreviates numpy arrays, and is otherwise generous
+    enough with its limits to show most values in full"""
+
+    def __init__(self):
+        reprlib.Repr.__init__(self)
+        self.maxlevel = 3
+        self.maxtuple = self.maxlist = self.maxarray = 50
+        self.maxdict = self.maxset = self.maxfrozenset = self.maxdeque = 50
+        self.maxstring = self.maxlong = self.maxother = 200
+
+    def repr_ndarray(self, x, level):
+        with np.printoptions(threshold=self.maxlist, edgeitems=3):
+            return repr(x)
+
+    def repr_instance(self, x, level):
+        # Don't abbreviate the middle of unknown objects as reprlib would, it is
+        # less confusing to cut them short at the end if they are too long:
+        return repr(x)
+
+
+_value_repr = _ValueRepr()
+
+
+def format_value(value, max_length):
+    """Return a repr of value for display, abbreviating large containers and arrays
+    and truncating the result to at most max_length characters. Unlike repr(), the
+    cost of this does not scale with the size of the value."""
+    try:
+        text = _value_repr.repr(value)
+    except Exception as e:
+        text = '<repr failed: %s: %s>' % (e.__class__.__name__, str(e))
+    if len(text) > max_length:
+        text = text[:max_length - 3] + '...'
+    return text
+
+
+def scroll_view_to_row_if_current(view, index):
+    """Checks to see if the index is in the row of the current index. If it is, scrolls
     the treeview/tableview vertically to ensure that row is visible. This is done by
     recording the horizontal scroll position, then using view.scrollTo(), and then
     restoring the horizontal position"""
     horizontal_scrollbar = view.horizontalScrollBar()
     existing_horizontal_position = horizontal_scrollbar.value()
-    index = item.index()
     current_row = view.currentIndex().row()
     if index.row() == current_row:
         view.scrollTo(index)
@@ -424,8 +447,8 @@ class ItemView(object):
 
     def keyPressEvent(self, event):
         if event.key() in [QtCore.Qt.Key_Space, QtCore.Qt.Key_Enter, QtCore.Qt.Key_Return]:
-            item = self.model().itemFromIndex(self.currentIndex())
-            if item.isEditable():
+            flags = self.model().flags(self.currentIndex())
+            if flags & QtCore.Qt.ItemIsEditable:
                 # Space/enter edits editable items:
                 self.edit(self.currentIndex())
             else:
@@ -487,16 +510,366 @@ class TableView(ItemView, QtWidgets.QTableView):
             self.resizeRowToContents(row)
 
 
-class AlternatingColorModel(QtGui.QStandardItemModel):
+class GlobalsModel(QtCore.QAbstractTableModel):
+    """Table model for the globals of a GroupTab. The names, expressions, units and
+    expansions of the globals, as well as the results of parsing them, are stored in
+    flat lists, one element per global, and all other data is computed on demand when
+    requested by the view. An extra 'dummy' row at the end, which is always sorted
+    last, is for the user to add new globals.
+
+    Edits by the user do not modify the model directly, instead the edited signal is
+    emitted with the row, column and new text, and it is up to the GroupTab to write
+    the change to the globals file and then update the model with the set_* methods.
+
+    Background colours are modified for every second row, according to the palette of
+    the view. This has the effect of making the alternate colours visible even when
+    custom colors are used - the same shading will be applied to the custom colours.
+    Selection highlight colour (using RunmanagerColors().COLOR_HIGHLIGHT) is also
+    applied as part of the background colour."""
+
+    COL_DELETE = 0
+    COL_NAME = 1
+    COL_VALUE = 2
+    COL_UNITS = 3
+    COL_EXPANSION = 4
+
+    ROLE_IS_DUMMY_ROW = QtCore.Qt.UserRole + 1
+    ROLE_IS_BOOL = QtCore.Qt.UserRole + 4
+
+    # Parse state of each global, determining the icon, colour and tooltip of its
+    # value. The tooltip of a successfully evaluated global is formatted from the
+    # evaluated value only when it is first requested by the view:
+    PARSE_PENDING = 0
+    PARSE_CHANGED = 1
+    PARSE_OK = 2
+    PARSE_ERROR = 3
+    PARSE_INACTIVE = 4
+
+    DUMMY_ROW_TEXT = '<Click to add global>'
+    TOOLTIP_MAX_LENGTH = 1000
+    HEADER_LABELS = ['Delete', 'Name', 'Value', 'Units', 'Expansion']
+
+    edited = Signal(int, int, str)
 
     def __init__(self, view):
-        QtGui.QStandardItemModel.__init__(self)
-        # How much darker in each channel is the alternate base color compared
-        # to the base color?
+        QtCore.QAbstractTableModel.__init__(self)
         self.view = view
+        self.names = []
+        self.values = []
+        self.units = []
+        self.expansions = []
+        self.parse_states = []
+        # Evaluated values (or the exceptions raised evaluating them), and value
+        # tooltips formatted from them, or None if not yet formatted:
+        self.evaluated = []
+        self.tooltips = []
+        # {global_name: row}, kept up to date with the above:
+        self.rows = {}
 
         # A cache, store brushes so we don't have to recalculate them. Is faster.
         self.bg_brushes = {}
+        self.font = QtGui.QFont(GLOBAL_MONOSPACE_FONT)
+        self.icons = {
+            'delete': QtGui.QIcon(':qtutils/fugue/minus'),
+            'changed': QtGui.QIcon(':qtutils/fugue/hourglass'),
+            'error': QtGui.QIcon(':qtutils/fugue/exclamation'),
+            'outer': QtGui.QIcon(':qtutils/custom/outer'),
+            'zip': QtGui.QIcon(':qtutils/custom/zip'),
+        }
+
+    def set_globals(self, globals):
+        """Replace the contents of the model with the given list of (name, value,
+        units, expansion) tuples"""
+        self.beginResetModel()
+        self.names = [name for name, _, _, _ in globals]
+        self.values = [str(value) for _, value, _, _ in globals]
+        self.units = [units for _, _, units, _ in globals]
+        self.expansions = [expansion for _, _, _, expansion in globals]
+        self.parse_states = [self.PARSE_PENDING] * len(globals)
+        self.evaluated = [None] * len(globals)
+        self.tooltips = [None] * len(globals)
+        self._update_rows()
+        self.endResetModel()
+
+    def is_dummy_row(self, row):
+        return row == len(self.names)
+
+    def is_bool(self, row):
+        return self.values[row] in ('True', 'False')
+
+    def row_of(self, global_name):
+        """Return the row of the given global"""
+        try:
+            return self.rows[global_name]
+        except KeyError:
+            raise LookupError('No item found') from None
+
+    def _update_rows(self):
+        self.rows = {name: row for row, name in enumerate(self.names)}
+
+    def insert_global(self, name, value='', units='', expansion=''):
+        """Add a global, as the row before the dummy row"""
+        row = len(self.names)
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self.names.append(name)
+        self.values.append(str(value))
+        self.units.append(units)
+        self.expansions.append(expansion)
+        self.parse_states.append(self.PARSE_PENDING)
+        self.evaluated.append(None)
+        self.tooltips.append(None)
+        self.rows[name] = row
+        self.endInsertRows()
+
+    def remove_global(self, name):
+        row = self.row_of(name)
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        for values in self._columns():
+            del values[row]
+        self._update_rows()
+        self.endRemoveRows()
+
+    def _columns(self):
+        return [
+            self.names,
+            self.values,
+            self.units,
+            self.expansions,
+            self.parse_states,
+            self.evaluated,
+            self.tooltips,
+        ]
+
+    def _row_changed(self, row):
+        self.dataChanged.emit(
+            self.index(row, 0), self.index(row, self.columnCount() - 1)
+        )
+
+    def set_name(self, row, name):
+        del self.rows[self.names[row]]
+        self.names[row] = name
+        self.rows[name] = row
+        self._row_changed(row)
+
+    def set_value(self, row, value, parse_state, evaluated=None):
+        self.values[row] = str(value)
+        self.parse_states[row] = parse_state
+        self.evaluated[row] = evaluated
+        self.tooltips[row] = None
+        self._row_changed(row)
+
+    def set_units(self, row, units):
+        self.units[row] = units
+        self._row_changed(row)
+
+    def set_expansion(self, row, expansion):
+        self.expansions[row] = expansion
+        self._row_changed(row)
+
+    def set_parse_results(self, expansions, parse_states, evaluated):
+        """Set the expansion, parse state and evaluated value of every global at
+        once, emitting a single dataChanged signal"""
+        self.expansions = list(expansions)
+        self.parse_states = list(parse_states)
+        self.evaluated = list(evaluated)
+        self.tooltips = [None] * len(self.names)
+        self.refresh()
+
+    def value_tooltip(self, row):
+        parse_state = self.parse_states[row]
+        if parse_state == self.PARSE_INACTIVE:
+            return 'Group inactive'
+        elif parse_state not in (self.PARSE_OK, self.PARSE_ERROR):
+            return 'Evaluating...'
+        tooltip = self.tooltips[row]
+        if tooltip is None:
+            value = self.evaluated[row]
+            if parse_state == self.PARSE_ERROR:
+                tooltip = '%s: %s' % (value.__class__.__name__, str(value))
+            else:
+                tooltip = format_value(value, self.TOOLTIP_MAX_LENGTH)
+            self.tooltips[row] = tooltip
+        return tooltip
+
+    def refresh(self):
+        """Emit dataChanged for the whole model, such that the view redraws all data,
+        for example after a change in colour scheme"""
+        if self.names:
+            self.dataChanged.emit(
+                self.index(0, 0),
+                self.index(len(self.names) - 1, self.columnCount() - 1),
+            )
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.names) + 1
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.HEADER_LABELS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return self.HEADER_LABELS[section]
+        return QtCore.QAbstractTableModel.headerData(self, section, orientation, role)
+
+    def flags(self, index):
+        row, column = index.row(), index.column()
+        if self.is_dummy_row(row):
+            if column == self.COL_NAME:
+                return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsEditable
+            return QtCore.Qt.ItemIsEnabled
+        flags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+        if column == self.COL_DELETE:
+            return flags
+        if column == self.COL_UNITS and self.is_bool(row):
+            return flags
+        return flags | QtCore.Qt.ItemIsEditable
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        row, column = index.row(), index.column()
+        if role == QtCore.Qt.BackgroundRole:
+            selected = self.view.selectionModel().isSelected(index)
+            return self.get_bgbrush(self._normal_brush(row, column), row % 2, selected)
+        if self.is_dummy_row(row):
+            return self._dummy_row_data(column, role)
+        if role == self.ROLE_IS_DUMMY_ROW:
+            return False
+        elif role == self.ROLE_IS_BOOL:
+            return column == self.COL_UNITS and self.is_bool(row)
+        elif column == self.COL_DELETE:
+            if role == QtCore.Qt.DecorationRole:
+                return self.icons['delete']
+            elif role == QtCore.Qt.ToolTipRole:
+                return 'Delete global from group.'
+        elif column == self.COL_NAME:
+            if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole, QtCore.Qt.ToolTipRole):
+                return self.names[row]
+            elif role == QtCore.Qt.FontRole:
+                return self.font
+        elif column == self.COL_VALUE:
+            if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+                return self.values[row]
+            elif role == QtCore.Qt.FontRole:
+                return self.font
+            elif role == QtCore.Qt.ToolTipRole:
+                return self.value_tooltip(row)
+            elif role == QtCore.Qt.DecorationRole:
+                parse_state = self.parse_states[row]
+                if parse_state == self.PARSE_CHANGED:
+                    return self.icons['changed']
+                elif parse_state == self.PARSE_ERROR:
+                    return self.icons['error']
+        elif column == self.COL_UNITS:
+            is_bool = self.is_bool(row)
+            if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+                return 'Bool' if is_bool else self.units[row]
+            elif role == QtCore.Qt.CheckStateRole and is_bool:
+                if self.values[row] == 'True':
+                    return QtCore.Qt.Checked
+                return QtCore.Qt.Unchecked
+            elif role == QtCore.Qt.ToolTipRole:
+                return ''
+        elif column == self.COL_EXPANSION:
+            expansion = self.expansions[row]
+            if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+                return expansion
+            elif role == QtCore.Qt.DecorationRole:
+                if expansion == 'outer':
+                    return self.icons['outer']
+                elif expansion:
+                    return self.icons['zip']
+            elif role == QtCore.Qt.ToolTipRole:
+                if expansion == 'outer':
+                    return ('This global will be interpreted as a list of values, and '
+                            'will be outer producted with other lists to form a larger '
+                            'parameter space.')
+                elif expansion:
+                    return ('This global will be interpreted as a list of values, and '
+                            'will be iterated over in lock-step with other globals in '
+                            'the \'%s\' zip group.' % expansion)
+                return ('This global will be interpreted as a single value and passed '
+                        'to compilation as-is.')
+        return None
+
+    def _dummy_row_data(self, column, role):
+        if role == self.ROLE_IS_DUMMY_ROW:
+            return True
+        elif role == QtCore.Qt.ToolTipRole:
+            return 'Click to add global'
+        elif column == self.COL_NAME:
+            if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+                return self.DUMMY_ROW_TEXT
+            elif role == QtCore.Qt.FontRole:
+                return self.font
+        return None
+
+    def _normal_brush(self, row, column):
+        """The background brush of a cell, before alternate row shading and selection
+        highlighting"""
+        if self.is_dummy_row(row):
+            return None
+        colors = RunmanagerColors()
+        if column == self.COL_VALUE:
+            parse_state = self.parse_states[row]
+            if parse_state == self.PARSE_OK:
+                return self._brush(colors.COLOR_OK)
+            elif parse_state == self.PARSE_ERROR:
+                return self._brush(colors.COLOR_ERROR)
+        elif column == self.COL_UNITS and self.is_bool(row):
+            if self.values[row] == 'True':
+                return self._brush(colors.COLOR_BOOL_ON)
+            return self._brush(colors.COLOR_BOOL_OFF)
+        return None
+
+    def _brush(self, color):
+        try:
+            return self.bg_brushes[color]
+        except KeyError:
+            brush = self.bg_brushes[color] = QtGui.QBrush(QtGui.QColor(color))
+            return brush
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if role != QtCore.Qt.EditRole or not self.flags(index) & QtCore.Qt.ItemIsEditable:
+            return False
+        self.edited.emit(index.row(), index.column(), value)
+        return True
+
+    def sort_key(self, row, column):
+        if column == self.COL_NAME:
+            return self.names[row]
+        elif column == self.COL_VALUE:
+            return self.values[row]
+        elif column == self.COL_UNITS:
+            if self.is_bool(row):
+                return '!1' if self.values[row] == 'True' else '!0'
+            return self.units[row]
+        elif column == self.COL_EXPANSION:
+            return self.expansions[row]
+        return ''
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        """Sort the globals, keeping the dummy row last"""
+        self.layoutAboutToBeChanged.emit()
+        n_globals = len(self.names)
+        new_order = sorted(
+            range(n_globals),
+            key=lambda row: self.sort_key(row, column),
+            reverse=order == QtCore.Qt.DescendingOrder,
+        )
+        for values in self._columns():
+            values[:] = [values[row] for row in new_order]
+        self._update_rows()
+        new_rows = {old_row: new_row for new_row, old_row in enumerate(new_order)}
+        new_rows[n_globals] = n_globals
+        old_indexes = self.persistentIndexList()
+        new_indexes = [
+            self.index(new_rows[index.row()], index.column()) for index in old_indexes
+        ]
+        self.changePersistentIndexList(old_indexes, new_indexes)
+        self.layoutChanged.emit()
 
     def get_bgbrush(self, normal_brush, alternate, selected):
         """Get cell colour as a function of its ordinary colour, whether it is on an odd
@@ -547,21 +920,6 @@ class AlternatingColorModel(QtGui.QStandardItemModel):
         self.bg_brushes[normal_rgb, alternate, selected] = brush
         return brush
 
-    def data(self, index, role):
-        """When background color data is being requested, returns modified colours for
-        every second row, according to the palette of the view. This has the effect of
-        making the alternate colours visible even when custom colors have been set - the
-        same shading will be applied to the custom colours. Only really looks sensible
-        when the normal and alternate colors are similar. Also applies selection
-        highlight colour (using RunmanagerColors().COLOR_HIGHLIGHT), similarly with alternate-row
-        shading, for the case of a QTableView."""
-        if role == QtCore.Qt.BackgroundRole:
-            normal_brush = QtGui.QStandardItemModel.data(self, index, QtCore.Qt.BackgroundRole)
-            selected = index in self.view.selectedIndexes()
-            alternate = index.row() % 2
-            return self.get_bgbrush(normal_brush, alternate, selected)
-        return QtGui.QStandardItemModel.data(self, index, role)
-
 
 class Editor(QtWidgets.QTextEdit):
     """Popup editor with word wrapping and automatic resizing."""
@@ -752,18 +1110,16 @@ class RunmanagerColors(object):
 
 
 class GroupTab(object):
-    GLOBALS_COL_DELETE = 0
-    GLOBALS_COL_NAME = 1
-    GLOBALS_COL_VALUE = 2
-    GLOBALS_COL_UNITS = 3
-    GLOBALS_COL_EXPANSION = 4
+    GLOBALS_COL_DELETE = GlobalsModel.COL_DELETE
+    GLOBALS_COL_NAME = GlobalsModel.COL_NAME
+    GLOBALS_COL_VALUE = GlobalsModel.COL_VALUE
+    GLOBALS_COL_UNITS = GlobalsModel.COL_UNITS
+    GLOBALS_COL_EXPANSION = GlobalsModel.COL_EXPANSION
 
-    GLOBALS_ROLE_IS_DUMMY_ROW = QtCore.Qt.UserRole + 1
-    GLOBALS_ROLE_SORT_DATA = QtCore.Qt.UserRole + 2
-    GLOBALS_ROLE_PREVIOUS_TEXT = QtCore.Qt.UserRole + 3
-    GLOBALS_ROLE_IS_BOOL = QtCore.Qt.UserRole + 4
+    GLOBALS_ROLE_IS_DUMMY_ROW = GlobalsModel.ROLE_IS_DUMMY_ROW
+    GLOBALS_ROLE_IS_BOOL = GlobalsModel.ROLE_IS_BOOL
 
-    GLOBALS_DUMMY_ROW_TEXT = '<Click to add global>'
+    GLOBALS_DUMMY_ROW_TEXT = GlobalsModel.DUMMY_ROW_TEXT
 
     def __init__(self, tabWidget, globals_file, group_name):
 
@@ -781,9 +1137,7 @@ class GroupTab(object):
 
         self.set_file_and_group_name(globals_file, group_name)
 
-        self.globals_model = AlternatingColorModel(view=self.ui.tableView_globals)
-        self.globals_model.setHorizontalHeaderLabels(['Delete', 'Name', 'Value', 'Units', 'Expansion'])
-        self.globals_model.setSortRole(self.GLOBALS_ROLE_SORT_DATA)
+        self.globals_model = GlobalsModel(view=self.ui.tableView_globals)
 
         self.ui.tableView_globals.setModel(self.globals_model)
         self.ui.tableView_globals.setSelectionBehavior(QtWidgets.QTableView.SelectRows)
@@ -810,7 +1164,22 @@ class GroupTab(object):
 
         self.connect_signals()
 
-        # Populate the model with globals from the h5 file:
+        # The model is not populated with globals from the h5 file until the tab is
+        # first shown, see self.ensure_populated(). Until then, the results of
+        # preparsing are kept to be shown once it is populated:
+        self.populated = False
+        self.pending_parse_indication = None
+
+        # Error state of tab
+        self.tab_contains_errors = False
+
+    def ensure_populated(self):
+        """Populate the model with globals from the h5 file if this has not been done
+        already. Called by the main app when the tab is first shown, and by any
+        methods that require the model to be populated."""
+        if self.populated:
+            return
+        self.populated = True
         self.populate_model()
         self.logger.info(f'Initial population of {self.group_name}')
         # Set sensible column widths:
@@ -826,9 +1195,10 @@ class GroupTab(object):
         if self.ui.tableView_globals.columnWidth(self.GLOBALS_COL_EXPANSION) < 100:
             self.ui.tableView_globals.setColumnWidth(self.GLOBALS_COL_EXPANSION, 100)
         self.ui.tableView_globals.resizeColumnToContents(self.GLOBALS_COL_DELETE)
-
-        # Error state of tab
-        self.tab_contains_errors = False
+        if self.pending_parse_indication is not None:
+            pending_parse_indication = self.pending_parse_indication
+            self.pending_parse_indication = None
+            self.update_parse_indication(*pending_parse_indication)
 
     def connect_signals(self):
         self.ui.tableView_globals.leftClicked.connect(self.on_tableView_globals_leftClicked)
@@ -838,10 +1208,7 @@ class GroupTab(object):
         self.action_globals_set_selected_false.triggered.connect(
             lambda: self.on_globals_set_selected_bools_triggered('False'))
         self.action_globals_delete_selected.triggered.connect(self.on_globals_delete_selected_triggered)
-        self.globals_model.itemChanged.connect(self.on_globals_model_item_changed)
-        # A context manager with which we can temporarily disconnect the above connection.
-        self.globals_model_item_changed_disconnected = DisconnectContextManager(
-            self.globals_model.itemChanged, self.on_globals_model_item_changed)
+        self.globals_model.edited.connect(self.on_globals_model_edited)
 
     def set_file_and_group_name(self, globals_file, group_name):
         """Provided as a separate method so the main app can call it if the
@@ -865,210 +1232,76 @@ class GroupTab(object):
 
     def populate_model(self):
         globals = runmanager.get_globals({self.group_name: self.globals_file})[self.group_name]
+        rows = []
         for name, (value, units, expansion) in globals.items():
-            row = self.make_global_row(name, value, units, expansion)
-            self.globals_model.appendRow(row)
-            value_item = row[self.GLOBALS_COL_VALUE]
-            self.check_for_boolean_values(value_item)
-            expansion_item = row[self.GLOBALS_COL_EXPANSION]
-            self.on_globals_model_expansion_changed(expansion_item)
-
-        # Add the dummy item at the end:
-        dummy_delete_item = QtGui.QStandardItem()
-        # This lets later code know that this row does not correspond to an
-        # actual global:
-        dummy_delete_item.setData(True, self.GLOBALS_ROLE_IS_DUMMY_ROW)
-        dummy_delete_item.setFlags(QtCore.Qt.ItemIsEnabled)
-        dummy_delete_item.setToolTip('Click to add global')
-
-        dummy_name_item = QtGui.QStandardItem(self.GLOBALS_DUMMY_ROW_TEXT)
-        dummy_name_item.setFont(QtGui.QFont(GLOBAL_MONOSPACE_FONT))
-        dummy_name_item.setToolTip('Click to add global')
-        dummy_name_item.setData(True, self.GLOBALS_ROLE_IS_DUMMY_ROW)
-        dummy_name_item.setData(self.GLOBALS_DUMMY_ROW_TEXT, self.GLOBALS_ROLE_PREVIOUS_TEXT)
-        dummy_name_item.setFlags(QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsEditable)  # Clears the 'selectable' flag
-
-        dummy_value_item = QtGui.QStandardItem()
-        dummy_value_item.setData(True, self.GLOBALS_ROLE_IS_DUMMY_ROW)
-        dummy_value_item.setFlags(QtCore.Qt.ItemIsEnabled)
-        dummy_value_item.setToolTip('Click to add global')
-
-        dummy_units_item = QtGui.QStandardItem()
-        dummy_units_item.setData(True, self.GLOBALS_ROLE_IS_DUMMY_ROW)
-        dummy_units_item.setFlags(QtCore.Qt.ItemIsEnabled)
-        dummy_units_item.setToolTip('Click to add global')
-
-        dummy_expansion_item = QtGui.QStandardItem()
-        dummy_expansion_item.setData(True, self.GLOBALS_ROLE_IS_DUMMY_ROW)
-        dummy_expansion_item.setFlags(QtCore.Qt.ItemIsEnabled)
-        dummy_expansion_item.setToolTip('Click to add global')
-
-        self.globals_model.appendRow(
-            [dummy_delete_item, dummy_name_item, dummy_value_item, dummy_units_item, dummy_expansion_item])
-
+            if str(value) in ('True', 'False') and units != 'Bool':
+                # Boolean globals are saved with units 'Bool':
+                runmanager.set_units(self.globals_file, self.group_name, name, 'Bool')
+                units = 'Bool'
+            rows.append((name, value, units, expansion))
+        self.globals_model.set_globals(rows)
         # Sort by name:
         self.ui.tableView_globals.sortByColumn(self.GLOBALS_COL_NAME, QtCore.Qt.AscendingOrder)
 
-    def make_global_row(self, name, value='', units='', expansion=''):
-        self.logger.debug('%s:%s - make global row: %s ' % (self.globals_file, self.group_name, name))
-        # We just set some data here, other stuff is set in
-        # self.update_parse_indication after runmanager has a chance to parse
-        # everything and get back to us about what that data should be.
-
-        delete_item = QtGui.QStandardItem()
-        delete_item.setIcon(QtGui.QIcon(':qtutils/fugue/minus'))
-        # Must be set to something so that the dummy row doesn't get sorted first:
-        delete_item.setData(False, self.GLOBALS_ROLE_SORT_DATA)
-        delete_item.setEditable(False)
-        delete_item.setToolTip('Delete global from group.')
-
-        name_item = QtGui.QStandardItem(name)
-        name_item.setData(name, self.GLOBALS_ROLE_SORT_DATA)
-        name_item.setData(name, self.GLOBALS_ROLE_PREVIOUS_TEXT)
-        name_item.setToolTip(name)
-        name_item.setFont(QtGui.QFont(GLOBAL_MONOSPACE_FONT))
-
-        value_item = QtGui.QStandardItem(value)
-        value_item.setData(value, self.GLOBALS_ROLE_SORT_DATA)
-        value_item.setData(str(value), self.GLOBALS_ROLE_PREVIOUS_TEXT)
-        value_item.setToolTip('Evaluating...')
-        value_item.setFont(QtGui.QFont(GLOBAL_MONOSPACE_FONT))
-
-        units_item = QtGui.QStandardItem(units)
-        units_item.setData(units, self.GLOBALS_ROLE_SORT_DATA)
-        units_item.setData(units, self.GLOBALS_ROLE_PREVIOUS_TEXT)
-        units_item.setData(False, self.GLOBALS_ROLE_IS_BOOL)
-        units_item.setToolTip('')
-
-        expansion_item = QtGui.QStandardItem(expansion)
-        expansion_item.setData(expansion, self.GLOBALS_ROLE_SORT_DATA)
-        expansion_item.setData(expansion, self.GLOBALS_ROLE_PREVIOUS_TEXT)
-        expansion_item.setToolTip('')
-
-        row = [delete_item, name_item, value_item, units_item, expansion_item]
-        return row
-
     def on_tableView_globals_leftClicked(self, index):
         if qapplication.keyboardModifiers() != QtCore.Qt.NoModifier:
             # Only handle mouseclicks with no keyboard modifiers.
             return
-        item = self.globals_model.itemFromIndex(index)
-        # The 'name' item in the same row:
-        name_index = index.sibling(index.row(), self.GLOBALS_COL_NAME)
-        name_item = self.globals_model.itemFromIndex(name_index)
-        global_name = name_item.text()
-        if item.data(self.GLOBALS_ROLE_IS_DUMMY_ROW):
+        row = index.row()
+        if self.globals_model.is_dummy_row(row):
             # They clicked on an 'add new global' row. Enter editing mode on
             # the name item so they can enter a name for the new global:
+            name_index = index.sibling(row, self.GLOBALS_COL_NAME)
             self.ui.tableView_globals.setCurrentIndex(name_index)
             self.ui.tableView_globals.edit(name_index)
-        elif item.data(self.GLOBALS_ROLE_IS_BOOL):
+            return
+        global_name = self.globals_model.names[row]
+        if index.data(self.GLOBALS_ROLE_IS_BOOL):
             # It's a bool indicator. Toggle it
-            value_item = self.get_global_item_by_name(global_name, self.GLOBALS_COL_VALUE)
-            if value_item.text() == 'True':
-                value_item.setText('False')
-            elif value_item.text() == 'False':
-                value_item.setText('True')
+            value = self.globals_model.values[row]
+            if value == 'True':
+                self.change_global_value(global_name, value, 'False')
+            elif value == 'False':
+                self.change_global_value(global_name, value, 'True')
             else:
                 raise AssertionError('expected boolean value')
-        elif item.column() == self.GLOBALS_COL_DELETE:
+        elif index.column() == self.GLOBALS_COL_DELETE:
             # They clicked a delete button.
             self.delete_global(global_name)
-        elif not item.data(self.GLOBALS_ROLE_IS_BOOL):
+        else:
             # Edit whatever it is:
             if (self.ui.tableView_globals.currentIndex() != index
                     or self.ui.tableView_globals.state() != QtWidgets.QTreeView.EditingState):
                 self.ui.tableView_globals.setCurrentIndex(index)
                 self.ui.tableView_globals.edit(index)
 
-    def on_globals_model_item_changed(self, item):
-        if item.column() == self.GLOBALS_COL_NAME:
-            self.on_globals_model_name_changed(item)
-        elif item.column() == self.GLOBALS_COL_VALUE:
-            self.on_globals_model_value_changed(item)
-        elif item.column() == self.GLOBALS_COL_UNITS:
-            self.on_globals_model_units_changed(item)
-        elif item.column() == self.GLOBALS_COL_EXPANSION:
-            self.on_globals_model_expansion_changed(item)
-
-    def on_globals_model_name_changed(self, item):
-        """Handles global renaming and creation of new globals due to the user
-        editing the <click to add global> item"""
-        item_text = item.text()
-        if item.data(self.GLOBALS_ROLE_IS_DUMMY_ROW):
-            if item_text != self.GLOBALS_DUMMY_ROW_TEXT:
+    def on_globals_model_edited(self, row, column, text):
+        """Handles the user editing a cell. The model has not been modified, it is up
+        to the methods called here to write the change to the globals file and update
+        the model if successful"""
+        if self.globals_model.is_dummy_row(row):
+            if column == self.GLOBALS_COL_NAME and text != self.GLOBALS_DUMMY_ROW_TEXT:
                 # The user has made a new global by editing the <click to add
                 # global> item
-                global_name = item_text
-                self.new_global(global_name)
-        else:
-            # User has renamed a global.
-            new_global_name = item_text
-            previous_global_name = item.data(self.GLOBALS_ROLE_PREVIOUS_TEXT)
-            # Ensure the name actually changed, rather than something else
-            # about the item:
-            if new_global_name != previous_global_name:
-                self.rename_global(previous_global_name, new_global_name)
-
-    def on_globals_model_value_changed(self, item):
-        index = item.index()
-        new_value = item.text()
-        previous_value = item.data(self.GLOBALS_ROLE_PREVIOUS_TEXT)
-        name_index = index.sibling(index.row(), self.GLOBALS_COL_NAME)
-        name_item = self.globals_model.itemFromIndex(name_index)
-        global_name = name_item.text()
-        # Ensure the value actually changed, rather than something else about
-        # the item:
-        if new_value != previous_value:
-            self.change_global_value(global_name, previous_value, new_value)
-
-    def on_globals_model_units_changed(self, item):
-        index = item.index()
-        new_units = item.text()
-        previous_units = item.data(self.GLOBALS_ROLE_PREVIOUS_TEXT)
-        name_index = index.sibling(index.row(), self.GLOBALS_COL_NAME)
-        name_item = self.globals_model.itemFromIndex(name_index)
-        global_name = name_item.text()
-        # If it's a boolean value, ensure the check state matches the bool state:
-        if item.data(self.GLOBALS_ROLE_IS_BOOL):
-            value_item = self.get_global_item_by_name(global_name, self.GLOBALS_COL_VALUE)
-            if value_item.text() == 'True':
-                item.setCheckState(QtCore.Qt.Checked)
-            elif value_item.text() == 'False':
-                item.setCheckState(QtCore.Qt.Unchecked)
-            else:
-                raise AssertionError('expected boolean value')
-        # Ensure the value actually changed, rather than something else about
-        # the item:
-        if new_units != previous_units:
-            self.change_global_units(global_name, previous_units, new_units)
-
-    def on_globals_model_expansion_changed(self, item):
-        index = item.index()
-        new_expansion = item.text()
-        previous_expansion = item.data(self.GLOBALS_ROLE_PREVIOUS_TEXT)
-        name_index = index.sibling(index.row(), self.GLOBALS_COL_NAME)
-        name_item = self.globals_model.itemFromIndex(name_index)
-        global_name = name_item.text()
-        # Don't want icon changing to recurse - which happens even if it is
-        # the same icon. So disconnect the signal temporarily:
-        with self.globals_model_item_changed_disconnected:
-            if new_expansion == 'outer':
-                item.setIcon(QtGui.QIcon(':qtutils/custom/outer'))
-                item.setToolTip('This global will be interpreted as a list of values, and will ' +
-                                'be outer producted with other lists to form a larger parameter space.')
-            elif new_expansion:
-                item.setIcon(QtGui.QIcon(':qtutils/custom/zip'))
-                item.setToolTip('This global will be interpreted as a list of values, and will ' +
-                                'be iterated over in lock-step with other globals in the ' +
-                                '\'%s\' zip group.' % new_expansion)
-            else:
-                item.setData(None, QtCore.Qt.DecorationRole)
-                item.setToolTip('This global will be interpreted as a single value and passed to compilation as-is.')
-        # Ensure the value actually changed, rather than something else about
-        # the item:
-        if new_expansion != previous_expansion:
-            self.change_global_expansion(global_name, previous_expansion, new_expansion)
+                self.new_global(text)
+            return
+        global_name = self.globals_model.names[row]
+        # In each case, ensure the text actually changed:
+        if column == self.GLOBALS_COL_NAME:
+            if text != global_name:
+                self.rename_global(global_name, text)
+        elif column == self.GLOBALS_COL_VALUE:
+            previous_value = self.globals_model.values[row]
+            if text != previous_value:
+                self.change_global_value(global_name, previous_value, text)
+        elif column == self.GLOBALS_COL_UNITS:
+            previous_units = self.globals_model.units[row]
+            if text != previous_units:
+                self.change_global_units(global_name, previous_units, text)
+        elif column == self.GLOBALS_COL_EXPANSION:
+            previous_expansion = self.globals_model.expansions[row]
+            if text != previous_expansion:
+                self.change_global_expansion(global_name, previous_expansion, text)
 
     def on_tableView_globals_context_menu_requested(self, point):
         menu = QtWidgets.QMenu(self.ui)
@@ -1077,29 +1310,29 @@ class GroupTab(object):
         menu.addAction(self.action_globals_delete_selected)
         menu.exec(QtGui.QCursor.pos())
 
+    def get_selected_global_names(self):
+        selected_rows = self.ui.tableView_globals.selectionModel().selectedRows()
+        return [self.globals_model.names[index.row()] for index in selected_rows
+                if not self.globals_model.is_dummy_row(index.row())]
+
     def on_globals_delete_selected_triggered(self):
-        selected_indexes = self.ui.tableView_globals.selectedIndexes()
-        selected_items = (self.globals_model.itemFromIndex(index) for index in selected_indexes)
-        name_items = [item for item in selected_items if item.column() == self.GLOBALS_COL_NAME]
+        global_names = self.get_selected_global_names()
         # If multiple selected, show 'delete n groups?' message. Otherwise,
         # pass confirm=True to self.delete_global so it can show the regular
         # message.
-        confirm_multiple = (len(name_items) > 1)
+        confirm_multiple = (len(global_names) > 1)
         if confirm_multiple:
-            if not question_dialog("Delete %d globals?" % len(name_items)):
+            if not question_dialog("Delete %d globals?" % len(global_names)):
                 return
-        for item in name_items:
-            global_name = item.text()
+        for global_name in global_names:
             self.delete_global(global_name, confirm=not confirm_multiple)
 
     def on_globals_set_selected_bools_triggered(self, state):
-        selected_indexes = self.ui.tableView_globals.selectedIndexes()
-        selected_items = [self.globals_model.itemFromIndex(index) for index in selected_indexes]
-        value_items = [item for item in selected_items if item.column() == self.GLOBALS_COL_VALUE]
-        units_items = [item for item in selected_items if item.column() == self.GLOBALS_COL_UNITS]
-        for value_item, units_item in zip(value_items, units_items):
-            if units_item.data(self.GLOBALS_ROLE_IS_BOOL):
-                value_item.setText(state)
+        for global_name in self.get_selected_global_names():
+            row = self.globals_model.row_of(global_name)
+            value = self.globals_model.values[row]
+            if self.globals_model.is_bool(row) and value != state:
+                self.change_global_value(global_name, value, state)
 
     def close(self):
         # It is up to the main runmanager class to drop references to this
@@ -1109,33 +1342,11 @@ class GroupTab(object):
         index = self.tabWidget.indexOf(self.ui)
         self.tabWidget.removeTab(index)
 
-    def get_global_item_by_name(self, global_name, column, previous_name=None):
-        """Returns an item from the row representing a global in the globals model.
-        Which item is returned is set by the column argument."""
-        possible_name_items = self.globals_model.findItems(global_name, column=self.GLOBALS_COL_NAME)
-        if previous_name is not None:
-            # Filter by previous name, useful for telling rows apart when a
-            # rename is in progress and two rows may temporarily contain the
-            # same name (though the rename code with throw an error and revert
-            # it).
-            possible_name_items = [item for item in possible_name_items
-                                   if item.data(self.GLOBALS_ROLE_PREVIOUS_TEXT) == previous_name]
-        elif global_name != self.GLOBALS_DUMMY_ROW_TEXT:
-            # Don't return the dummy item unless they asked for it explicitly
-            # - if a new global is being created, its name might be
-            # simultaneously present in its own row and the dummy row too.
-            possible_name_items = [item for item in possible_name_items
-                                   if not item.data(self.GLOBALS_ROLE_IS_DUMMY_ROW)]
-        if len(possible_name_items) > 1:
-            raise LookupError('Multiple items found')
-        elif not possible_name_items:
-            raise LookupError('No item found')
-        name_item = possible_name_items[0]
-        name_index = name_item.index()
-        # Found the name item, get the sibling item for the column requested:
-        item_index = name_index.sibling(name_index.row(), column)
-        item = self.globals_model.itemFromIndex(item_index)
-        return item
+    def get_global_index_by_name(self, global_name, column):
+        """Returns the model index of the cell in the row representing a global in
+        the globals model. Which cell is returned is set by the column argument."""
+        row = self.globals_model.row_of(global_name)
+        return self.globals_model.index(row, column)
 
     def do_model_sort(self):
         header = self.ui.tableView_globals.horizontalHeader()
@@ -1145,194 +1356,139 @@ class GroupTab(object):
 
     def new_global(self, global_name):
         self.logger.info('%s:%s - new global: %s', self.globals_file, self.group_name, global_name)
-        item = self.get_global_item_by_name(global_name, self.GLOBALS_COL_NAME,
-                                            previous_name=self.GLOBALS_DUMMY_ROW_TEXT)
         try:
             runmanager.new_global(self.globals_file, self.group_name, global_name)
         except Exception as e:
             error_dialog(str(e))
         else:
             # Insert the newly created global into the model:
-            global_row = self.make_global_row(global_name)
-            last_index = self.globals_model.rowCount()
-            # Insert it as the row before the last (dummy) row:
-            self.globals_model.insertRow(last_index - 1, global_row)
+            self.globals_model.insert_global(global_name)
             self.do_model_sort()
             # Go into edit mode on the 'value' item:
-            value_item = self.get_global_item_by_name(global_name, self.GLOBALS_COL_VALUE,
-                                                      previous_name=global_name)
-            value_item_index = value_item.index()
-            self.ui.tableView_globals.setCurrentIndex(value_item_index)
-            self.ui.tableView_globals.edit(value_item_index)
+            value_index = self.get_global_index_by_name(global_name, self.GLOBALS_COL_VALUE)
+            self.ui.tableView_globals.setCurrentIndex(value_index)
+            self.ui.tableView_globals.edit(value_index)
             self.globals_changed()
-        finally:
-            # Set the dummy row's text back ready for another group to be created:
-            item.setText(self.GLOBALS_DUMMY_ROW_TEXT)
 
     def rename_global(self, previous_global_name, new_global_name):
         self.logger.info('%s:%s - rename global: %s -> %s',
                     self.globals_file, self.group_name, previous_global_name, new_global_name)
-        item = self.get_global_item_by_name(new_global_name, self.GLOBALS_COL_NAME,
-                                            previous_name=previous_global_name)
         try:
             runmanager.rename_global(self.globals_file, self.group_name, previous_global_name, new_global_name)
         except Exception as e:
             error_dialog(str(e))
-            # Set the item text back to the old name, since the rename failed:
-            item.setText(previous_global_name)
         else:
-            item.setData(new_global_name, self.GLOBALS_ROLE_PREVIOUS_TEXT)
-            item.setData(new_global_name, self.GLOBALS_ROLE_SORT_DATA)
+            row = self.globals_model.row_of(previous_global_name)
+            self.globals_model.set_name(row, new_global_name)
             self.do_model_sort()
-            item.setToolTip(new_global_name)
             self.globals_changed()
-            value_item = self.get_global_item_by_name(new_global_name, self.GLOBALS_COL_VALUE)
-            value = value_item.text()
+            value_index = self.get_global_index_by_name(new_global_name, self.GLOBALS_COL_VALUE)
+            value = value_index.data()
             if not value and self.ui.tableView_globals.state() != QtWidgets.QAbstractItemView.EditingState:
                 # Go into editing the value item automatically if not already in edit mode:
-                value_item_index = value_item.index()
-                self.ui.tableView_globals.setCurrentIndex(value_item_index)
-                self.ui.tableView_globals.edit(value_item_index)
+                self.ui.tableView_globals.setCurrentIndex(value_index)
+                self.ui.tableView_globals.edit(value_index)
             else:
                 # If this changed the sort order, ensure the item is still visible:
-                scroll_view_to_row_if_current(self.ui.tableView_globals, item)
+                scroll_view_to_row_if_current(self.ui.tableView_globals, value_index)
 
     def change_global_value(self, global_name, previous_value, new_value, interactive=True):
         self.logger.info('%s:%s - change global value: %s = %s -> %s' %
                     (self.globals_file, self.group_name, global_name, previous_value, new_value))
-        item = self.get_global_item_by_name(global_name, self.GLOBALS_COL_VALUE)
-        if not interactive:
-            # Value was not set interactively by the user, it is up to us to set it:
-            with self.globals_model_item_changed_disconnected:
-                item.setText(new_value)
-        previous_background = item.background()
-        previous_icon = item.icon()
-        item.setData(new_value, self.GLOBALS_ROLE_PREVIOUS_TEXT)
-        item.setData(new_value, self.GLOBALS_ROLE_SORT_DATA)
-        item.setData(None, QtCore.Qt.BackgroundRole)
-        item.setIcon(QtGui.QIcon(':qtutils/fugue/hourglass'))
-        args = global_name, previous_value, new_value, item, previous_background, previous_icon
+        self.ensure_populated()
+        row = self.globals_model.row_of(global_name)
+        previous_parse_state = self.globals_model.parse_states[row]
+        previous_evaluated = self.globals_model.evaluated[row]
+        self.globals_model.set_value(row, new_value, self.globals_model.PARSE_CHANGED)
+        args = global_name, previous_value, new_value, previous_parse_state, previous_evaluated
         if interactive:
             QtCore.QTimer.singleShot(1, lambda: self.complete_change_global_value(*args))
         else:
             self.complete_change_global_value(*args, interactive=False)
 
-    def complete_change_global_value(self, global_name, previous_value, new_value, item, previous_background, previous_icon, interactive=True):
+    def complete_change_global_value(self, global_name, previous_value, new_value, previous_parse_state,
+                                     previous_evaluated, interactive=True):
         try:
             runmanager.set_value(self.globals_file, self.group_name, global_name, new_value)
         except Exception as e:
             if interactive:
                 error_dialog(str(e))
-            # Set the item text back to the old name, since the change failed:
-            with self.globals_model_item_changed_disconnected:
-                item.setText(previous_value)
-                item.setData(previous_value, self.GLOBALS_ROLE_PREVIOUS_TEXT)
-                item.setData(previous_value, self.GLOBALS_ROLE_SORT_DATA)
-                item.setData(previous_background, QtCore.Qt.BackgroundRole)
-                item.setIcon(previous_icon)
+            # Set the value back to the old one, since the change failed:
+            row = self.globals_model.row_of(global_name)
+            self.globals_model.set_value(row, previous_value, previous_parse_state, previous_evaluated)
             if not interactive:
                 raise
         else:
-            self.check_for_boolean_values(item)
+            self.check_for_boolean_values(global_name, previous_value)
             self.do_model_sort()
-            item.setToolTip('Evaluating...')
             self.globals_changed()
             if not interactive:
                 return
-            units_item = self.get_global_item_by_name(global_name, self.GLOBALS_COL_UNITS)
-            units = units_item.text()
+            units_index = self.get_global_index_by_name(global_name, self.GLOBALS_COL_UNITS)
+            units = units_index.data()
             if not units and self.ui.tableView_globals.state() != QtWidgets.QAbstractItemView.EditingState:
                 # Go into editing the units item automatically if not already in edit mode:
-                units_item_index = units_item.index()
-                self.ui.tableView_globals.setCurrentIndex(units_item_index)
-                self.ui.tableView_globals.edit(units_item_index)
+                self.ui.tableView_globals.setCurrentIndex(units_index)
+                self.ui.tableView_globals.edit(units_index)
             else:
                 # If this changed the sort order, ensure the item is still visible:
-                scroll_view_to_row_if_current(self.ui.tableView_globals, item)
+                scroll_view_to_row_if_current(self.ui.tableView_globals, units_index)
 
     def change_global_units(self, global_name, previous_units, new_units):
         self.logger.info('%s:%s - change units: %s = %s -> %s' %
                     (self.globals_file, self.group_name, global_name, previous_units, new_units))
-        item = self.get_global_item_by_name(global_name, self.GLOBALS_COL_UNITS)
         try:
             runmanager.set_units(self.globals_file, self.group_name, global_name, new_units)
         except Exception as e:
             error_dialog(str(e))
-            # Set the item text back to the old units, since the change failed:
-            item.setText(previous_units)
         else:
-            item.setData(new_units, self.GLOBALS_ROLE_PREVIOUS_TEXT)
-            item.setData(new_units, self.GLOBALS_ROLE_SORT_DATA)
+            row = self.globals_model.row_of(global_name)
+            self.globals_model.set_units(row, new_units)
             self.do_model_sort()
             # If this changed the sort order, ensure the item is still visible:
-            scroll_view_to_row_if_current(self.ui.tableView_globals, item)
+            units_index = self.get_global_index_by_name(global_name, self.GLOBALS_COL_UNITS)
+            scroll_view_to_row_if_current(self.ui.tableView_globals, units_index)
 
     def change_global_expansion(self, global_name, previous_expansion, new_expansion):
         self.logger.info('%s:%s - change expansion: %s = %s -> %s' %
                     (self.globals_file, self.group_name, global_name, previous_expansion, new_expansion))
-        item = self.get_global_item_by_name(global_name, self.GLOBALS_COL_EXPANSION)
         try:
             runmanager.set_expansion(self.globals_file, self.group_name, global_name, new_expansion)
         except Exception as e:
             error_dialog(str(e))
-            # Set the item text back to the old units, since the change failed:
-            item.setText(previous_expansion)
         else:
-            item.setData(new_expansion, self.GLOBALS_ROLE_PREVIOUS_TEXT)
-            item.setData(new_expansion, self.GLOBALS_ROLE_SORT_DATA)
+            row = self.globals_model.row_of(global_name)
+            self.globals_model.set_expansion(row, new_expansion)
             self.do_model_sort()
             self.globals_changed()
             # If this changed the sort order, ensure the item is still visible:
-            scroll_view_to_row_if_current(self.ui.tableView_globals, item)
-
-    def check_for_boolean_values(self, item):
-        """Checks if the value is 'True' or 'False'. If either, makes the
-        units cell checkable, uneditable, and coloured to indicate the state.
-        The units cell can then be clicked to toggle the value."""
-        index = item.index()
-        value = item.text()
-        name_index = index.sibling(index.row(), self.GLOBALS_COL_NAME)
-        units_index = index.sibling(index.row(), self.GLOBALS_COL_UNITS)
-        name_item = self.globals_model.itemFromIndex(name_index)
-        units_item = self.globals_model.itemFromIndex(units_index)
-        global_name = name_item.text()
+            expansion_index = self.get_global_index_by_name(global_name, self.GLOBALS_COL_EXPANSION)
+            scroll_view_to_row_if_current(self.ui.tableView_globals, expansion_index)
+
+    def check_for_boolean_values(self, global_name, previous_value=None):
+        """Checks if the value is 'True' or 'False'. If either, the model displays the
+        units cell as checkable, uneditable, and coloured to indicate the state, and
+        the units are saved as 'Bool'. The units cell can then be clicked to toggle the
+        value. If the value was previously a bool and now isn't, clears the units."""
         self.logger.debug('%s:%s - check for boolean values: %s' %
                      (self.globals_file, self.group_name, global_name))
-        if value == 'True':
-            units_item.setData(True, self.GLOBALS_ROLE_IS_BOOL)
-            units_item.setText('Bool')
-            units_item.setData('!1', self.GLOBALS_ROLE_SORT_DATA)
-            units_item.setEditable(False)
-            units_item.setCheckState(QtCore.Qt.Checked)
-            units_item.setBackground(QtGui.QBrush(QtGui.QColor(self.colorConfig.COLOR_BOOL_ON)))
-        elif value == 'False':
-            units_item.setData(True, self.GLOBALS_ROLE_IS_BOOL)
-            units_item.setText('Bool')
-            units_item.setData('!0', self.GLOBALS_ROLE_SORT_DATA)
-            units_item.setEditable(False)
-            units_item.setCheckState(QtCore.Qt.Unchecked)
-            units_item.setBackground(QtGui.QBrush(QtGui.QColor(self.colorConfig.COLOR_BOOL_OFF)))
-        else:
-            was_bool = units_item.data(self.GLOBALS_ROLE_IS_BOOL)
-            units_item.setData(False, self.GLOBALS_ROLE_IS_BOOL)
-            units_item.setEditable(True)
-            # Checkbox still visible unless we do the following:
-            units_item.setData(None, QtCore.Qt.CheckStateRole)
-            units_item.setData(None, QtCore.Qt.BackgroundRole)
-            if was_bool:
-                # If the item was a bool and now isn't, clear the
-                # units and go into editing so the user can enter a
-                # new units string:
-                units_item.setText('')
-                self.ui.tableView_globals.setCurrentIndex(units_item.index())
-                self.ui.tableView_globals.edit(units_item.index())
+        row = self.globals_model.row_of(global_name)
+        units = self.globals_model.units[row]
+        if self.globals_model.is_bool(row):
+            if units != 'Bool':
+                self.change_global_units(global_name, units, 'Bool')
+        elif previous_value in ('True', 'False'):
+            # If the item was a bool and now isn't, clear the units and go into
+            # editing so the user can enter a new units string:
+            if units:
+                self.change_global_units(global_name, units, '')
+            units_index = self.get_global_index_by_name(global_name, self.GLOBALS_COL_UNITS)
+            self.ui.tableView_globals.setCurrentIndex(units_index)
+            self.ui.tableView_globals.edit(units_index)
 
     def redraw_boolean_values(self):
         """Called during theme changes to ensure boolean values get repainted with new colors"""
-
-        for r in range(self.globals_model.rowCount()-1): # don't parse add-global row
-            item = self.globals_model.item(r, self.GLOBALS_COL_VALUE)
-            self.check_for_boolean_values(item)
+        self.globals_model.refresh()
 
     def globals_changed(self):
         """Called whenever something about a global has changed. call
@@ -1351,61 +1507,49 @@ class GroupTab(object):
                 return
         runmanager.delete_global(self.globals_file, self.group_name, global_name)
         # Find the entry for this global in self.globals_model and remove it:
-        name_item = self.get_global_item_by_name(global_name, self.GLOBALS_COL_NAME)
-        self.globals_model.removeRow(name_item.row())
+        self.globals_model.remove_global(global_name)
         self.globals_changed()
 
     def update_parse_indication(self, active_groups, sequence_globals, evaled_globals):
+        if not self.populated:
+            # Keep the results for when the tab is shown, but keep the tab icon up to
+            # date in the meantime:
+            self.pending_parse_indication = active_groups, sequence_globals, evaled_globals
+            self.tab_contains_errors = (
+                self.group_name in active_groups
+                and active_groups[self.group_name] == self.globals_file
+                and any(isinstance(value, Exception)
+                        for value in evaled_globals[self.group_name].values())
+            )
+            if self.tab_contains_errors:
+                self.set_tab_icon(':qtutils/fugue/exclamation')
+            else:
+                self.set_tab_icon(None)
+            return
+        model = self.globals_model
         # Check that we are an active group:
         if self.group_name in active_groups and active_groups[self.group_name] == self.globals_file:
             self.tab_contains_errors = False
-            # for global_name, value in evaled_globals[self.group_name].items():
-            for i in range(self.globals_model.rowCount()):
-                name_item = self.globals_model.item(i, self.GLOBALS_COL_NAME)
-                if name_item.data(self.GLOBALS_ROLE_IS_DUMMY_ROW):
-                    continue
-                value_item = self.globals_model.item(i, self.GLOBALS_COL_VALUE)
-                expansion_item = self.globals_model.item(i, self.GLOBALS_COL_EXPANSION)
-                # value_item = self.get_global_item_by_name(global_name, self.GLOBALS_COL_VALUE)
-                # expansion_item = self.get_global_item_by_name(global_name, self.GLOBALS_COL_EXPANSION)
-                global_name = name_item.text()
-                value = evaled_globals[self.group_name][global_name]
-
-                ignore, ignore, expansion = sequence_globals[self.group_name][global_name]
-                # Temporarily disconnect the item_changed signal on the model
-                # so that we can set the expansion type without triggering
-                # another preparse - the parsing has already been done with
-                # the new expansion type.
-                with self.globals_model_item_changed_disconnected:
-                    if expansion_item.data(self.GLOBALS_ROLE_PREVIOUS_TEXT) != expansion:
-                        # self.logger.info('expansion previous text set')
-                        expansion_item.setData(expansion, self.GLOBALS_ROLE_PREVIOUS_TEXT)
-                    if expansion_item.data(self.GLOBALS_ROLE_SORT_DATA) != expansion:
-                        # self.logger.info('sort data role set')
-                        expansion_item.setData(expansion, self.GLOBALS_ROLE_SORT_DATA)
-                # The next line will now trigger item_changed, but it will not
-                # be detected as an actual change to the expansion type,
-                # because previous_text will match text. So it will not look
-                # like a change and will not trigger preparsing. However It is
-                # still important that other triggers be processed, such as
-                # setting the icon in the expansion item, so that will still
-                # occur in the callback.
-                expansion_item.setText(expansion)
+            group_sequence_globals = sequence_globals[self.group_name]
+            group_evaled_globals = evaled_globals[self.group_name]
+            expansions = []
+            parse_states = []
+            evaluated = []
+            for global_name in model.names:
+                value = group_evaled_globals[global_name]
+                _, _, expansion = group_sequence_globals[global_name]
+                # Setting the expansion type here does not trigger another preparse,
+                # the parsing has already been done with the new expansion type.
+                expansions.append(expansion)
+                # Tooltips are formatted from the evaluated value by the model, only
+                # when requested:
+                evaluated.append(value)
                 if isinstance(value, Exception):
-                    value_item.setBackground(QtGui.QBrush(QtGui.QColor(self.colorConfig.COLOR_ERROR)))
-                    value_item.setIcon(QtGui.QIcon(':qtutils/fugue/exclamation'))
-                    tooltip = '%s: %s' % (value.__class__.__name__, str(value))
+                    parse_states.append(model.PARSE_ERROR)
                     self.tab_contains_errors = True
                 else:
-                    if value_item.background().color().name().lower() != self.colorConfig.COLOR_OK.lower():
-                        value_item.setBackground(QtGui.QBrush(QtGui.QColor(self.colorConfig.COLOR_OK)))
-                    if not value_item.icon().isNull():
-                        # self.logger.info('clearing icon')
-                        value_item.setData(None, QtCore.Qt.DecorationRole)
-                    tooltip = repr(value)
-                if value_item.toolTip() != tooltip:
-                    # self.logger.info('tooltip_changed')
-                    value_item.setToolTip(tooltip)
+                    parse_states.append(model.PARSE_OK)
+            model.set_parse_results(expansions, parse_states, evaluated)
             if self.tab_contains_errors:
                 self.set_tab_icon(':qtutils/fugue/exclamation')
             else:
@@ -1413,13 +1557,10 @@ class GroupTab(object):
         else:
             # Clear everything:
             self.set_tab_icon(None)
-            for row in range(self.globals_model.rowCount()):
-                item = self.globals_model.item(row, self.GLOBALS_COL_VALUE)
-                if item.data(self.GLOBALS_ROLE_IS_DUMMY_ROW):
-                    continue
-                item.setData(None, QtCore.Qt.DecorationRole)
-                item.setToolTip('Group inactive')
-                item.setData(None, QtCore.Qt.BackgroundRole)
+            n_globals = len(model.names)
+            model.set_parse_results(
+                model.expansions, [model.PARSE_INACTIVE] * n_globals, [None] * n_globals
+            )
 
 
 class RunmanagerMainWindow(QtWidgets.QMainWindow):
@@ -1475,6 +1616,244 @@ class PoppedOutOutputBoxWindow(QtWidgets.QDialog):
         app.on_output_popout_button_clicked()
 
 
+class CompileOutputRelay(object):
+    """Relays output from the compiler subprocess to an OutputBox, keeping the cost
+    of high-volume output bounded. The subprocess's output is redirected to
+    self.port, and runmanager's own messages about compilation should be written with
+    output(), so that they go the same way and are saved with it. Incoming text is
+    buffered in a thread and passed to the output box with its write() method once
+    per FLUSH_INTERVAL seconds, rather than once per message. If more lines arrive in
+    one interval than the output box's scrollback can hold, the oldest are dropped
+    before reaching it, since they would be scrolled out immediately anyway.
+    Consecutive identical lines are collapsed into a count if collapse_repeated_lines
+    is True. All output, including any that was dropped or collapsed, is saved to the
+    file given to start_log() until stop_log() is called."""
+
+    FLUSH_INTERVAL = 0.05
+
+    def __init__(self, output_box, scrollback_lines=1000, collapse_repeated_lines=False):
+        self.output_box = output_box
+        self.scrollback_lines = scrollback_lines
+        self.collapse_repeated_lines = collapse_repeated_lines
+        self.lock = threading.Lock()
+        self.log_file = None
+        # Text waiting to be passed to the output box, as [charformat, text] lists:
+        self.pending = collections.deque()
+        self.n_pending_lines = 0
+        self.n_dropped_lines = 0
+        # Whether incoming text is at the start of a line, and the last complete line
+        # and the number of times it has been repeated since, for collapsing repeats:
+        self.at_line_start = True
+        self.last_line = None
+        self.n_repeats = 0
+        self.context = Context.instance()
+        socket = self.context.socket(zmq.PULL)
+        socket.setsockopt(zmq.LINGER, 0)
+        self.port = socket.bind_to_random_port('tcp://127.0.0.1')
+        # One push socket per thread for output(), as in OutputBox:
+        self.local = threading.local()
+        self.shutting_down = threading.Event()
+        self.thread = threading.Thread(target=self.mainloop, args=(socket,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def output(self, text, red=False):
+        """Output text as with OutputBox.output(), along with the output of the
+        compiler subprocess and saved to the compile log, if any"""
+        if not hasattr(self.local, 'push_sock'):
+            self.local.push_sock = self.context.socket(zmq.PUSH)
+            self.local.push_sock.connect('tcp://127.0.0.1:%d' % self.port)
+        charformat = 'stderr' if red else 'stdout'
+        self.local.push_sock.send_multipart(
+            [charformat.encode('utf8'), text.encode('utf8')]
+        )
+
+    def start_log(self, path):
+        """Save all subsequent output to the file at path, until stop_log() is
+        called. Raises OSError if it cannot be opened."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        log_file = open(path, 'a', encoding='utf8')
+        with self.lock:
+            if self.log_file is not None:
+                self.log_file.close()
+            self.log_file = log_file
+
+    def stop_log(self):
+        with self.lock:
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
+
+    def mainloop(self, socket):
+        next_flush_time = None
+        while not self.shutting_down.is_set():
+            if next_flush_time is None:
+                timeout = 1000
+            else:
+                timeout = max(0, 1000 * (next_flush_time - time.monotonic()))
+            if socket.poll(timeout):
+                if next_flush_time is None:
+                    next_flush_time = time.monotonic() + self.FLUSH_INTERVAL
+                # Receive everything waiting, but not beyond when the next flush is due:
+                while time.monotonic() < next_flush_time:
+                    try:
+                        charformat, text = socket.recv_multipart(zmq.NOBLOCK)
+                    except zmq.Again:
+                        break
+                    self.receive(
+                        charformat.decode('utf8', errors='replace'),
+                        text.decode('utf8', errors='backslashreplace'),
+                    )
+            if next_flush_time is not None and time.monotonic() >= next_flush_time:
+                self.flush()
+                next_flush_time = None
+        socket.close(linger=0)
+        self.flush()
+
+    def receive(self, charformat, text):
+        with self.lock:
+            if self.log_file is not None:
+                self.log_file.write(text)
+            if not self.collapse_repeated_lines:
+                self._buffer(charformat, text)
+                return
+            for line in text.splitlines(True):
+                is_complete_line = self.at_line_start and line.endswith('\n')
+                if is_complete_line and (charformat, line) == self.last_line:
+                    self.n_repeats += 1
+                    continue
+                self._buffer_repeats()
+                self.last_line = (charformat, line) if is_complete_line else None
+                self._buffer(charformat, line)
+                self.at_line_start = line.endswith('\n')
+
+    def _buffer_repeats(self):
+        if self.n_repeats:
+            message = '[previous line repeated %d times]\n' % self.n_repeats
+            self._buffer('DEBUG', message)
+            self.n_repeats = 0
+
+    def _buffer(self, charformat, text):
+        if self.pending and self.pending[-1][0] == charformat:
+            self.pending[-1][1] += text
+        else:
+            self.pending.append([charformat, text])
+        self.n_pending_lines += text.count('\n')
+        # Drop the oldest lines if they would not fit in the scrollback anyway:
+        while self.n_pending_lines > self.scrollback_lines:
+            n_excess_lines = self.n_pending_lines - self.scrollback_lines
+            segment = self.pending[0]
+            n_lines = segment[1].count('\n')
+            if n_lines <= n_excess_lines:
+                self.pending.popleft()
+            else:
+                segment[1] = ''.join(segment[1].splitlines(True)[n_excess_lines:])
+                n_lines = n_excess_lines
+            self.n_pending_lines -= n_lines
+            self.n_dropped_lines += n_lines
+
+    def flush(self):
+        """Pass all buffered text to the output box"""
+        with self.lock:
+            # Show the number of repeats so far rather than waiting for the next
+            # different line, which may not come:
+            self._buffer_repeats()
+            pending = self.pending
+            n_dropped_lines = self.n_dropped_lines
+            self.pending = collections.deque()
+            self.n_pending_lines = 0
+            self.n_dropped_lines = 0
+        if n_dropped_lines:
+            message = '[%d lines not shown]\n' % n_dropped_lines
+            self.output_box.write(message, charformat='DEBUG')
+        # In chunks no larger than the output box adds to the widget at once, as the
+        # cost of adding a chunk grows faster than its number of lines:
+        n_lines = self.output_box.MAX_LINES_BATCH
+        for charformat, text in pending:
+            lines = text.splitlines(True)
+            for i in range(0, len(lines), n_lines):
+                chunk = ''.join(lines[i : i + n_lines])
+                self.output_box.write(chunk, charformat=charformat)
+
+    def shutdown(self):
+        self.shutting_down.set()
+        self.thread.join()
+        self.stop_log()
+
+
+class EventLoopWatchdog(object):
+    """Detects stalls of the Qt event loop. A timer in the main thread records a
+    heartbeat, and a daemon thread checks that the heartbeat is recent. If the main
+    thread has not returned to the event loop for longer than threshold seconds, the
+    stack of the main thread is logged, so that the code responsible for the stall
+    can be identified. The total duration of the stall is logged once the event loop
+    resumes. If output_box is given, a short summary is also printed there."""
+
+    def __init__(self, threshold, logger, output_box=None):
+        self.threshold = threshold
+        self.logger = logger
+        self.output_box = output_box
+        self.main_thread_id = threading.main_thread().ident
+        self.last_heartbeat = time.monotonic()
+        # Start time of the stall in progress, if any:
+        self.stall_start = None
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.heartbeat_timer = QtCore.QTimer()
+        self.heartbeat_timer.setInterval(max(10, int(1000 * self.threshold / 4)))
+        self.heartbeat_timer.timeout.connect(self.heartbeat)
+        self.thread = threading.Thread(target=self.mainloop)
+        self.thread.daemon = True
+
+    def start(self):
+        self.heartbeat()
+        self.heartbeat_timer.start()
+        self.thread.start()
+        self.logger.info('Event loop watchdog started, threshold %.2f s', self.threshold)
+
+    def stop(self):
+        self.heartbeat_timer.stop()
+        self.stopping.set()
+
+    def heartbeat(self):
+        now = time.monotonic()
+        with self.lock:
+            stall_start = self.stall_start
+            self.stall_start = None
+            self.last_heartbeat = now
+        if stall_start is not None:
+            duration = now - stall_start
+            self.logger.warning('Event loop resumed after stalling for %.2f s', duration)
+            if self.output_box is not None:
+                self.output_box.output(
+                    'Warning: GUI was unresponsive for %.1f s. See the runmanager log '
+                    'for details.\n' % duration,
+                    red=True,
+                )
+
+    def mainloop(self):
+        while not self.stopping.wait(self.threshold / 4):
+            last_heartbeat = self.last_heartbeat
+            stalled_for = time.monotonic() - last_heartbeat
+            if self.stall_start is not None or stalled_for < self.threshold:
+                continue
+            frame = sys._current_frames().get(self.main_thread_id)
+            if frame is None:
+                continue
+            stack = ''.join(traceback.format_stack(frame))
+            with self.lock:
+                if self.last_heartbeat != last_heartbeat:
+                    # The event loop resumed in the meantime:
+                    continue
+                # Only report each stall once:
+                self.stall_start = last_heartbeat
+            self.logger.warning(
+                'Event loop stalled for more than %.2f s. Main thread stack:\n%s',
+                stalled_for,
+                stack,
+            )
+
+
 class RunManager(object):
 
     # Constants for the model in the axes tab:
@@ -1513,7 +1892,22 @@ class RunManager(object):
             os.path.join(runmanager_dir, 'main.ui'), RunmanagerMainWindow()
         )
 
-        self.output_box = OutputBox(self.ui.verticalLayout_output_tab)
+        self.setup_config()
+        scrollback_lines = self.exp_config.getint(
+            'runmanager', 'output_box_scrollback_lines', fallback=1000
+        )
+        self.output_box = OutputBox(
+            self.ui.verticalLayout_output_tab, scrollback_lines=scrollback_lines
+        )
+        # Output of the compiler subprocess goes through this on its way to the output
+        # box, which also saves compile logs:
+        self.compile_output = CompileOutputRelay(
+            self.output_box,
+            scrollback_lines=scrollback_lines,
+            collapse_repeated_lines=self.exp_config.getboolean(
+                'runmanager', 'collapse_repeated_output_lines', fallback=False
+            ),
+        )
 
         # Add a 'pop-out' button to the output tab:
         output_tab_index = self.ui.tabWidget.indexOf(self.ui.tab_output)
@@ -1532,7 +1926,6 @@ class RunManager(object):
         self.output_box_window_verticalLayout.setContentsMargins(0, 0, 0, 0)
         self.output_box_window.setWindowTitle('runmanager output')
         self.output_box_window.resize(800, 1000)
-        self.setup_config()
         self.setup_axes_tab()
         self.setup_groups_tab()
         self.connect_signals()
@@ -1553,6 +1946,13 @@ class RunManager(object):
         self.experiment_shot_storage = self.exp_config.get('paths', 'experiment_shot_storage')
         # Store the currently open groups as {(globals_filename, group_name): GroupTab}
         self.currently_open_groups = {}
+        # State for self.bulk_update(). Whilst in a bulk update, preparsing, sorting
+        # of the groups model, and updating the check state of files to reflect their
+        # groups are deferred until the end of the update:
+        self.bulk_update_depth = 0
+        self.bulk_update_globals_changed = False
+        self.bulk_update_sort_required = False
+        self.bulk_update_globals_files = set()
 
         # A thread that will evaluate globals when they change, allowing us to
         # show their values and any errors in the tabs they came from.
@@ -1563,21 +1963,53 @@ class RunManager(object):
         # callers can call Queue.join() to wait for parsing to complete in a race-free
         # way
         self.preparse_globals_required = queue.Queue()
+        # Incremented whenever globals change, so that a preparse can tell if it is
+        # out of date:
+        self.preparse_generation = 0
+        # How long to wait after a change to globals for further changes before
+        # preparsing, in seconds:
+        self.preparse_debounce = self.exp_config.getfloat(
+            'runmanager', 'preparse_debounce', fallback=0.2
+        )
         self.preparse_globals_thread.start()
 
+        # Start a watchdog to log stalls of the Qt event loop longer than the
+        # configured threshold, in seconds. Zero or negative disables it:
+        watchdog_threshold = self.exp_config.getfloat(
+            'runmanager', 'watchdog_threshold', fallback=2.0
+        )
+        if watchdog_threshold > 0:
+            if self.exp_config.getboolean('runmanager', 'watchdog_output_box', fallback=False):
+                watchdog_output_box = self.output_box
+            else:
+                watchdog_output_box = None
+            self.event_loop_watchdog = EventLoopWatchdog(
+                watchdog_threshold, self.logger, watchdog_output_box
+            )
+            self.event_loop_watchdog.start()
+        else:
+            self.event_loop_watchdog = None
+
         # A flag telling the compilation thread to abort:
         self.compilation_aborted = threading.Event()
 
-        # A few attributes for self.guess_expansion_modes() to keep track of
-        # its state, and thus detect changes:
-        self.previous_evaled_globals = {}
-        self.previous_global_hierarchy = {}
-        self.previous_expansion_types = {}
-        self.previous_expansions = {}
+        # Guesses expansion modes of globals as they change, keeping track of their
+        # previous values to detect changes:
+        self.expansion_mode_guesser = runmanager.ExpansionModeGuesser()
 
         # The prospective number of shots resulting from compilation
         self.n_shots = None
 
+        # If a staging directory is configured, run files are created and compiled
+        # there, and moved to the shot output folder in the background:
+        staging_dir = self.exp_config.get('runmanager', 'staging_dir', fallback='')
+        if staging_dir:
+            self.run_file_mover = RunFileMover(
+                staging_dir, on_error=self.on_run_file_move_error
+            )
+        else:
+            self.run_file_mover = None
+
         # Start the loop that allows compilations to be queued up:
         self.compile_queue = queue.Queue()
         self.compile_queue_thread = threading.Thread(target=self.compile_loop)
@@ -1588,16 +2020,27 @@ class RunManager(object):
         # Start the compiler subprocess:
         self.to_child, self.from_child, self.child = process_tree.subprocess(
             os.path.join(runmanager_dir, 'batch_compiler.py'),
-            output_redirection_port=self.output_box.port,
+            output_redirection_port=self.compile_output.port,
         )
         self.logger.info('compiler subprocess started')
 
         # Is blank until a labscript file is selected:
         self.previous_default_output_folder = ''
-
-        # Start a thread to monitor the time of day and create new shot output
-        # folders for each day:
-        inthread(self.rollover_shot_output_folder)
+        # The text of lineEdit_labscript_file, for reading from any thread:
+        self.current_labscript_file = ''
+
+        # The default output folder, which is recomputed when the labscript file
+        # changes, after compiling, and in a thread at midnight, whereupon the shot
+        # output folder is updated if the default is in use:
+        self.default_output_folder = DefaultOutputFolder(
+            self.exp_config, on_change=self.on_default_output_folder_changed
+        )
+        # Watches the sequence index file of the selected labscript file, so that the
+        # default output folder is also updated when another process compiles a
+        # sequence:
+        self.sequence_index_watcher = QtCore.QFileSystemWatcher()
+        self.sequence_index_watcher.fileChanged.connect(self.on_sequence_index_changed)
+        self.sequence_index_watcher.directoryChanged.connect(self.on_sequence_index_changed)
         self.non_default_folder = None
 
         # The data from the last time we saved the configuration, so we can
@@ -1681,6 +2124,18 @@ class RunManager(object):
         self.groups_model = QtGui.QStandardItemModel()
         self.groups_model.setHorizontalHeaderLabels(['File/group name', 'Active', 'Delete', 'Open/Close'])
         self.groups_model.setSortRole(self.GROUPS_ROLE_SORT_DATA)
+        # Indexes of the name items in the model, kept up to date as rows are added,
+        # removed and renamed, so that we can look them up without searching the
+        # model. {globals_file: item}, {(globals_file, group_name): item}, and
+        # {globals_file: item} for the <Click to add group> rows:
+        self.globals_file_items = {}
+        self.group_name_items = {}
+        self.groups_dummy_items = {}
+        # The set of (globals_file, group_name) of active groups, kept up to date as
+        # groups are checked/unchecked, renamed, deleted and closed, so that any
+        # thread can read it without iterating over the model:
+        self.active_groups = set()
+        self.active_groups_lock = threading.Lock()
         self.ui.treeView_groups.setModel(self.groups_model)
         self.ui.treeView_groups.setAnimated(True)  # Pretty
         self.ui.treeView_groups.setSelectionMode(QtWidgets.QTreeView.ExtendedSelection)
@@ -1756,6 +2211,7 @@ class RunManager(object):
 
         # Tab closebutton clicked:
         self.ui.tabWidget.tabCloseRequested.connect(self.on_tabCloseRequested)
+        self.ui.tabWidget.currentChanged.connect(self.on_tabWidget_currentChanged)
 
         # Axes tab; right click menu, menu actions, reordering
         # self.ui.treeView_axes.customContextMenuRequested.connect(self.on_treeView_axes_context_menu_requested)
@@ -1811,7 +2267,11 @@ class RunManager(object):
                 return False
             if reply == QtWidgets.QMessageBox.Yes:
                 self.save_configuration(self.last_save_config_file)
+        if self.event_loop_watchdog is not None:
+            self.event_loop_watchdog.stop()
+        self.default_output_folder.stop()
         self.to_child.put(['quit', None])
+        self.compile_output.shutdown()
         return True
 
     def close_current_tab(self):
@@ -1918,6 +2378,8 @@ class RunManager(object):
         # file is selected:
         self.ui.toolButton_select_shot_output_folder.setEnabled(enabled)
         self.ui.lineEdit_labscript_file.setToolTip(text)
+        self.current_labscript_file = text
+        self.update_sequence_index_watcher()
         # Check if the output folder needs to be updated:
         self.check_output_folder_update()
 
@@ -1932,43 +2394,129 @@ class RunManager(object):
         self.ui.label_non_default_folder.setVisible(self.non_default_folder)
         self.ui.lineEdit_shot_output_folder.setToolTip(text)
 
+    def get_engage_settings(self, interactive=True):
+        """Return the settings from the GUI required to compile a sequence, as a tuple
+        (send_to_BLACS, send_to_runviewer, labscript_file, shuffle, output_folder,
+        BLACS_host, active_groups, expansion_order). Raises an exception if they are
+        not valid."""
+        send_to_BLACS = self.ui.checkBox_run_shots.isChecked()
+        send_to_runviewer = self.ui.checkBox_view_shots.isChecked()
+        labscript_file = self.ui.lineEdit_labscript_file.text()
+        # even though we shuffle on a per global basis, if ALL of the globals are set to shuffle, then we may as well shuffle again. This helps shuffle shots more randomly than just shuffling within each level (because without this, you would still do all shots with the outer most variable the same, etc)
+        shuffle = self.ui.pushButton_shuffle.checkState() == QtCore.Qt.Checked
+        if not labscript_file:
+            raise Exception('Error: No labscript file selected')
+        output_folder = self.ui.lineEdit_shot_output_folder.text()
+        if not output_folder:
+            raise Exception('Error: No output folder selected')
+        BLACS_host = self.ui.lineEdit_BLACS_hostname.text()
+        active_groups = self.get_active_groups(interactive=interactive)
+        # Get ordering of expansion globals
+        expansion_order = {}
+        for i in range(self.axes_model.rowCount()):
+            item = self.axes_model.item(i, self.AXES_COL_NAME)
+            shuffle_item = self.axes_model.item(i, self.AXES_COL_SHUFFLE)
+            name = item.data(self.AXES_ROLE_NAME)
+            expansion_order[name] = {'order':i, 'shuffle':shuffle_item.checkState()}
+        return (
+            send_to_BLACS,
+            send_to_runviewer,
+            labscript_file,
+            shuffle,
+            output_folder,
+            BLACS_host,
+            active_groups,
+            expansion_order,
+        )
+
     def on_engage_clicked(self):
         self.logger.info('Engage')
         try:
-            send_to_BLACS = self.ui.checkBox_run_shots.isChecked()
-            send_to_runviewer = self.ui.checkBox_view_shots.isChecked()
-            labscript_file = self.ui.lineEdit_labscript_file.text()
-            # even though we shuffle on a per global basis, if ALL of the globals are set to shuffle, then we may as well shuffle again. This helps shuffle shots more randomly than just shuffling within each level (because without this, you would still do all shots with the outer most variable the same, etc)
-            shuffle = self.ui.pushButton_shuffle.checkState() == QtCore.Qt.Checked
-            if not labscript_file:
-                raise Exception('Error: No labscript file selected')
-            output_folder = self.ui.lineEdit_shot_output_folder.text()
-            if not output_folder:
-                raise Exception('Error: No output folder selected')
-            BLACS_host = self.ui.lineEdit_BLACS_hostname.text()
+            (
+                send_to_BLACS,
+                send_to_runviewer,
+                labscript_file,
+                shuffle,
+                output_folder,
+                BLACS_host,
+                active_groups,
+                expansion_order,
+            ) = self.get_engage_settings()
             self.logger.info('Parsing globals...')
-            active_groups = self.get_active_groups()
-            # Get ordering of expansion globals
-            expansion_order = {}
-            for i in range(self.axes_model.rowCount()):
-                item = self.axes_model.item(i, self.AXES_COL_NAME)
-                shuffle_item = self.axes_model.item(i, self.AXES_COL_SHUFFLE)
-                name = item.data(self.AXES_ROLE_NAME)
-                expansion_order[name] = {'order':i, 'shuffle':shuffle_item.checkState()}
-            
             try:
                 sequenceglobals, shots, evaled_globals, global_hierarchy, expansions = self.parse_globals(active_groups, expansion_order=expansion_order)
             except Exception as e:
                 raise Exception('Error parsing globals:\n%s\nCompilation aborted.' % str(e))
             self.logger.info('Making h5 files')
-            labscript_file, run_files = self.make_h5_files(
+            labscript_file, run_files, compile_log = self.make_h5_files(
                 labscript_file, output_folder, sequenceglobals, shots, shuffle)
             self.ui.pushButton_abort.setEnabled(True)
-            self.compile_queue.put([labscript_file, run_files, send_to_BLACS, BLACS_host, send_to_runviewer])
+            self.compile_queue.put([labscript_file, run_files, compile_log, send_to_BLACS, BLACS_host, send_to_runviewer])
         except Exception as e:
             self.output_box.output('%s\n\n' % str(e), red=True)
         self.logger.info('end engage')
 
+    def engage_with_overrides(self, overrides=None, scan=None, raw=False):
+        """Compile a sequence with some globals overridden or scanned over for this
+        sequence only, as per runmanager.apply_global_overrides(). Neither the globals
+        files nor the GUI are modified, and the overrides are recorded in the run files.
+        Called from the remote server thread, exceptions are raised to the caller."""
+        self.logger.info('Engage with overrides')
+        (
+            send_to_BLACS,
+            send_to_runviewer,
+            labscript_file,
+            shuffle,
+            output_folder,
+            BLACS_host,
+            active_groups,
+            expansion_order,
+        ) = inmain(self.get_engage_settings, interactive=False)
+        sequence_globals = runmanager.get_globals(active_groups)
+        # Guess the expansion modes of the overridden globals as the GUI would if they
+        # were set in the globals files, without writing them there:
+        expansion_mode_guesser = runmanager.ExpansionModeGuesser()
+        expansion_mode_guesser.prime(sequence_globals)
+        sequence_globals, override_expressions = runmanager.apply_global_overrides(
+            sequence_globals, overrides, scan, raw
+        )
+        try:
+            (
+                sequence_globals,
+                evaled_globals,
+                _,
+                _,
+            ) = runmanager.evaluate_globals_guessing_expansions(
+                active_groups, expansion_mode_guesser, sequence_globals=sequence_globals
+            )
+            shots = runmanager.expand_globals(
+                sequence_globals, evaled_globals, expansion_order
+            )
+        except Exception as e:
+            raise Exception('Error parsing globals:\n%s\nCompilation aborted.' % str(e))
+        self.output_box.output(
+            'Engaging with overrides: %s\n' % ', '.join(sorted(override_expressions))
+        )
+        labscript_file, run_files, compile_log = self.make_h5_files(
+            labscript_file,
+            output_folder,
+            sequence_globals,
+            shots,
+            shuffle,
+            overrides=override_expressions,
+        )
+        inmain(self.ui.pushButton_abort.setEnabled, True)
+        self.compile_queue.put(
+            [
+                labscript_file,
+                run_files,
+                compile_log,
+                send_to_BLACS,
+                BLACS_host,
+                send_to_runviewer,
+            ]
+        )
+
     def on_abort_clicked(self):
         self.compilation_aborted.set()
 
@@ -2003,7 +2551,7 @@ class RunManager(object):
         self.output_box.output('Spawning new compiler subprocess...')
         self.to_child, self.from_child, self.child = process_tree.subprocess(
             os.path.join(runmanager_dir, 'batch_compiler.py'),
-            output_redirection_port=self.output_box.port,
+            output_redirection_port=self.compile_output.port,
         )
         self.output_box.output('done.\n')
         self.output_box.output('Ready.\n\n')
@@ -2015,6 +2563,14 @@ class RunManager(object):
                 self.close_group(globals_file, group_name)
                 break
 
+    def on_tabWidget_currentChanged(self, index):
+        # Group tabs are populated when first shown:
+        tab_page = self.ui.tabWidget.widget(index)
+        for group_tab in self.currently_open_groups.values():
+            if group_tab.ui is tab_page:
+                group_tab.ensure_populated()
+                break
+
     def on_treeView_axes_context_menu_requested(self, point):
         raise NotImplementedError
         # menu = QtWidgets.QMenu(self.ui)
@@ -2211,8 +2767,9 @@ class RunManager(object):
         active_items = (item for item in selected_items
                         if item.column() == self.GROUPS_COL_ACTIVE
                         and item.parent() is not None)
-        for item in active_items:
-            item.setCheckState(checked_state)
+        with self.bulk_update():
+            for item in active_items:
+                item.setCheckState(checked_state)
 
     def on_groups_delete_selected_triggered(self):
         selected_indexes = self.ui.treeView_groups.selectedIndexes()
@@ -2227,10 +2784,11 @@ class RunManager(object):
         if confirm_multiple:
             if not question_dialog("Delete %d groups?" % len(name_items)):
                 return
-        for item in name_items:
-            globals_file = item.parent().text()
-            group_name = item.text()
-            self.delete_group(globals_file, group_name, confirm=not confirm_multiple)
+        with self.bulk_update():
+            for item in name_items:
+                globals_file = item.parent().text()
+                group_name = item.text()
+                self.delete_group(globals_file, group_name, confirm=not confirm_multiple)
 
     def on_groups_open_selected_triggered(self):
         selected_indexes = self.ui.treeView_groups.selectedIndexes()
@@ -2246,13 +2804,14 @@ class RunManager(object):
                 # Exclude <add new group> item, which is not selectable
                 name_items += [child for child in children if child.isSelectable() ]
 
-        for item in name_items:
-            globals_file = item.parent().text()
-            group_name = item.text()
-            if (globals_file, group_name) not in self.currently_open_groups:
-                self.open_group(globals_file, group_name, trigger_preparse=False)
-        if name_items:
-            self.globals_changed()
+        with self.bulk_update():
+            for item in name_items:
+                globals_file = item.parent().text()
+                group_name = item.text()
+                if (globals_file, group_name) not in self.currently_open_groups:
+                    self.open_group(globals_file, group_name, trigger_preparse=False)
+            if name_items:
+                self.globals_changed()
 
     def on_groups_close_selected_groups_triggered(self):
         selected_indexes = self.ui.treeView_groups.selectedIndexes()
@@ -2260,11 +2819,12 @@ class RunManager(object):
         name_items = [item for item in selected_items
                       if item.column() == self.GROUPS_COL_NAME
                       and item.parent() is not None]
-        for item in name_items:
-            globals_file = item.parent().text()
-            group_name = item.text()
-            if (globals_file, group_name) in self.currently_open_groups:
-                self.close_group(globals_file, group_name)
+        with self.bulk_update():
+            for item in name_items:
+                globals_file = item.parent().text()
+                group_name = item.text()
+                if (globals_file, group_name) in self.currently_open_groups:
+                    self.close_group(globals_file, group_name)
 
     def on_groups_close_selected_files_triggered(self):
         selected_indexes = self.ui.treeView_groups.selectedIndexes()
@@ -2281,9 +2841,10 @@ class RunManager(object):
             if not question_dialog('Close %d file(s)? This will close %d currently open group(s).' %
                                    (len(name_items), child_is_open.count(True))):
                 return
-        for item in name_items:
-            globals_file = item.text()
-            self.close_globals_file(globals_file, confirm=False)
+        globals_files = [item.text() for item in name_items]
+        with self.bulk_update():
+            for globals_file in globals_files:
+                self.close_globals_file(globals_file, confirm=False)
 
     def on_open_globals_file_clicked(self):
         globals_file = QtWidgets.QFileDialog.getOpenFileName(self.ui,
@@ -2407,7 +2968,7 @@ class RunManager(object):
             else:
                 raise AssertionError('Invalid Check state')
             # If this changed the sort order, ensure the item is still visible:
-            scroll_view_to_row_if_current(self.ui.treeView_groups, item)
+            scroll_view_to_row_if_current(self.ui.treeView_groups, item.index())
         elif parent_item is None:
             # They clicked on a globals file row.
             globals_file = name_item.text()
@@ -2517,27 +3078,29 @@ class RunManager(object):
             check_state = item.checkState()
             # Ensure sort data matches active state:
             item.setData(check_state, self.GROUPS_ROLE_SORT_DATA)
+            parent_item = item.parent()
+            if parent_item is not None and not item.data(self.GROUPS_ROLE_IS_DUMMY_ROW):
+                # A group's checkbox. Record whether it is active:
+                name_item = parent_item.child(item.row(), self.GROUPS_COL_NAME)
+                key = parent_item.text(), name_item.data(self.GROUPS_ROLE_PREVIOUS_NAME)
+                with self.active_groups_lock:
+                    if check_state == QtCore.Qt.Checked:
+                        self.active_groups.add(key)
+                    else:
+                        self.active_groups.discard(key)
             if self.on_groups_model_active_changed_recursion_depth > 1:
                 # Prevent all below code from running in response to data changes
                 # initiated from within this method itself. The code above this
                 # check still runs in response to all changes.
                 return
 
-            parent_item = item.parent()
             if parent_item is not None:
                 # A 'group active' checkbox changed due to external action (not from this method itself).
                 # Update the parent file checkbox to reflect the state of its children
-                children = [parent_item.child(i, self.GROUPS_COL_ACTIVE) for i in range(parent_item.rowCount())]
-                child_states = [child.checkState() for child in children
-                                if not child.data(self.GROUPS_ROLE_IS_DUMMY_ROW)]
-                parent_active_index = parent_item.index().sibling(parent_item.index().row(), self.GROUPS_COL_ACTIVE)
-                parent_active_item = self.groups_model.itemFromIndex(parent_active_index)
-                if all(state == QtCore.Qt.Checked for state in child_states):
-                    parent_active_item.setCheckState(QtCore.Qt.Checked)
-                elif all(state == QtCore.Qt.Unchecked for state in child_states):
-                    parent_active_item.setCheckState(QtCore.Qt.Unchecked)
+                if self.bulk_update_depth:
+                    self.bulk_update_globals_files.add(parent_item.text())
                 else:
-                    parent_active_item.setCheckState(QtCore.Qt.PartiallyChecked)
+                    self.update_file_active_state(parent_item)
             else:
                 # A 'file active' checkbox changed due to external action (not from this method itself).
                 # Update the check state of all children to match.
@@ -2555,6 +3118,54 @@ class RunManager(object):
                 # Trigger a preparse to occur:
                 self.globals_changed()
 
+    def update_file_active_state(self, file_name_item):
+        """Set the check state of a globals file's 'active' checkbox to reflect the
+        check states of its groups"""
+        children = [file_name_item.child(i, self.GROUPS_COL_ACTIVE) for i in range(file_name_item.rowCount())]
+        child_states = [child.checkState() for child in children
+                        if not child.data(self.GROUPS_ROLE_IS_DUMMY_ROW)]
+        file_active_item = self.groups_model.item(file_name_item.row(), self.GROUPS_COL_ACTIVE)
+        if all(state == QtCore.Qt.Checked for state in child_states):
+            file_active_item.setCheckState(QtCore.Qt.Checked)
+        elif all(state == QtCore.Qt.Unchecked for state in child_states):
+            file_active_item.setCheckState(QtCore.Qt.Unchecked)
+        else:
+            file_active_item.setCheckState(QtCore.Qt.PartiallyChecked)
+
+    @contextlib.contextmanager
+    def bulk_update(self):
+        """Context manager for making many changes to the groups model at once, such
+        as loading a configuration or acting on multiple selected groups. Requests to
+        preparse globals and to sort the groups model are coalesced and done once at
+        the end, as is updating the check state of globals files to match their
+        groups. May be nested. Must be used from the main thread."""
+        self.bulk_update_depth += 1
+        try:
+            yield
+        finally:
+            if self.bulk_update_depth == 1:
+                globals_files = self.bulk_update_globals_files
+                self.bulk_update_globals_files = set()
+                # As in on_groups_model_active_changed, the file check state is set
+                # with the recursion depth incremented so that the change does not
+                # propagate back to the file's groups:
+                self.on_groups_model_active_changed_recursion_depth += 1
+                try:
+                    for globals_file in globals_files:
+                        # Skip files that were closed during the update:
+                        if globals_file in self.globals_file_items:
+                            self.update_file_active_state(self.globals_file_items[globals_file])
+                finally:
+                    self.on_groups_model_active_changed_recursion_depth -= 1
+            self.bulk_update_depth -= 1
+            if self.bulk_update_depth == 0:
+                if self.bulk_update_sort_required:
+                    self.bulk_update_sort_required = False
+                    self.do_model_sort()
+                if self.bulk_update_globals_changed:
+                    self.bulk_update_globals_changed = False
+                    self.globals_changed()
+
     def on_groups_model_openclose_changed(self, item):
         """Sets item sort data and icon in response to the open/close state of a group
         changing."""
@@ -2579,39 +3190,44 @@ class RunManager(object):
                 item.setToolTip('Load globals group into runmanager.')
             self.do_model_sort()
             # If this changed the sort order, ensure the item is still visible:
-            scroll_view_to_row_if_current(self.ui.treeView_groups, item)
+            scroll_view_to_row_if_current(self.ui.treeView_groups, item.index())
 
-    @inmain_decorator()
     def get_default_output_folder(self):
         """Returns what the default output folder would be right now, based on
         the current date and selected labscript file. Returns empty string if
         no labscript file is selected. Does not create the default output
-        folder, does not check if it exists."""
-        current_labscript_file = self.ui.lineEdit_labscript_file.text()
-        if not current_labscript_file:
-            return ''
-        _, default_output_folder, _ = runmanager.new_sequence_details(
-            current_labscript_file,
-            config=self.exp_config,
-            increment_sequence_index=False,
-        )
-        default_output_folder = os.path.normpath(default_output_folder)
-        return default_output_folder
-
-    def rollover_shot_output_folder(self):
-        """Runs in a thread, checking every 30 seconds if the default output folder has
-        changed, likely because the date has changed, but also possible because another
-        instance of runmanager has incremented the sequence index. If the defaulr output
-        folder has changed, and if runmanager is configured to use the default output
-        folder, sets the folder in which compiled shots will be put. Does not create the
-        folder if it does not already exist, this will be done at compile-time."""
-        while True:
-            time.sleep(30)
-            try:
-                self.check_output_folder_update()
-            except Exception as e:
-                # Don't stop the thread.
-                self.logger.exception(f"error checking default output folder: {e}")
+        folder, does not check if it exists. The folder is cached by
+        self.default_output_folder, so this is cheap unless the labscript file
+        has changed. Can be called from any thread."""
+        return self.default_output_folder.get(self.current_labscript_file)
+
+    def on_default_output_folder_changed(self, folder):
+        """Called in a thread by self.default_output_folder when the default output
+        folder has changed at midnight. If runmanager is configured to use the
+        default output folder, sets the folder in which compiled shots will be put.
+        Does not create the folder if it does not already exist, this will be done at
+        compile-time."""
+        self.check_output_folder_update()
+
+    @inmain_decorator()
+    def update_sequence_index_watcher(self):
+        """Watch those of the paths the sequence index of the selected labscript file
+        depends on that exist, see DefaultOutputFolder.watched_paths()"""
+        watched = self.sequence_index_watcher.files()
+        watched += self.sequence_index_watcher.directories()
+        if watched:
+            self.sequence_index_watcher.removePaths(watched)
+        paths = self.default_output_folder.watched_paths(self.current_labscript_file)
+        paths = [path for path in paths if os.path.exists(path)]
+        if paths:
+            self.sequence_index_watcher.addPaths(paths)
+
+    def on_sequence_index_changed(self, path):
+        # The sequence index may have been incremented by another process. Watch the
+        # paths afresh, in case any were created or replaced:
+        self.default_output_folder.invalidate()
+        self.update_sequence_index_watcher()
+        self.check_output_folder_update()
 
     @inmain_decorator()
     def check_output_folder_update(self):
@@ -2637,6 +3253,12 @@ class RunManager(object):
         """Called from either self, a GroupTab, or the RemoteServer to inform runmanager
         that something about globals has changed, and that they need parsing again."""
         self.ui.pushButton_engage.setEnabled(False)
+        if self.bulk_update_depth:
+            self.bulk_update_globals_changed = True
+            return
+        # Increment the generation first, so that any preparse in progress, which
+        # will be stale, is abandoned:
+        self.preparse_generation += 1
         self.preparse_globals_required.put(None)
 
     def update_axes_indentation(self):
@@ -2723,7 +3345,14 @@ class RunManager(object):
             n_shots_string = '({} shots)'.format(n_shots)
         self.ui.pushButton_engage.setText('Engage {}'.format(n_shots_string))
 
-    def preparse_globals(self):
+    def preparse_globals(self, generation=None):
+        """Parse globals and display the results. If generation is given, the
+        parse is abandoned by raising runmanager.EvaluationInterrupted as soon as
+        self.preparse_generation no longer matches it, that is, as soon as
+        globals have changed again, since the results would be stale."""
+        def interrupt():
+            return generation is not None and self.preparse_generation != generation
+
         active_groups = self.get_active_groups()
         if active_groups is None:
             # There was an error, get_active_groups has already shown
@@ -2731,21 +3360,29 @@ class RunManager(object):
             return
         # Expansion mode is automatically updated when the global's
         # type changes. If this occurs, we will have to parse again to
-        # include the change:
+        # include the change. the expansion mode guesser makes all the changes
+        # required in one go, so this normally parses at most twice:
         while True:
-            results = self.parse_globals(active_groups, raise_exceptions=False, expand_globals=False, return_dimensions = True)
+            results = self.parse_globals(active_groups, raise_exceptions=False, expand_globals=False, return_dimensions = True, interrupt=interrupt)
             sequence_globals, shots, evaled_globals, global_hierarchy, expansions, dimensions = results
-            self.n_shots = len(shots)
-            expansions_changed = self.guess_expansion_modes(
+            if interrupt():
+                raise runmanager.EvaluationInterrupted()
+            expansions_changed = self.expansion_mode_guesser.guess(
                 active_groups, evaled_globals, global_hierarchy, expansions)
             if not expansions_changed:
-                # Now expand globals while parsing to calculate the number of shots.
-                # this must only be done after the expansion type guessing has been updated to avoid exceptions
-                # when changing a zip group from a list to a single value
-                results = self.parse_globals(active_groups, raise_exceptions=False, expand_globals=True, return_dimensions = True)
-                sequence_globals, shots, evaled_globals, global_hierarchy, expansions, dimensions = results
+                # Now expand globals to calculate the number of shots. This must only
+                # be done after the expansion type guessing has been updated to avoid
+                # exceptions when changing a zip group from a list to a single value.
+                # Nothing has changed since parsing, so there is no need to parse
+                # again first:
+                shots, dimensions = runmanager.expand_globals(
+                    sequence_globals, evaled_globals, return_dimensions=True
+                )
                 self.n_shots = len(shots)
                 break
+        if interrupt():
+            # Don't display stale results:
+            raise runmanager.EvaluationInterrupted()
         self.update_tabs_parsing_indication(active_groups, sequence_globals, evaled_globals, self.n_shots)
         self.update_axes_tab(expansions, dimensions)
         self.logger.info('Globals parsed')
@@ -2760,21 +3397,35 @@ class RunManager(object):
                 # Wait until we're needed:
                 self.preparse_globals_required.get()
                 n_requests = 1
-                # Wait until the main thread is idle before clearing the queue of
-                # requests. This way if preparsing is triggered multiple times within
-                # the main thread before it becomes idle, we can respond to this all at
-                # once, once they are all done, rather than starting too early and
-                # having to preparse again.
-                with qtlock:
-                    while True:
-                        try:
-                            self.preparse_globals_required.get(block=False)
-                            n_requests += 1
-                        except queue.Empty:
-                            break
+                while True:
+                    # Wait until the main thread is idle before clearing the queue of
+                    # requests. This way if preparsing is triggered multiple times
+                    # within the main thread before it becomes idle, we can respond to
+                    # this all at once, once they are all done, rather than starting
+                    # too early and having to preparse again.
+                    with qtlock:
+                        while True:
+                            try:
+                                self.preparse_globals_required.get(block=False)
+                                n_requests += 1
+                            except queue.Empty:
+                                break
+                    # Then wait until there have been no further requests for the
+                    # debounce window, so that a burst of changes, such as from typing
+                    # quickly or a remote script, results in only one preparse:
+                    try:
+                        self.preparse_globals_required.get(timeout=self.preparse_debounce)
+                        n_requests += 1
+                    except queue.Empty:
+                        break
                 # Do some work:
                 self.logger.info(f'Pre-parsing globals with {n_requests:d} requests')
-                self.preparse_globals()
+                try:
+                    self.preparse_globals(generation=self.preparse_generation)
+                except runmanager.EvaluationInterrupted:
+                    # Globals changed during parsing. There is already a newer
+                    # request in the queue:
+                    self.logger.info('Pre-parse abandoned as globals changed')
                 # Tell any callers calling preparse_globals_required.join() that we are
                 # done with their request:
                 for _ in range(n_requests):
@@ -2791,74 +3442,61 @@ class RunManager(object):
 
     def get_group_item_by_name(self, globals_file, group_name, column, previous_name=None):
         """Returns an item from the row representing a globals group in the
-        groups model. Which item is returned is set by the column argument."""
-        parent_item = self.groups_model.findItems(globals_file, column=self.GROUPS_COL_NAME)[0]
-        possible_name_items = self.groups_model.findItems(group_name, QtCore.Qt.MatchRecursive,
-                                                          column=self.GROUPS_COL_NAME)
-        # Don't accidentally match on other groups or files with the same name
-        # as this group:
-        possible_name_items = [item for item in possible_name_items if item.parent() == parent_item]
-        if previous_name is not None:
-            # Also filter by previous name, useful for telling rows apart when
-            # a rename is in progress and two rows may temporarily contain the
-            # same name (though the rename code with throw an error and revert
-            # it).
-            possible_name_items = [item for item in possible_name_items
-                                   if item.data(self.GROUPS_ROLE_PREVIOUS_NAME) == previous_name]
-        elif group_name != self.GROUPS_DUMMY_ROW_TEXT:
-            # Don't return the dummy item unless they asked for it explicitly
-            # - if a new group is being created, its name might be
-            # simultaneously present in its own row and the dummy row too.
-            possible_name_items = [item for item in possible_name_items
-                                   if not item.data(self.GROUPS_ROLE_IS_DUMMY_ROW)]
-
-        if len(possible_name_items) > 1:
-            raise LookupError('Multiple items found')
-        elif not possible_name_items:
-            raise LookupError('No item found')
-        name_item = possible_name_items[0]
-        name_index = name_item.index()
+        groups model. Which item is returned is set by the column argument.
+        If previous_name is given, the row is looked up by it instead of by
+        group_name, useful when a rename is in progress and the name item
+        contains the new name already. The dummy row is only returned if
+        asked for explicitly - if a new group is being created, its name is
+        in the dummy row, and passing previous_name=GROUPS_DUMMY_ROW_TEXT
+        returns it."""
+        try:
+            if previous_name == self.GROUPS_DUMMY_ROW_TEXT or (
+                previous_name is None and group_name == self.GROUPS_DUMMY_ROW_TEXT
+            ):
+                name_item = self.groups_dummy_items[globals_file]
+            elif previous_name is not None:
+                name_item = self.group_name_items[globals_file, previous_name]
+            else:
+                name_item = self.group_name_items[globals_file, group_name]
+        except KeyError:
+            raise LookupError('No item found') from None
         # Found the name item, get the sibling item for the column requested:
-        item_index = name_index.sibling(name_index.row(), column)
-        item = self.groups_model.itemFromIndex(item_index)
-        return item
+        return name_item.parent().child(name_item.row(), column)
 
     def do_model_sort(self):
+        if self.bulk_update_depth:
+            self.bulk_update_sort_required = True
+            return
         header = self.ui.treeView_groups.header()
         sort_column = header.sortIndicatorSection()
         sort_order = header.sortIndicatorOrder()
         self.ui.treeView_groups.sortByColumn(sort_column, sort_order)
 
-    @inmain_decorator()  # Can be called from a non-main thread
     def get_active_groups(self, interactive=True):
         """Returns active groups in the format {group_name: globals_file}.
         Displays an error dialog and returns None if multiple groups of the
         same name are selected, this is invalid - selected groups must be
-        uniquely named. If interactive=False, raises the exception instead."""
+        uniquely named. If interactive=False, raises the exception instead.
+        Can be called from any thread."""
+        with self.active_groups_lock:
+            active_groups_list = sorted(self.active_groups)
         active_groups = {}
-        for i in range(self.groups_model.rowCount()):
-            file_name_item = self.groups_model.item(i, self.GROUPS_COL_NAME)
-            for j in range(file_name_item.rowCount()):
-                group_name_item = file_name_item.child(j, self.GROUPS_COL_NAME)
-                group_active_item = file_name_item.child(j, self.GROUPS_COL_ACTIVE)
-                if group_active_item.checkState() == QtCore.Qt.Checked:
-                    group_name = group_name_item.text()
-                    globals_file = file_name_item.text()
-                    if group_name in active_groups:
-                        msg = (
-                            'There are two active groups named %s. ' % group_name
-                            + 'Active groups must have unique names.'
-                        )
-                        if interactive:
-                            error_dialog(msg)
-                            return
-                        raise RuntimeError(msg)
-                    active_groups[group_name] = globals_file
+        for globals_file, group_name in active_groups_list:
+            if group_name in active_groups:
+                msg = (
+                    'There are two active groups named %s. ' % group_name
+                    + 'Active groups must have unique names.'
+                )
+                if interactive:
+                    error_dialog(msg)
+                    return
+                raise RuntimeError(msg)
+            active_groups[group_name] = globals_file
         return active_groups
 
     def open_globals_file(self, globals_file):
         # Do nothing if this file is already open:
-        if self.groups_model.findItems(globals_file, column=self.GROUPS_COL_NAME):
+        if globals_file in self.globals_file_items:
             return
 
         # Get the groups:
@@ -2888,11 +3526,13 @@ class RunManager(object):
         file_close_item.setToolTip('Close globals file.')
 
         self.groups_model.appendRow([file_name_item, file_active_item, file_delete_item, file_close_item])
+        self.globals_file_items[globals_file] = file_name_item
 
         # Add the groups as children:
         for group_name in groups:
             row = self.make_group_row(group_name)
             file_name_item.appendRow(row)
+            self.group_name_items[globals_file, group_name] = row[self.GROUPS_COL_NAME]
 
         # Finally, add the <Click to add group> row at the bottom:
         dummy_name_item = QtGui.QStandardItem(self.GROUPS_DUMMY_ROW_TEXT)
@@ -2921,12 +3561,13 @@ class RunManager(object):
         # anything, yay.
 
         file_name_item.appendRow([dummy_name_item, dummy_active_item, dummy_delete_item, dummy_open_close_item])
+        self.groups_dummy_items[globals_file] = dummy_name_item
         # Expand the child items to be visible:
         self.ui.treeView_groups.setExpanded(file_name_item.index(), True)
         self.globals_changed()
         self.do_model_sort()
         # If this changed the sort order, ensure the file item is visible:
-        scroll_view_to_row_if_current(self.ui.treeView_groups, file_name_item)
+        scroll_view_to_row_if_current(self.ui.treeView_groups, file_name_item.index())
 
     def make_group_row(self, group_name):
         """Returns a new row representing one group in the groups tab, ready to be
@@ -2966,7 +3607,7 @@ class RunManager(object):
         return row
 
     def close_globals_file(self, globals_file, confirm=True):
-        item = self.groups_model.findItems(globals_file, column=self.GROUPS_COL_NAME)[0]
+        item = self.globals_file_items[globals_file]
         # Close any open groups in this globals file:
 
         child_name_items = [item.child(i, self.GROUPS_COL_NAME) for i in range(item.rowCount())]
@@ -2984,6 +3625,12 @@ class RunManager(object):
 
         # Remove the globals file from the model:
         self.groups_model.removeRow(item.row())
+        del self.globals_file_items[globals_file]
+        del self.groups_dummy_items[globals_file]
+        for key in [key for key in self.group_name_items if key[0] == globals_file]:
+            del self.group_name_items[key]
+        with self.active_groups_lock:
+            self.active_groups = {key for key in self.active_groups if key[0] != globals_file}
         self.globals_changed()
 
     def copy_group(self, source_globals_file, source_group_name, dest_globals_file=None, delete_source_group=False):
@@ -3003,15 +3650,13 @@ class RunManager(object):
                 dest_globals_file = source_globals_file
 
             # find the new groups parent row by filepath
-            for index in range(self.groups_model.rowCount()):
-                if self.groups_model.item(index, self.GROUPS_COL_NAME).text() == dest_globals_file:
-                    parent_row = self.groups_model.item(index)
-                    break
+            parent_row = self.globals_file_items[dest_globals_file]
 
             last_index = parent_row.rowCount()
             # Insert it as the row before the last (dummy) row:
             group_row = self.make_group_row(dest_group_name)
             parent_row.insertRow(last_index - 1, group_row)
+            self.group_name_items[dest_globals_file, dest_group_name] = group_row[self.GROUPS_COL_NAME]
             self.do_model_sort()
 
             # Open the group
@@ -3025,7 +3670,7 @@ class RunManager(object):
                 self.delete_group(source_globals_file, source_group_name, confirm=False)
 
             # If this changed the sort order, ensure the group item is still visible:
-            scroll_view_to_row_if_current(self.ui.treeView_groups, name_item)
+            scroll_view_to_row_if_current(self.ui.treeView_groups, name_item.index())
 
     def new_group(self, globals_file, group_name):
         item = self.get_group_item_by_name(globals_file, group_name, self.GROUPS_COL_NAME,
@@ -3041,6 +3686,7 @@ class RunManager(object):
             last_index = item.parent().rowCount()
             # Insert it as the row before the last (dummy) row:
             item.parent().insertRow(last_index - 1, group_row)
+            self.group_name_items[globals_file, group_name] = group_row[self.GROUPS_COL_NAME]
             self.do_model_sort()
             # Open the group and mark it active:
             self.open_group(globals_file, group_name)
@@ -3050,7 +3696,7 @@ class RunManager(object):
             self.globals_changed()
             self.ui.treeView_groups.setCurrentIndex(name_item.index())
             # If this changed the sort order, ensure the group item is still visible:
-            scroll_view_to_row_if_current(self.ui.treeView_groups, name_item)
+            scroll_view_to_row_if_current(self.ui.treeView_groups, name_item.index())
         finally:
             # Set the dummy row's text back ready for another group to be created:
             item.setText(self.GROUPS_DUMMY_ROW_TEXT)
@@ -3059,6 +3705,9 @@ class RunManager(object):
         assert (globals_file, group_name) not in self.currently_open_groups  # sanity check
         group_tab = GroupTab(self.ui.tabWidget, globals_file, group_name)
         self.currently_open_groups[globals_file, group_name] = group_tab
+        if self.ui.tabWidget.currentWidget() is group_tab.ui:
+            # It was made current before we could respond to currentChanged:
+            group_tab.ensure_populated()
 
         # Set the open/close state in the groups_model. itemChanged will be
         # emitted and self.on_groups_model_item_changed will handle updating
@@ -3084,9 +3733,15 @@ class RunManager(object):
         else:
             item.setData(new_group_name, self.GROUPS_ROLE_PREVIOUS_NAME)
             item.setData(new_group_name, self.GROUPS_ROLE_SORT_DATA)
+            del self.group_name_items[globals_file, previous_group_name]
+            self.group_name_items[globals_file, new_group_name] = item
+            with self.active_groups_lock:
+                if (globals_file, previous_group_name) in self.active_groups:
+                    self.active_groups.remove((globals_file, previous_group_name))
+                    self.active_groups.add((globals_file, new_group_name))
             self.do_model_sort()
             # If this changed the sort order, ensure the group item is still visible:
-            scroll_view_to_row_if_current(self.ui.treeView_groups, item)
+            scroll_view_to_row_if_current(self.ui.treeView_groups, item.index())
             group_tab = self.currently_open_groups.pop((globals_file, previous_group_name), None)
             if group_tab is not None:
                 # Change labels and tooltips appropriately if the group is open:
@@ -3113,6 +3768,9 @@ class RunManager(object):
         # Find the entry for this group in self.groups_model and remove it:
         name_item = self.get_group_item_by_name(globals_file, group_name, self.GROUPS_COL_NAME)
         name_item.parent().removeRow(name_item.row())
+        del self.group_name_items[globals_file, group_name]
+        with self.active_groups_lock:
+            self.active_groups.discard((globals_file, group_name))
         self.globals_changed()
 
     def on_save_configuration_triggered(self):
@@ -3258,113 +3916,135 @@ class RunManager(object):
         self.load_configuration(file)
 
     def load_configuration(self, filename):
-        self.last_save_config_file = filename
-        self.ui.actionSave_configuration.setText('Save configuration %s'%filename)
-        # Close all files:
-        save_data = self.get_save_data()
-        for globals_file in save_data['h5_files_open']:
-            self.close_globals_file(globals_file, confirm=False)
-        # Ensure folder exists, if this was opened programmatically we are
-        # creating the file, so the directory had better exist!
-        runmanager_config = load_appconfig(filename).get('runmanager_state', {})
-
-        has_been_a_warning = [False]
-        def warning(message):
-            if not has_been_a_warning[0]:
-                has_been_a_warning[0] = True
-                self.output_box.output('\n')
-            self.output_box.output('Warning: %s\n' % message, red=True)
-
-        for globals_file in runmanager_config.get('h5_files_open', []):
-            if os.path.exists(globals_file):
-                try:
-                    self.open_globals_file(globals_file)
-                    self.last_opened_globals_folder = os.path.dirname(globals_file)
-                except Exception:
-                    raise_exception_in_thread(sys.exc_info())
-                    continue
-            else:
-                self.output_box.output('\nWarning: globals file %s no longer exists\n' % globals_file, red=True)
+        start_time = time.perf_counter()
+        # Defer preparsing and sorting until everything is loaded:
+        with self.bulk_update():
+            self.last_save_config_file = filename
+            self.ui.actionSave_configuration.setText('Save configuration %s'%filename)
+            # Close all files:
+            save_data = self.get_save_data()
+            for globals_file in save_data['h5_files_open']:
+                self.close_globals_file(globals_file, confirm=False)
+            # Ensure folder exists, if this was opened programmatically we are
+            # creating the file, so the directory had better exist!
+            runmanager_config = load_appconfig(filename).get('runmanager_state', {})
+
+            has_been_a_warning = [False]
+            def warning(message):
+                if not has_been_a_warning[0]:
+                    has_been_a_warning[0] = True
+                    self.output_box.output('\n')
+                self.output_box.output('Warning: %s\n' % message, red=True)
+
+            for globals_file in runmanager_config.get('h5_files_open', []):
+                if os.path.exists(globals_file):
+                    try:
+                        self.open_globals_file(globals_file)
+                        self.last_opened_globals_folder = os.path.dirname(globals_file)
+                    except Exception:
+                        raise_exception_in_thread(sys.exc_info())
+                        continue
+                else:
+                    self.output_box.output('\nWarning: globals file %s no longer exists\n' % globals_file, red=True)
 
-        for globals_file, group_name in runmanager_config.get('active_groups', []):
-            try:
-                group_active_item = self.get_group_item_by_name(globals_file, group_name, self.GROUPS_COL_ACTIVE)
-                group_active_item.setCheckState(QtCore.Qt.Checked)
-            except LookupError:
-                warning("previously active group '%s' in %s no longer exists" % (group_name, globals_file))
+            for globals_file, group_name in runmanager_config.get('active_groups', []):
+                try:
+                    group_active_item = self.get_group_item_by_name(globals_file, group_name, self.GROUPS_COL_ACTIVE)
+                    group_active_item.setCheckState(QtCore.Qt.Checked)
+                except LookupError:
+                    warning("previously active group '%s' in %s no longer exists" % (group_name, globals_file))
 
-        for globals_file, group_name in runmanager_config.get('groups_open', []):
-            # First check if it exists:
-            try:
-                self.get_group_item_by_name(globals_file, group_name, self.GROUPS_COL_NAME)
-            except LookupError:
-                warning("previously open group '%s' in %s no longer exists" % (group_name, globals_file))
-            else:
-                self.open_group(globals_file, group_name)
+            for globals_file, group_name in runmanager_config.get('groups_open', []):
+                # First check if it exists:
+                try:
+                    self.get_group_item_by_name(globals_file, group_name, self.GROUPS_COL_NAME)
+                except LookupError:
+                    warning("previously open group '%s' in %s no longer exists" % (group_name, globals_file))
+                else:
+                    self.open_group(globals_file, group_name)
 
-        current_labscript_file = runmanager_config.get('current_labscript_file')
-        if current_labscript_file is not None:
-            if os.path.exists(current_labscript_file):
-                self.ui.lineEdit_labscript_file.setText(current_labscript_file)
-                self.last_opened_labscript_folder = os.path.dirname(current_labscript_file)
-            elif current_labscript_file:
-                warning('previously selected labscript file %s no longer exists' % current_labscript_file)
-
-        shot_output_folder = runmanager_config.get('shot_output_folder')
-        if shot_output_folder is not None:
-            self.ui.lineEdit_shot_output_folder.setText(shot_output_folder)
-            self.last_selected_shot_output_folder = os.path.dirname(shot_output_folder)
-
-        if runmanager_config.get('is_using_default_shot_output_folder', False):
-            default_output_folder = self.get_default_output_folder()
-            self.ui.lineEdit_shot_output_folder.setText(default_output_folder)
-            self.last_selected_shot_output_folder = os.path.dirname(default_output_folder)
-
-        send_to_runviewer = runmanager_config.get('send_to_runviewer')
-        if send_to_runviewer is not None:
-            self.ui.checkBox_view_shots.setChecked(send_to_runviewer)
-
-        send_to_blacs = runmanager_config.get('send_to_blacs')
-        if send_to_blacs is not None:
-            self.ui.checkBox_run_shots.setChecked(send_to_blacs)
-        
-        # clear the axes model first
-        if self.axes_model.rowCount():
-            self.axes_model.removeRows(0, self.axes_model.rowCount())
-
-        # set the state of the global shuffle button. This ensure that if no axes items get loaded afterwards
-        # (e.g. because the globals in the .ini file are no longer expansion globals), then we still have 
-        # an approximate state for the shuffle button that will apply to whatever globals are to be expanded.
-        if runmanager_config.get('shuffle', False):
-            self.ui.pushButton_shuffle.setChecked(True)
-
-        # Now load the axes states (order and shuffle). This will also ensure the shuffle button matches the 
-        # state of these items (since we don't save/restore the tri-state nature of the global shuffle button
-        axes = runmanager_config.get('axes')
-        if axes is not None and isinstance(axes, list):
-            # clear model
-            for name, shuffle in axes:
-                self.add_item_to_axes_model(name, shuffle)
-            self.update_axes_indentation() 
-
-        blacs_host = runmanager_config.get('blacs_host')
-        if blacs_host is not None:
-            self.ui.lineEdit_BLACS_hostname.setText(blacs_host)
-
-        # Set as self.last_save_data:
-        save_data = self.get_save_data()
-        self.last_save_data = save_data
-        self.ui.actionSave_configuration_as.setEnabled(True)
-        self.ui.actionRevert_configuration.setEnabled(True)
+            current_labscript_file = runmanager_config.get('current_labscript_file')
+            if current_labscript_file is not None:
+                if os.path.exists(current_labscript_file):
+                    self.ui.lineEdit_labscript_file.setText(current_labscript_file)
+                    self.last_opened_labscript_folder = os.path.dirname(current_labscript_file)
+                elif current_labscript_file:
+                    warning('previously selected labscript file %s no longer exists' % current_labscript_file)
+
+            shot_output_folder = runmanager_config.get('shot_output_folder')
+            if shot_output_folder is not None:
+                self.ui.lineEdit_shot_output_folder.setText(shot_output_folder)
+                self.last_selected_shot_output_folder = os.path.dirname(shot_output_folder)
+
+            if runmanager_config.get('is_using_default_shot_output_folder', False):
+                default_output_folder = self.get_default_output_folder()
+                self.ui.lineEdit_shot_output_folder.setText(default_output_folder)
+                self.last_selected_shot_output_folder = os.path.dirname(default_output_folder)
+
+            send_to_runviewer = runmanager_config.get('send_to_runviewer')
+            if send_to_runviewer is not None:
+                self.ui.checkBox_view_shots.setChecked(send_to_runviewer)
+
+            send_to_blacs = runmanager_config.get('send_to_blacs')
+            if send_to_blacs is not None:
+                self.ui.checkBox_run_shots.setChecked(send_to_blacs)
+
+            # clear the axes model first
+            if self.axes_model.rowCount():
+                self.axes_model.removeRows(0, self.axes_model.rowCount())
+
+            # set the state of the global shuffle button. This ensure that if no axes items get loaded afterwards
+            # (e.g. because the globals in the .ini file are no longer expansion globals), then we still have 
+            # an approximate state for the shuffle button that will apply to whatever globals are to be expanded.
+            if runmanager_config.get('shuffle', False):
+                self.ui.pushButton_shuffle.setChecked(True)
+
+            # Now load the axes states (order and shuffle). This will also ensure the shuffle button matches the 
+            # state of these items (since we don't save/restore the tri-state nature of the global shuffle button
+            axes = runmanager_config.get('axes')
+            if axes is not None and isinstance(axes, list):
+                # clear model
+                for name, shuffle in axes:
+                    self.add_item_to_axes_model(name, shuffle)
+                self.update_axes_indentation() 
+
+            blacs_host = runmanager_config.get('blacs_host')
+            if blacs_host is not None:
+                self.ui.lineEdit_BLACS_hostname.setText(blacs_host)
+
+            # Set as self.last_save_data:
+            save_data = self.get_save_data()
+            self.last_save_data = save_data
+            self.ui.actionSave_configuration_as.setEnabled(True)
+            self.ui.actionRevert_configuration.setEnabled(True)
+        self.output_box.output(
+            'Loaded configuration %s in %.2f s\n' % (filename, time.perf_counter() - start_time)
+        )
 
     def compile_loop(self):
         while True:
             try:
-                labscript_file, run_files, send_to_BLACS, BLACS_host, send_to_runviewer = self.compile_queue.get()
+                labscript_file, run_files, compile_log, send_to_BLACS, BLACS_host, send_to_runviewer = self.compile_queue.get()
                 run_files = iter(run_files)  # Should already be in iterator but just in case
+                if compile_log is not None:
+                    try:
+                        self.compile_output.start_log(compile_log)
+                    except OSError as e:
+                        self.compile_output.output('Could not save compile log: %s\n' % str(e), red=True)
+
+                def submit(run_file):
+                    # Called in this thread, or in the run file mover's thread once the
+                    # run file has been moved out of the staging directory:
+                    if self.compilation_aborted.is_set():
+                        return
+                    if send_to_BLACS:
+                        self.send_to_BLACS(run_file, BLACS_host)
+                    if send_to_runviewer:
+                        self.send_to_runviewer(run_file)
+
                 while True:
                     if self.compilation_aborted.is_set():
-                        self.output_box.output('Compilation aborted.\n\n', red=True)
+                        self.compile_output.output('Compilation aborted.\n\n', red=True)
                         break
                     try:
                         try:
@@ -3373,7 +4053,7 @@ class RunManager(object):
                             # create an extra file unnecessarily.
                             run_file = next(run_files)
                         except StopIteration:
-                            self.output_box.output('Ready.\n\n')
+                            self.compile_output.output('Ready.\n\n')
                             break
                         else:
                             self.to_child.put(['compile', [labscript_file, run_file]])
@@ -3382,13 +4062,19 @@ class RunManager(object):
                             if not success:
                                 self.compilation_aborted.set()
                                 continue
-                            if send_to_BLACS:
-                                self.send_to_BLACS(run_file, BLACS_host)
-                            if send_to_runviewer:
-                                self.send_to_runviewer(run_file)
+                            if (
+                                self.run_file_mover is not None
+                                and self.run_file_mover.is_staged(run_file)
+                            ):
+                                self.run_file_mover.move(run_file, submit)
+                            else:
+                                submit(run_file)
                     except Exception as e:
-                        self.output_box.output(str(e) + '\n', red=True)
+                        self.compile_output.output(str(e) + '\n', red=True)
                         self.compilation_aborted.set()
+                if self.run_file_mover is not None:
+                    self.run_file_mover.finish()
+                self.compile_output.stop_log()
                 inmain(self.ui.pushButton_abort.setEnabled, False)
                 self.compilation_aborted.clear()
             except Exception:
@@ -3398,10 +4084,12 @@ class RunManager(object):
                 raise_exception_in_thread(exc_info)
                 continue
 
-    def parse_globals(self, active_groups, raise_exceptions=True, expand_globals=True, expansion_order = None, return_dimensions = False):
+    def parse_globals(self, active_groups, raise_exceptions=True, expand_globals=True, expansion_order = None, return_dimensions = False, interrupt=None):
         sequence_globals = runmanager.get_globals(active_groups)
         #logger.info('got sequence globals')
-        evaled_globals, global_hierarchy, expansions = runmanager.evaluate_globals(sequence_globals, raise_exceptions)
+        evaled_globals, global_hierarchy, expansions = runmanager.evaluate_globals(
+            sequence_globals, raise_exceptions, interrupt=interrupt
+        )
         #logger.info('evaluated sequence globals')
         if expand_globals:
             if return_dimensions:
@@ -3417,176 +4105,9 @@ class RunManager(object):
         else:
             return sequence_globals, shots, evaled_globals, global_hierarchy, expansions
 
-    def guess_expansion_modes(self, active_groups, evaled_globals, global_hierarchy, expansions):
-        """This function is designed to be called iteratively. It changes the
-        expansion type of globals that reference other globals - such that
-        globals referencing an iterable global will be zipped with it, rather
-        than outer producted. Each time this method is called,
-        self.parse_globals should also be called, so that the globals are
-        evaluated with their new expansion modes, if they changed. This should
-        be performed repeatedly until there are no more changes. Note that
-        this method does not return what expansion types it thinks globals
-        should have - it *actually writes them to the globals HDF5 file*. So
-        it is up to later code to ensure it re-reads the expansion mode from
-        the HDF5 file before proceeding. At present this method is only called
-        from self.preparse_globals(), so see there to see how it fits in with
-        everything else. This method uses four instance attributes to store
-        state: self.previous_evaled_globals, self.previous_global_hierarchy,
-        self.previous_expansion_types and self.previous_expansions. This is
-        neccesary so that it can detect changes."""
-
-        # Do nothing if there were exceptions:
-        for group_name in evaled_globals:
-            for global_name in evaled_globals[group_name]:
-                value = evaled_globals[group_name][global_name]
-                if isinstance(value, Exception):
-                    # Let ExpansionErrors through through, as they occur
-                    # when the user has changed the value without changing
-                    # the expansion type:
-                    if isinstance(value, runmanager.ExpansionError):
-                        continue
-                    return False
-        # Did the guessed expansion type for any of the globals change?
-        expansion_types_changed = False
-        expansion_types = {}
-        for group_name in evaled_globals:
-            for global_name in evaled_globals[group_name]:
-                new_value = evaled_globals[group_name][global_name]
-                try:
-                    previous_value = self.previous_evaled_globals[group_name][global_name]
-                except KeyError:
-                    # This variable is used to guess the expansion type
-                    # 
-                    # If we already have an expansion specified for this, but
-                    # don't have a previous value, then we should use the 
-                    # new_value for the guess as we are likely loading from HDF5
-                    # file for the first time (and either way, don't want to 
-                    # overwrite what the user has put in the expansion type)
-                    #
-                    # If we don't have an expansion...
-                    # then we set it to '0' which will result in an
-                    # expansion type guess of '' (emptys string) This will
-                    # either result in nothing being done to the expansion
-                    # type or the expansion type being found to be 'outer',
-                    # which will then make it go through the machinery below
-                    if global_name in expansions and expansions[global_name]:
-                        previous_value = new_value
-                    else:
-                        previous_value = 0
-
-                new_guess = runmanager.guess_expansion_type(new_value)
-                previous_guess = runmanager.guess_expansion_type(previous_value)
-
-                if new_guess == 'outer':
-                    expansion_types[global_name] = {'previous_guess': previous_guess,
-                                                    'new_guess': new_guess,
-                                                    'group_name': group_name,
-                                                    'value': new_value
-                                                    }
-                elif new_guess != previous_guess:
-                    filename = active_groups[group_name]
-                    runmanager.set_expansion(filename, group_name, global_name, new_guess)
-                    expansions[global_name] = new_guess
-                    expansion_types_changed = True
-
-        # recursively find dependencies and add them to a zip group!
-        def find_dependencies(global_name, global_hierarchy, expansion_types):
-            results = set()
-            for name, dependencies in global_hierarchy.items():
-                if name in expansion_types and global_name in dependencies:
-                    results.add(name)
-                    results = results.union(find_dependencies(name, global_hierarchy, expansion_types))
-            return results
-
-        def global_depends_on_global_with_outer_product(global_name, global_hierarchy, expansions):
-            if global_name not in global_hierarchy:
-                return False
-            else:
-                for dependency in global_hierarchy[global_name]:
-                    if expansions[dependency]:
-                        return True
-
-        def set_expansion_type_guess(expansion_types, expansions, global_name, expansion_to_set, new=True):
-            if new:
-                key = 'new_guess'
-            else:
-                key = 'previous_guess'
-                
-            # debug logging
-            log_if_global(global_name, [], 'setting expansion type for new dependency' if new else 'setting expansion type for old dependencies')
-            
-            
-            # only do this if the expansion is *not* already set to a specific zip group
-            if global_name in expansions and expansions[global_name] != '' and expansions[global_name] != 'outer':
-                expansion_types[global_name][key] = expansions[global_name]
-                
-                # debug logging
-                log_if_global(global_name, [], 'Using existing expansion %s for %s'%(expansions[global_name], global_name))
-            else:
-                expansion_types[global_name][key] = expansion_to_set
-                expansions[global_name] = expansion_to_set
-                
-                # debug logging
-                log_if_global(global_name, [], 'Using existing expansion %s for %s'%(expansion_to_set, global_name))
-            
-        
-        for global_name in sorted(expansion_types):
-            # we have a global that does not depend on anything that has an
-            # expansion type of 'outer'
-            if (not global_depends_on_global_with_outer_product(global_name, global_hierarchy, expansions)
-                    and not isinstance(expansion_types[global_name]['value'], runmanager.ExpansionError)):
-                current_dependencies = find_dependencies(global_name, global_hierarchy, expansion_types)
-
-                # if this global has other globals that use it, then add them
-                # all to a zip group with the name of this global
-                if current_dependencies:
-                    for dependency in current_dependencies:                        
-                        set_expansion_type_guess(expansion_types, expansions, dependency,  str(global_name))
-                            
-                    set_expansion_type_guess(expansion_types, expansions, global_name,  str(global_name))
-
-        for global_name in sorted(self.previous_expansion_types):
-            if (not global_depends_on_global_with_outer_product(
-                global_name, self.previous_global_hierarchy, self.previous_expansions)
-                    and not isinstance(self.previous_expansion_types[global_name]['value'], runmanager.ExpansionError)):
-                old_dependencies = find_dependencies(global_name, self.previous_global_hierarchy, self.previous_expansion_types)
-                # if this global has other globals that use it, then add them
-                # all to a zip group with the name of this global
-                if old_dependencies:
-                    for dependency in old_dependencies:
-                        if dependency in expansion_types:
-                            set_expansion_type_guess(expansion_types, self.previous_expansions, dependency, str(global_name), new=False)
-                    if global_name in expansion_types:
-                        set_expansion_type_guess(expansion_types, self.previous_expansions, global_name, str(global_name), new=False)
-
-        for global_name, guesses in expansion_types.items():
-            if guesses['new_guess'] != guesses['previous_guess']:
-                filename = active_groups[guesses['group_name']]
-                runmanager.set_expansion(
-                    filename, str(guesses['group_name']), str(global_name), str(guesses['new_guess']))
-                expansions[global_name] = guesses['new_guess']
-                expansion_types_changed = True
-
-        # Now check everything that has an expansion type not equal to outer.
-        # If it has one, but is not iteratble, remove it from teh zip group
-        for group_name in evaled_globals:
-            for global_name in evaled_globals[group_name]:
-                if expansions[global_name] and expansions[global_name] != 'outer':
-                    try:
-                        iter(evaled_globals[group_name][global_name])
-                    except Exception:
-                        filename = active_groups[group_name]
-                        runmanager.set_expansion(filename, group_name, global_name, '')
-                        expansion_types_changed = True
-
-        self.previous_evaled_globals = evaled_globals
-        self.previous_global_hierarchy = global_hierarchy
-        self.previous_expansion_types = expansion_types
-        self.previous_expansions = expansions
-
-        return expansion_types_changed
-
-    def make_h5_files(self, labscript_file, output_folder, sequence_globals, shots, shuffle):
+    def make_h5_files(
+        self, labscript_file, output_folder, sequence_globals, shots, shuffle, overrides=None
+    ):
         sequence_attrs, default_output_dir, filename_prefix = runmanager.new_sequence_details(
             labscript_file, config=self.exp_config, increment_sequence_index=True
         )
@@ -3594,32 +4115,69 @@ class RunManager(object):
             # The user is using dthe efault output folder. Just in case the sequence
             # index has been updated or the date has changed, use the default_output dir
             # obtained from new_sequence_details, as it is race-free, whereas the one
-            # from the UI may be out of date since we only update it once a second.
+            # from the UI may be out of date if another process has compiled a
+            # sequence since we last updated it.
             output_folder = default_output_dir
+        # We have incremented the sequence index, so the default output folder is
+        # likely different now:
+        self.default_output_folder.invalidate()
+        self.update_sequence_index_watcher()
         self.check_output_folder_update()
+        if self.run_file_mover is not None:
+            # Create and compile the run files in the staging directory. They are
+            # moved to the output folder by the run file mover once compiled:
+            run_files_folder = self.run_file_mover.staged_folder(output_folder)
+        else:
+            run_files_folder = output_folder
         run_files = runmanager.make_run_files(
-            output_folder,
+            run_files_folder,
             sequence_globals,
             shots,
             sequence_attrs,
             filename_prefix,
             shuffle,
+            overrides=overrides,
+            manifest=self.exp_config.getboolean(
+                'runmanager', 'sequence_manifest', fallback=False
+            ),
+            sidecar=self.exp_config.getboolean(
+                'runmanager', 'sequence_globals_sidecar', fallback=False
+            ),
+            compression=self.exp_config.get(
+                'runmanager', 'global_dataset_compression', fallback=None
+            ),
+            private=self.exp_config.getboolean(
+                'runmanager', 'atomic_run_files', fallback=False
+            ),
         )
         self.logger.debug(run_files)
-        return labscript_file, run_files
+        if self.exp_config.getboolean('runmanager', 'save_compile_logs', fallback=False):
+            compile_log = os.path.join(output_folder, filename_prefix + '_compile.log')
+        else:
+            compile_log = None
+        return labscript_file, run_files, compile_log
+
+    def on_run_file_move_error(self, staged_path, final_path, error):
+        # Called from the run file mover's thread:
+        self.output_box.output(
+            'Could not move %s to %s: %s\nThe file remains at %s, and was not '
+            'submitted.\n' % (os.path.basename(staged_path), final_path, str(error), staged_path),
+            red=True,
+        )
+        self.compilation_aborted.set()
 
     def send_to_BLACS(self, run_file, BLACS_hostname):
         port = int(self.exp_config.get('ports', 'BLACS'))
         agnostic_path = shared_drive.path_to_agnostic(run_file)
-        self.output_box.output('Submitting run file %s.\n' % os.path.basename(run_file))
+        self.compile_output.output('Submitting run file %s.\n' % os.path.basename(run_file))
         try:
             response = zmq_get(port, BLACS_hostname, data=agnostic_path)
             if 'added successfully' in response:
-                self.output_box.output(response)
+                self.compile_output.output(response)
             else:
                 raise Exception(response)
         except Exception as e:
-            self.output_box.output('Couldn\'t submit job to control server: %s\n' % str(e), red=True)
+            self.compile_output.output('Couldn\'t submit job to control server: %s\n' % str(e), red=True)
             self.compilation_aborted.set()
 
     def send_to_runviewer(self, run_file):
@@ -3648,27 +4206,66 @@ class RunManager(object):
             try:
                 zmq_get(runviewer_port, 'localhost', data='hello', timeout=15)
             except Exception as e:
-                self.output_box.output('Couldn\'t submit shot to runviewer: %s\n\n' % str(e), red=True)
+                self.compile_output.output('Couldn\'t submit shot to runviewer: %s\n\n' % str(e), red=True)
 
         try:
             response = zmq_get(runviewer_port, 'localhost', data=agnostic_path, timeout=0.5)
             if 'ok' not in response:
                 raise Exception(response)
             else:
-                self.output_box.output('Shot %s sent to runviewer.\n' % os.path.basename(run_file))
+                self.compile_output.output('Shot %s sent to runviewer.\n' % os.path.basename(run_file))
         except Exception as e:
-            self.output_box.output('Couldn\'t submit shot to runviewer: %s\n\n' % str(e), red=True)
+            self.compile_output.output('Couldn\'t submit shot to runviewer: %s\n\n' % str(e), red=True)
+
 
+class RemoteServer(runmanager.remote.Server):
+    # Commands handled concurrently. They read only immutable snapshots of GUI state:
+    # settings from a cache updated in the main thread, so as not to wait for it, and
+    # active groups copied under app.active_groups_lock by app.get_active_groups():
+    read_only_commands = runmanager.remote.READ_ONLY_COMMANDS
 
-class RemoteServer(ZMQServer):
     def __init__(self):
+        # Must be instantiated in the main thread.
+        self.settings_lock = threading.Lock()
+        self.update_cached_settings()
+        app.ui.checkBox_run_shots.toggled.connect(self.update_cached_settings)
+        app.ui.checkBox_view_shots.toggled.connect(self.update_cached_settings)
+        app.ui.pushButton_shuffle.stateChanged.connect(self.update_cached_settings)
+        app.ui.lineEdit_labscript_file.textChanged.connect(self.update_cached_settings)
+        app.ui.lineEdit_shot_output_folder.textChanged.connect(
+            self.update_cached_settings
+        )
         port = app.exp_config.getint(
             'ports', 'runmanager', fallback=runmanager.remote.DEFAULT_PORT
         )
-        ZMQServer.__init__(self, port=port)
+        binary_port = app.exp_config.getint(
+            'ports', 'runmanager_binary', fallback=runmanager.remote.DEFAULT_BINARY_PORT
+        )
+        runmanager.remote.Server.__init__(self, port=port, binary_port=binary_port)
+
+    def update_cached_settings(self, *args):
+        """Called in the main thread when any of the settings read by remote commands
+        change. The snapshot is read-only and replaced rather than modified, so that
+        worker threads may use it after getting it with get_cached_settings()"""
+        settings = types.MappingProxyType(
+            {
+                'run_shots': app.ui.checkBox_run_shots.isChecked(),
+                'view_shots': app.ui.checkBox_view_shots.isChecked(),
+                'shuffle': app.ui.pushButton_shuffle.isChecked(),
+                'labscript_file': app.ui.lineEdit_labscript_file.text(),
+                'shot_output_folder': app.ui.lineEdit_shot_output_folder.text(),
+                'output_folder_default': not app.non_default_folder,
+            }
+        )
+        with self.settings_lock:
+            self.cached_settings = settings
+
+    def get_cached_settings(self):
+        with self.settings_lock:
+            return self.cached_settings
 
     def handle_get_globals(self, raw=False):
-        active_groups = inmain(app.get_active_groups, interactive=False)
+        active_groups = app.get_active_groups(interactive=False)
         sequence_globals = runmanager.get_globals(active_groups)
         all_globals = {}
         if raw:
@@ -3683,6 +4280,9 @@ class RemoteServer(ZMQServer):
                 all_globals.update(group_globals)
         return all_globals
 
+    def handle_get_active_groups(self):
+        return app.get_active_groups(interactive=False)
+
     @inmain_decorator()
     def handle_set_globals(self, globals, raw=False):
         active_groups = app.get_active_groups(interactive=False)
@@ -3692,7 +4292,14 @@ class RemoteServer(ZMQServer):
                 # Unless raw=True, convert to str representation for saving to the GUI
                 # or file. If this does not result in an object the user can actually
                 # use, evaluation will error and the caller will find out about it later
-                if not raw:
+                if (
+                    not raw
+                    and isinstance(new_value, np.ndarray)
+                    and new_value.nbytes >= runmanager.ARRAY_DATASET_THRESHOLD
+                ):
+                    # Large arrays are stored as datasets rather than as text:
+                    new_value = runmanager.ArrayExpression(new_value)
+                elif not raw:
                     new_value = repr(new_value)
                 elif not isinstance(new_value, (str, bytes)):
                     msg = "global %s must be a string if raw=True, not %s"
@@ -3750,33 +4357,40 @@ class RemoteServer(ZMQServer):
             # globals that depend on them, etc.
             app.globals_changed()
 
-    def handle_engage(self):
+    def handle_engage(self, overrides=None, scan=None, raw=False):
+        if overrides or scan:
+            # No need to wait for preparsing, since nothing is read from the GUI but
+            # the active groups and settings:
+            app.engage_with_overrides(overrides, scan, raw)
+            return
         app.wait_until_preparse_complete()
         inmain(app.on_engage_clicked)
 
+    def handle_evaluate(self, proposed_globals, raw=False):
+        active_groups = app.get_active_groups(interactive=False)
+        sequence_globals = runmanager.get_globals(active_groups)
+        return runmanager.evaluate_proposed_globals(sequence_globals, proposed_globals, raw)
+
     @inmain_decorator()
     def handle_abort(self):
         app.on_abort_clicked()
 
-    @inmain_decorator()
     def handle_get_run_shots(self):
-        return app.ui.checkBox_run_shots.isChecked()
+        return self.get_cached_settings()['run_shots']
 
     @inmain_decorator()
     def handle_set_run_shots(self, value):
         app.ui.checkBox_run_shots.setChecked(value)
 
-    @inmain_decorator()
     def handle_get_view_shots(self):
-        return app.ui.checkBox_view_shots.isChecked()
+        return self.get_cached_settings()['view_shots']
 
     @inmain_decorator()
     def handle_set_view_shots(self, value):
         app.ui.checkBox_view_shots.setChecked(value)
 
-    @inmain_decorator()
     def handle_get_shuffle(self):
-        return app.ui.pushButton_shuffle.isChecked()
+        return self.get_cached_settings()['shuffle']
 
     @inmain_decorator()
     def handle_set_shuffle(self, value):
@@ -3788,9 +4402,8 @@ class RemoteServer(ZMQServer):
         app.wait_until_preparse_complete()
         return app.n_shots
 
-    @inmain_decorator()
     def handle_get_labscript_file(self):
-        labscript_file = app.ui.lineEdit_labscript_file.text()
+        labscript_file = self.get_cached_settings()['labscript_file']
         return os.path.abspath(labscript_file)
 
     @inmain_decorator()
@@ -3798,9 +4411,8 @@ class RemoteServer(ZMQServer):
         labscript_file = os.path.abspath(value)
         app.ui.lineEdit_labscript_file.setText(labscript_file)
 
-    @inmain_decorator()
     def handle_get_shot_output_folder(self):
-        shot_output_folder = app.ui.lineEdit_shot_output_folder.text()
+        shot_output_folder = self.get_cached_settings()['shot_output_folder']
         return os.path.abspath(shot_output_folder)
 
     @inmain_decorator()
@@ -3812,7 +4424,7 @@ class RemoteServer(ZMQServer):
         try:
             # This will raise an exception if there are multiple active groups of the
             # same name:
-            active_groups = inmain(app.get_active_groups, interactive=False)
+            active_groups = app.get_active_groups(interactive=False)
             sequence_globals = runmanager.get_globals(active_groups)
             # This will raise an exception if any of the globals can't be evaluated:
             runmanager.evaluate_globals(sequence_globals, raise_exceptions=True)
@@ -3821,7 +4433,7 @@ class RemoteServer(ZMQServer):
         return False
 
     def handle_is_output_folder_default(self):
-        return not app.non_default_folder
+        return self.get_cached_settings()['output_folder_default']
 
     @inmain_decorator()
     def handle_reset_shot_output_folder(self):
@@ -22,10 +22,14 @@ process_tree.zlock_client.set_process_name('runmanager.batch_compiler')
 
 import os
 import sys
+import builtins
 import traceback
 from types import ModuleType
 
 import labscript
+import labscript_utils.h5_lock
+import h5py
+import runmanager
 from labscript_utils.modulewatcher import ModuleWatcher
 
 class BatchProcessor(object):
@@ -53,6 +57,20 @@ class BatchProcessor(object):
             else:
                 raise ValueError(signal)
                     
+    def load_global_datasets(self, run_file):
+        """labscript_init() puts the globals into builtins as returned by
+        labscript_utils.shot_utils.get_shot_globals(), which leaves globals saved as
+        datasets as object references. Replace these with their arrays."""
+        references = {
+            name: value
+            for name, value in vars(builtins).items()
+            if isinstance(value, h5py.Reference) and value
+        }
+        if references:
+            arrays = runmanager.load_global_datasets(run_file, references)
+            for name, value in arrays.items():
+                setattr(builtins, name, value)
+
     def compile(self, labscript_file, run_file):
         self.script_module.__file__ = labscript_file
 
@@ -65,6 +83,7 @@ class BatchProcessor(object):
             # Do not let the modulewatcher unload any modules whilst we're working:
             with kill_lock, module_watcher.lock:
                 labscript.labscript_init(run_file, labscript_file=labscript_file)
+                self.load_global_datasets(run_file)
                 with open(labscript_file) as f:
                     code = compile(
                         f.read(), self.script_module.__file__, 'exec', dont_inherit=True
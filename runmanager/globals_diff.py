@@ -1,14 +1,141 @@
-"""Script that runs :meth:`runmanager.globals_diff_shots` between two shot files.
+"""Script that compares the globals of shot files.
 
-It is run from the command prompt::
+Given two shot files, it runs :meth:`runmanager.globals_diff_shots` between them::
 
-$ python runmanager.global_diffs(shot1,shot2)
+$ python -m runmanager.globals_diff shot1.h5 shot2.h5
 
+Given more than two shot files, or directories containing shot files, it runs
+:func:`globals_diff_sequence` on all of them, reporting which globals vary across the
+set::
+
+$ python -m runmanager.globals_diff path/to/sequence_folder
 
 """
+import os
 import sys
-from runmanager import globals_diff_shots
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from runmanager import globals_diff_shots, load_shot_globals, SEQUENCE_FILE_SUFFIXES
+
+# Maximum number of distinct values to list for each global in the summary:
+MAX_VALUES_SHOWN = 5
+
+
+def _hashable(value):
+    """Return a hashable key for a global's value, such that two values have equal
+    keys if they are equal and of the same type"""
+    if isinstance(value, np.ndarray):
+        return ('ndarray', value.dtype.str, value.shape, value.tobytes())
+    try:
+        hash(value)
+    except TypeError:
+        return ('repr', repr(value))
+    return (type(value).__name__, value)
+
+
+def _read_shot_globals(path):
+    shot_globals = load_shot_globals(path)
+    keys = {name: _hashable(value) for name, value in shot_globals.items()}
+    return shot_globals, keys
 
-if __name__ == '__main__':
 
-    df = globals_diff_shots(sys.argv[1], sys.argv[2])
+def read_sequence_globals(paths, max_workers=None):
+    """Read the evaluated globals of each shot file in paths, in parallel, and return
+    two DataFrames indexed by path with a column per global. The first contains the
+    globals' values, and the second hashable keys for them, as used by
+    globals_diff_sequence() to compare values. Globals missing from a shot are NaN in
+    both."""
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(_read_shot_globals, paths))
+    values = pd.DataFrame.from_records([r[0] for r in results], index=paths)
+    keys = pd.DataFrame.from_records([r[1] for r in results], index=paths)
+    return values, keys.reindex(columns=values.columns)
+
+
+def globals_diff_sequence(paths, max_workers=None):
+    """Compare the evaluated globals of any number of shot files, reading each file
+    once. Return a DataFrame indexed by the name of each global that is not the same
+    in all shots, with columns for the number of distinct values it takes, the number
+    of shots it is missing from, its minimum and maximum if it is numeric, and a
+    sample of its distinct values. Returns an empty DataFrame if all shots have
+    identical globals."""
+    values, keys = read_sequence_globals(paths, max_workers=max_workers)
+    n_distinct = keys.nunique(dropna=True)
+    n_missing = keys.isna().sum()
+    varies = (n_distinct > 1) | (n_missing > 0)
+    names = sorted(varies.index[varies])
+    numeric = values[names].select_dtypes(include='number')
+    summary = pd.DataFrame(
+        {
+            'Distinct values': n_distinct[names],
+            'Missing': n_missing[names],
+            'Min': numeric.min(),
+            'Max': numeric.max(),
+        },
+        index=pd.Index(names, name='Global'),
+    )
+    samples = []
+    for name in names:
+        present = keys[name].notna()
+        distinct_values = values[name][present][~keys[name][present].duplicated()]
+        sample = [repr(value) for value in distinct_values.iloc[:MAX_VALUES_SHOWN]]
+        if len(distinct_values) > MAX_VALUES_SHOWN:
+            sample.append('...')
+        samples.append(', '.join(sample))
+    summary['Values'] = samples
+    return summary
+
+
+def _find_shot_files(paths):
+    # Directories are searched recursively, so that run files in shard subfolders
+    # are found:
+    shot_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                shot_files.extend(
+                    os.path.join(dirpath, name)
+                    for name in sorted(filenames)
+                    if name.endswith('.h5') and not name.endswith(SEQUENCE_FILE_SUFFIXES)
+                )
+        else:
+            shot_files.append(path)
+    return shot_files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m runmanager.globals_diff',
+        description="Compare the globals of shot files.",
+    )
+    parser.add_argument(
+        'paths', nargs='+', help="shot files, or directories containing shot files"
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=None,
+        help="number of files to read in parallel",
+    )
+    args = parser.parse_args(argv)
+    shot_files = _find_shot_files(args.paths)
+    if len(shot_files) == 2 and len(args.paths) == 2:
+        return globals_diff_shots(*shot_files)
+    summary = globals_diff_sequence(shot_files, max_workers=args.jobs)
+    print('Globals diff between %d shot files:\n' % len(shot_files))
+    if len(summary):
+        print(summary.to_string())
+    else:
+        print('Evaluated globals are identical in all shot files.')
+    return summary
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,323 @@
+"""An index of the sequence attributes and globals of all shot files in a shot storage
+tree, kept in a local SQLite database so that shots can be found without opening
+every HDF5 file.
+
+The index is brought up to date by :meth:`ShotIndex.update`, which only reads shot
+files that are new or have been modified since they were last indexed, and is queried
+with :meth:`ShotIndex.query`. It can also be used from the command prompt::
+
+$ python -m runmanager.index update
+$ python -m runmanager.index query "detuning > 5e6" --since 2026-10-12
+
+"""
+import os
+import re
+import sys
+import ast
+import json
+import sqlite3
+import argparse
+import contextlib
+
+import labscript_utils.h5_lock
+import h5py
+import numpy as np
+import pandas as pd
+
+from labscript_utils.labconfig import LabConfig
+from runmanager import SEQUENCE_FILE_SUFFIXES
+
+# Top-level attributes of shot files that are stored as columns of the shots table.
+# All other filters in queries are on globals:
+SHOT_ATTRS = {
+    'script_basename': 'script_basename',
+    'sequence_date': 'sequence_date',
+    'sequence_index': 'sequence_index',
+    'sequence_id': 'sequence_id',
+    'run number': 'run_number',
+    'n_runs': 'n_runs',
+}
+
+QUERY_OPERATORS = ['<=', '>=', '!=', '=', '<', '>']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shots (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    script_basename TEXT,
+    sequence_date TEXT,
+    sequence_index INTEGER,
+    sequence_id TEXT,
+    run_number INTEGER,
+    n_runs INTEGER
+);
+CREATE TABLE IF NOT EXISTS globals (
+    path TEXT NOT NULL REFERENCES shots(path) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value,
+    PRIMARY KEY (path, name)
+);
+CREATE INDEX IF NOT EXISTS globals_name_value ON globals (name, value);
+CREATE INDEX IF NOT EXISTS shots_sequence_date ON shots (sequence_date);
+"""
+
+
+def _sqlite_value(value):
+    """Convert an HDF5 attribute value to a value that can be stored in SQLite.
+    Numbers and strings are stored as such so that they can be compared in queries,
+    arrays are stored as JSON text."""
+    if isinstance(value, (bool, np.bool_)):
+        return int(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, bytes):
+        return value.decode('utf8', errors='backslashreplace')
+    if isinstance(value, h5py.Reference):
+        # Null references are how None globals are saved, others refer to datasets
+        # of globals too large to be saved as attributes, which are not indexed:
+        return None if not value else '<dataset>'
+    if isinstance(value, np.ndarray):
+        return json.dumps(value.tolist(), default=str)
+    if isinstance(value, (int, float, str)) or value is None:
+        return value
+    return repr(value)
+
+
+def read_shot_file(path):
+    """Return the top-level attributes and globals of a shot file as dicts of values
+    suitable for storing in the index"""
+    with h5py.File(path, 'r') as f:
+        attrs = {name: _sqlite_value(value) for name, value in f.attrs.items()}
+        if 'globals' in f:
+            shot_globals = f['globals'].attrs
+            shot_globals = {
+                name: _sqlite_value(value) for name, value in shot_globals.items()
+            }
+        else:
+            shot_globals = {}
+    return attrs, shot_globals
+
+
+def parse_filter(expression):
+    """Parse a filter such as 'detuning > 5e6' into a (name, operator, value) tuple.
+    The value is evaluated as a Python literal if possible, otherwise it is taken to
+    be a string."""
+    pattern = r'^\s*(.+?)\s*(%s)\s*(.+?)\s*$' % '|'.join(
+        re.escape(operator) for operator in QUERY_OPERATORS
+    )
+    match = re.match(pattern, expression)
+    if match is None:
+        raise ValueError('Cannot parse filter %r' % expression)
+    name, operator, value = match.groups()
+    try:
+        value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        pass
+    return name, operator, _sqlite_value(value)
+
+
+class ShotIndex(object):
+    """An index of the shot files under shot_storage, stored in an SQLite database at
+    db_path. If not given, shot_storage defaults to the experiment_shot_storage
+    labconfig setting, and db_path to the runmanager/shot_index labconfig setting, or
+    shot_index.sqlite in the runmanager subdirectory of app_saved_configs if that is
+    not set."""
+
+    def __init__(self, shot_storage=None, db_path=None, config=None):
+        if shot_storage is None or db_path is None:
+            if config is None:
+                config = LabConfig()
+        if shot_storage is None:
+            shot_storage = config.get('DEFAULT', 'experiment_shot_storage')
+        if db_path is None:
+            try:
+                db_path = config.get('runmanager', 'shot_index')
+            except (LabConfig.NoOptionError, LabConfig.NoSectionError):
+                app_saved_configs = config.get('DEFAULT', 'app_saved_configs')
+                db_path = os.path.join(app_saved_configs, 'runmanager', 'shot_index.sqlite')
+        self.shot_storage = shot_storage
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def find_shot_files(self):
+        """Yield the path, mtime and size of every shot file in the shot storage
+        tree"""
+        for dirpath, dirnames, filenames in os.walk(self.shot_storage):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if not filename.endswith('.h5') or filename.endswith(SEQUENCE_FILE_SUFFIXES):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # Deleted since listing the directory:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def update(self, progress=None):
+        """Bring the index up to date with the shot storage tree. Shot files that are
+        not yet in the index, or whose modification time or size has changed since
+        they were indexed, are read. Shot files that no longer exist are removed from
+        the index. Files that cannot be read, for example because they are still
+        being written, are skipped and will be retried next time. If given,
+        progress(path) is called before reading each file. Returns the numbers of
+        files added or updated, removed, and skipped."""
+        indexed = {
+            path: (mtime, size)
+            for path, mtime, size in self.connection.execute(
+                'SELECT path, mtime, size FROM shots'
+            )
+        }
+        n_updated = 0
+        n_skipped = 0
+        seen = set()
+        with self.connection:
+            for path, mtime, size in self.find_shot_files():
+                seen.add(path)
+                if indexed.get(path) == (mtime, size):
+                    continue
+                if progress is not None:
+                    progress(path)
+                try:
+                    attrs, shot_globals = read_shot_file(path)
+                except (OSError, KeyError):
+                    n_skipped += 1
+                    continue
+                self._add_shot(path, mtime, size, attrs, shot_globals)
+                n_updated += 1
+            removed = [(path,) for path in indexed if path not in seen]
+            self.connection.executemany('DELETE FROM shots WHERE path = ?', removed)
+        return n_updated, len(removed), n_skipped
+
+    def _add_shot(self, path, mtime, size, attrs, shot_globals):
+        # Deletes the shot's old globals, if any, by cascade:
+        self.connection.execute('DELETE FROM shots WHERE path = ?', (path,))
+        columns = ['path', 'mtime', 'size'] + list(SHOT_ATTRS.values())
+        values = [path, mtime, size] + [attrs.get(attr) for attr in SHOT_ATTRS]
+        self.connection.execute(
+            'INSERT INTO shots (%s) VALUES (%s)'
+            % (', '.join(columns), ', '.join('?' * len(columns))),
+            values,
+        )
+        self.connection.executemany(
+            'INSERT INTO globals (path, name, value) VALUES (?, ?, ?)',
+            [(path, name, value) for name, value in shot_globals.items()],
+        )
+
+    def query(self, filters=(), since=None, until=None, global_names=None):
+        """Return a DataFrame, indexed by path, of the shots matching all of filters,
+        a list of (name, operator, value) tuples or strings such as 'detuning > 5e6'.
+        Names may be of globals or of top-level shot attributes such as
+        sequence_index. Operators may be any of QUERY_OPERATORS. since and until, if
+        given, are inclusive bounds on the sequence_date, as 'YYYY-MM-DD' strings or
+        dates. The columns are the top-level attributes followed by the globals named
+        in global_names, or all globals if global_names is None."""
+        joins = []
+        join_params = []
+        conditions = []
+        params = []
+        for i, shot_filter in enumerate(filters):
+            if isinstance(shot_filter, str):
+                shot_filter = parse_filter(shot_filter)
+            name, operator, value = shot_filter
+            if operator not in QUERY_OPERATORS:
+                raise ValueError('Invalid operator %r' % operator)
+            if name in SHOT_ATTRS or name in SHOT_ATTRS.values():
+                column = 'shots.%s' % SHOT_ATTRS.get(name, name)
+            else:
+                joins.append(
+                    'JOIN globals AS g%d ON g%d.path = shots.path AND g%d.name = ?'
+                    % (i, i, i)
+                )
+                join_params.append(name)
+                column = 'g%d.value' % i
+            conditions.append('%s %s ?' % (column, operator))
+            params.append(value)
+        if since is not None:
+            conditions.append('shots.sequence_date >= ?')
+            params.append(str(since))
+        if until is not None:
+            conditions.append('shots.sequence_date <= ?')
+            params.append(str(until))
+        sql = 'SELECT shots.path, %s FROM shots %s' % (
+            ', '.join('shots.%s' % column for column in SHOT_ATTRS.values()),
+            ' '.join(joins),
+        )
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY shots.sequence_id, shots.run_number'
+        rows = self.connection.execute(sql, join_params + params).fetchall()
+        shots = pd.DataFrame.from_records(
+            rows, columns=['path'] + list(SHOT_ATTRS), index='path'
+        )
+        if global_names is not None and not global_names:
+            return shots
+        with contextlib.closing(self.connection.cursor()) as cursor:
+            cursor.execute('CREATE TEMP TABLE IF NOT EXISTS query_paths (path TEXT)')
+            cursor.execute('DELETE FROM query_paths')
+            cursor.executemany(
+                'INSERT INTO query_paths VALUES (?)', [(path,) for path in shots.index]
+            )
+            sql = 'SELECT globals.path, name, value FROM globals JOIN query_paths USING (path)'
+            if global_names is not None:
+                global_names = list(global_names)
+                sql += ' WHERE name IN (%s)' % ', '.join('?' * len(global_names))
+            shot_globals = cursor.execute(sql, global_names or ()).fetchall()
+            cursor.execute('DELETE FROM query_paths')
+        shot_globals = pd.DataFrame.from_records(
+            shot_globals, columns=['path', 'name', 'value']
+        ).pivot(index='path', columns='name', values='value')
+        return shots.join(shot_globals)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m runmanager.index',
+        description="Index the globals of shot files, and query the index.",
+    )
+    parser.add_argument('--shot-storage', help="root of the shot storage tree")
+    parser.add_argument('--db', help="path to the index database")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('update', help="bring the index up to date")
+    query_parser = subparsers.add_parser('query', help="find shots")
+    query_parser.add_argument(
+        'filters', nargs='*', help="filters such as 'detuning > 5e6'"
+    )
+    query_parser.add_argument('--since', help="earliest sequence date, YYYY-MM-DD")
+    query_parser.add_argument('--until', help="latest sequence date, YYYY-MM-DD")
+    query_parser.add_argument(
+        '--globals', nargs='*', help="globals to show, default all"
+    )
+    args = parser.parse_args(argv)
+
+    with ShotIndex(shot_storage=args.shot_storage, db_path=args.db) as index:
+        if args.command == 'update':
+            n_updated, n_removed, n_skipped = index.update()
+            print(
+                'Indexed %d new or modified shot files, removed %d, skipped %d.'
+                % (n_updated, n_removed, n_skipped)
+            )
+        else:
+            shots = index.query(args.filters, args.since, args.until, args.globals)
+            with pd.option_context('display.max_rows', None):
+                print(shots.to_string())
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
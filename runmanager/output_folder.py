@@ -0,0 +1,160 @@
+#####################################################################
+#                                                                   #
+# /output_folder.py                                                 #
+#                                                                   #
+# Copyright 2013, Monash University                                 #
+#                                                                   #
+# This file is part of the program runmanager, in the labscript     #
+# suite (see http://labscriptsuite.org), and is licensed under the  #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+"""Caching of the default shot output folder.
+
+The default output folder depends on the date and on the next sequence index, which
+is read from the .next_sequence_index file in the shot storage, under a zlock. Rather
+than computing it every time it is needed, :class:`DefaultOutputFolder` caches it,
+and recomputes it only when something it depends on changes: the date, or the
+sequence index, when a sequence is compiled by this or another process.
+"""
+
+import os
+import datetime
+import threading
+import logging
+
+import runmanager
+
+
+class DefaultOutputFolder(object):
+    """Cache of the default output folder for the labscript file given to get(),
+    computed with runmanager.new_sequence_details() using the given LabConfig.
+
+    The cached folder is recomputed when get() is called with a different labscript
+    file, or when the modification time of the sequence index file has changed, as it
+    does when this or another process, such as another instance of runmanager,
+    compiles a sequence. It is also recomputed after invalidate() has been called,
+    which should be done after each compile and when a file system watcher of
+    watched_paths() reports a change, in case the modification time is too coarse to
+    have changed. And it is recomputed at midnight in a background thread, after which
+    on_change(folder), if given, is called in that thread if the folder has changed.
+    Output folder formats with fields that change during the day, such as
+    {sequence_timestamp}, are not updated except at these times."""
+
+    def __init__(self, config, on_change=None):
+        self.config = config
+        self.on_change = on_change
+        self.logger = logging.getLogger('runmanager.output_folder')
+        self.lock = threading.Lock()
+        self.labscript_file = None
+        self.folder = None
+        self.sequence_index_mtime = None
+        self.date = None
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.mainloop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _shot_basedir(self, labscript_file):
+        # The folder containing the sequence index file, as per new_sequence_details():
+        script_basename = os.path.splitext(os.path.basename(labscript_file))[0]
+        shot_storage = self.config.get('DEFAULT', 'experiment_shot_storage')
+        return os.path.join(shot_storage, script_basename)
+
+    def _sequence_index_mtime(self, labscript_file):
+        sequence_index_file = os.path.join(
+            self._shot_basedir(labscript_file), runmanager.SEQUENCE_INDEX_FILENAME
+        )
+        try:
+            return os.stat(sequence_index_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def watched_paths(self, labscript_file):
+        """Return the paths that a file system watcher should watch for changes to the
+        sequence index for labscript_file: the sequence index file, the folder it is
+        in, in case the file is created or replaced, and that folder's parent, in case
+        the folder is created. Returns an empty list if labscript_file is empty."""
+        if not labscript_file:
+            return []
+        shot_basedir = self._shot_basedir(labscript_file)
+        return [
+            os.path.dirname(shot_basedir),
+            shot_basedir,
+            os.path.join(shot_basedir, runmanager.SEQUENCE_INDEX_FILENAME),
+        ]
+
+    def _compute(self, labscript_file):
+        _, folder, _ = runmanager.new_sequence_details(
+            labscript_file, config=self.config, increment_sequence_index=False
+        )
+        return os.path.normpath(folder)
+
+    def get(self, labscript_file):
+        """Return the default output folder for labscript_file, or an empty string if
+        labscript_file is empty. Only computed if the labscript file, the date or the
+        modification time of the sequence index file have changed since the last call,
+        or if the cache has been invalidated, otherwise the cached folder is
+        returned."""
+        if not labscript_file:
+            return ''
+        sequence_index_mtime = self._sequence_index_mtime(labscript_file)
+        with self.lock:
+            if labscript_file != self.labscript_file:
+                self.labscript_file = labscript_file
+                self.folder = None
+            if (
+                self.folder is None
+                or self.date != datetime.date.today()
+                or self.sequence_index_mtime != sequence_index_mtime
+            ):
+                self.date = datetime.date.today()
+                self.sequence_index_mtime = sequence_index_mtime
+                self.folder = self._compute(labscript_file)
+            return self.folder
+
+    def invalidate(self):
+        """Discard the cached folder, so that it is recomputed on the next call to
+        get(). Call this after incrementing the sequence index, or when a file system
+        watcher reports a change to one of watched_paths()."""
+        with self.lock:
+            self.folder = None
+
+    def _seconds_until_midnight(self):
+        now = datetime.datetime.now()
+        tomorrow = datetime.datetime.combine(
+            now.date() + datetime.timedelta(days=1), datetime.time()
+        )
+        # A second late, to be sure the date has changed when we wake:
+        return (tomorrow - now).total_seconds() + 1
+
+    def mainloop(self):
+        while not self.stopping.wait(self._seconds_until_midnight()):
+            try:
+                self.refresh()
+            except Exception:
+                # Don't stop the thread:
+                self.logger.exception('Error computing default output folder')
+
+    def refresh(self):
+        """Recompute the default output folder for the most recent labscript file, and
+        call on_change(folder) if it has changed."""
+        with self.lock:
+            labscript_file = self.labscript_file
+            previous_folder = self.folder
+        if labscript_file is None:
+            return
+        folder = self._compute(labscript_file)
+        with self.lock:
+            if labscript_file != self.labscript_file:
+                # Changed in the meantime, in which case get() computed it afresh:
+                return
+            self.folder = folder
+            self.date = datetime.date.today()
+        if folder != previous_folder and self.on_change is not None:
+            self.on_change(folder)
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
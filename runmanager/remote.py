@@ -1,13 +1,261 @@
 DEFAULT_PORT = 42523
+DEFAULT_BINARY_PORT = 42524
 
-from labscript_utils.ls_zprocess import ZMQClient
+import os
+import sys
+import time
+import pickle
+import threading
+import traceback
+from binascii import hexlify
+from socket import gethostbyname
+from concurrent.futures import ThreadPoolExecutor
+
+import zmq
+import zprocess
+
+from labscript_utils.ls_zprocess import ZMQClient, Context
 from labscript_utils.labconfig import LabConfig
 
 
+def serialise(obj):
+    """Pickle obj with protocol 5, returning a list of frames suitable for sending as a
+    zmq multipart message. The first frame is the pickle data, and the remaining frames
+    are the raw buffers of any contiguous numpy arrays in obj, which are not copied."""
+    buffers = []
+    data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    return [data] + [buffer.raw() for buffer in buffers]
+
+
+def deserialise(frames):
+    """Inverse of serialise(). numpy arrays in the result are views of the received
+    frames rather than copies."""
+    return pickle.loads(frames[0], buffers=frames[1:])
+
+
+# Commands of runmanager's remote API that only read state, handled concurrently by
+# both the GUI's and the headless server. Not n_shots, since in the GUI it waits for
+# globals to finish being parsed, which would tie up a worker indefinitely:
+READ_ONLY_COMMANDS = (
+    'get_globals',
+    'get_active_groups',
+    'evaluate',
+    'get_run_shots',
+    'get_view_shots',
+    'get_shuffle',
+    'get_labscript_file',
+    'get_shot_output_folder',
+    'error_in_globals',
+    'is_output_folder_default',
+)
+
+
+class Server(object):
+    """Base class for runmanager remote servers. Listens for requests from
+    Client.request() on port, and for requests from Client.request_binary() on
+    binary_port, for which requests and responses are sent with serialise() and
+    deserialise() such that numpy arrays are transferred without being copied.
+
+    Requests are of the form [command, args, kwargs], and are passed to handler(), to
+    be implemented by subclasses, which should return the response, or an exception
+    object to be raised in the client. Commands in read_only_commands are run
+    concurrently on a pool of n_workers threads, so that slow requests do not hold up
+    others, and so the handlers for them must be safe to call from any thread at any
+    time. All other commands are run one at a time, in the order they were received, in
+    a single worker thread. The latency of each command, from receipt of the request
+    until the response is ready, is recorded and is returned by the
+    'get_latency_stats' command."""
+
+    read_only_commands = ()
+
+    def __init__(self, port=None, binary_port=None, n_workers=4):
+        if port is None:
+            port = LabConfig().getint('ports', 'runmanager', fallback=DEFAULT_PORT)
+        if binary_port is None:
+            binary_port = LabConfig().getint(
+                'ports', 'runmanager_binary', fallback=DEFAULT_BINARY_PORT
+            )
+        self.port = port
+        self.binary_port = binary_port
+        self.read_only_commands = set(self.read_only_commands) | {
+            'hello',
+            '__version__',
+            'get_latency_stats',
+        }
+        self._read_only_pool = ThreadPoolExecutor(n_workers)
+        self._serial_pool = ThreadPoolExecutor(1)
+        self._latencies = {}
+        self._latencies_lock = threading.Lock()
+        self._crashed = threading.Event()
+
+        self.context = Context.instance()
+        self.sock = self.context.socket(zmq.ROUTER)
+        self.sock.setsockopt(zmq.LINGER, 0)
+        self.sock.bind('tcp://*:%d' % self.port)
+        self.binary_sock = self.context.socket(zmq.ROUTER)
+        self.binary_sock.setsockopt(zmq.LINGER, 0)
+        self.binary_sock.bind('tcp://*:%d' % self.binary_port)
+
+        # Workers cannot use the above sockets, since zmq sockets are not threadsafe.
+        # They send responses to the mainloop via this socket instead:
+        endpoint_id = hexlify(os.urandom(8)).decode()
+        self._responses_endpoint = 'inproc://runmanager-responses-' + endpoint_id
+        self._responses_sock = self.context.socket(zmq.PULL)
+        self._responses_sock.bind(self._responses_endpoint)
+        self._local = threading.local()
+        self._worker_socks = []
+
+        self._shutdown_endpoint = 'inproc://runmanager-shutdown-' + endpoint_id
+        self._shutdown_sock = self.context.socket(zmq.PULL)
+        self._shutdown_sock.bind(self._shutdown_endpoint)
+
+        self.mainloop_thread = threading.Thread(target=self.mainloop)
+        self.mainloop_thread.daemon = True
+        self.mainloop_thread.start()
+
+    def mainloop(self):
+        poller = zmq.Poller()
+        for sock in [
+            self.sock,
+            self.binary_sock,
+            self._responses_sock,
+            self._shutdown_sock,
+        ]:
+            poller.register(sock, zmq.POLLIN)
+        try:
+            while True:
+                events = dict(poller.poll())
+                if self._shutdown_sock in events:
+                    assert self._shutdown_sock.recv() == b'stop'
+                    break
+                if self._responses_sock in events:
+                    # A response from a worker. The first frame says which socket it
+                    # is for, the rest are the envelope and message:
+                    frames = self._responses_sock.recv_multipart(copy=False)
+                    if frames[0].bytes == b'binary':
+                        sock = self.binary_sock
+                    else:
+                        sock = self.sock
+                    sock.send_multipart(frames[1:], copy=False)
+                for sock, binary in [(self.sock, False), (self.binary_sock, True)]:
+                    if sock in events:
+                        self._receive_request(sock, binary)
+        except Exception:
+            self._crashed.set()
+            raise
+
+    def _receive_request(self, sock, binary):
+        frames = sock.recv_multipart(copy=False)
+        received_time = time.monotonic()
+        # Requests are from REQ sockets, and so consist of the client's identity, an
+        # empty delimiter frame, and then the message:
+        envelope = [frame.bytes for frame in frames[:2]]
+        message = [frame.buffer for frame in frames[2:]]
+        try:
+            if binary:
+                request_data = deserialise(message)
+            else:
+                request_data = pickle.loads(message[0])
+            command = request_data[0]
+        except Exception:
+            msg = "The server could not decode the request:\n%s"
+            response = RuntimeError(msg % traceback.format_exc())
+            self._send_response(envelope, response, binary)
+            return
+        if command in self.read_only_commands:
+            pool = self._read_only_pool
+        else:
+            pool = self._serial_pool
+        pool.submit(
+            self._handle_request, envelope, request_data, binary, received_time
+        )
+
+    def _handle_request(self, envelope, request_data, binary, received_time):
+        try:
+            response = self.handler(request_data)
+        except Exception:
+            msg = "The server had an unhandled exception whilst processing the "
+            msg += "request:\n%s" % traceback.format_exc()
+            response = RuntimeError(msg)
+        command = request_data[0]
+        latency = time.monotonic() - received_time
+        with self._latencies_lock:
+            count, total, maximum, _ = self._latencies.get(command, (0, 0.0, 0.0, 0.0))
+            self._latencies[command] = (
+                count + 1,
+                total + latency,
+                max(maximum, latency),
+                latency,
+            )
+        self._send_response(envelope, response, binary)
+
+    def _send_response(self, envelope, response, binary):
+        try:
+            if binary:
+                message = serialise(response)
+            else:
+                message = [pickle.dumps(response, protocol=zprocess.PICKLE_PROTOCOL)]
+        except Exception:
+            msg = "The server could not encode the response:\n%s"
+            response = RuntimeError(msg % traceback.format_exc())
+            message = [pickle.dumps(response, protocol=zprocess.PICKLE_PROTOCOL)]
+        if not hasattr(self._local, 'sock'):
+            self._local.sock = self.context.socket(zmq.PUSH)
+            self._local.sock.connect(self._responses_endpoint)
+            self._worker_socks.append(self._local.sock)
+        destination = b'binary' if binary else b'pyobj'
+        self._local.sock.send_multipart([destination] + envelope + message, copy=False)
+
+    def handle_get_latency_stats(self):
+        """Return a dict {command: stats} of the latency, in seconds, of each command
+        the server has handled, where stats is a dict with keys 'count', 'mean', 'max'
+        and 'last'"""
+        with self._latencies_lock:
+            latencies = self._latencies.copy()
+        return {
+            command: {
+                'count': count,
+                'mean': total / count,
+                'max': maximum,
+                'last': last,
+            }
+            for command, (count, total, maximum, last) in latencies.items()
+        }
+
+    def handler(self, request_data):
+        """To be overridden by subclasses"""
+        raise NotImplementedError
+
+    def shutdown_on_interrupt(self):
+        try:
+            # Sleep rather than waiting on the event so that ctrl-C works on Windows:
+            while True:
+                time.sleep(1)
+                if self._crashed.is_set():
+                    raise RuntimeError("Server mainloop crashed")
+        except KeyboardInterrupt:
+            print('KeyboardInterrupt, stopping.', file=sys.stderr)
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        sock = self.context.socket(zmq.PUSH)
+        sock.connect(self._shutdown_endpoint)
+        sock.send(b'stop')
+        self.mainloop_thread.join()
+        sock.close(linger=100)
+        self._read_only_pool.shutdown(wait=True)
+        self._serial_pool.shutdown(wait=True)
+        for sock in self._worker_socks + [self._responses_sock, self._shutdown_sock]:
+            sock.close(linger=0)
+        self.sock.close(linger=0)
+        self.binary_sock.close(linger=0)
+
+
 class Client(ZMQClient):
     """A ZMQClient for communication with runmanager"""
 
-    def __init__(self, host=None, port=None, timeout=None):
+    def __init__(self, host=None, port=None, timeout=None, binary_port=None):
         ZMQClient.__init__(self)
         if host is None:
             host = LabConfig().get('servers', 'runmanager', fallback='localhost')
@@ -17,15 +265,52 @@ class Client(ZMQClient):
             timeout = LabConfig().getfloat(
                 'timeouts', 'communication_timeout', fallback=60
             )
+        if binary_port is None:
+            binary_port = LabConfig().getint(
+                'ports', 'runmanager_binary', fallback=DEFAULT_BINARY_PORT
+            )
         self.host = host
         self.port = port
+        self.binary_port = binary_port
         self.timeout = timeout
+        self._binary_local = threading.local()
 
     def request(self, command, *args, **kwargs):
         return self.get(
             self.port, self.host, data=[command, args, kwargs], timeout=self.timeout
         )
 
+    def request_binary(self, command, *args, **kwargs):
+        """As request(), but via the binary server, such that numpy arrays in the
+        arguments and the response are sent as separate message frames without being
+        copied."""
+        local = self._binary_local
+        if not hasattr(local, 'sock'):
+            local.sock = Context.instance().socket(zmq.REQ)
+            local.sock.setsockopt(zmq.LINGER, 1000)
+            try:
+                local.sock.connect(
+                    'tcp://%s:%d' % (gethostbyname(self.host), self.binary_port),
+                    timeout=self.timeout * 1000,
+                )
+            except Exception:
+                del local.sock
+                raise
+        try:
+            local.sock.send_multipart(serialise([command, args, kwargs]), copy=False)
+            if not local.sock.poll(self.timeout * 1000):
+                raise TimeoutError('No response from server: timed out')
+            response_frames = local.sock.recv_multipart(copy=False)
+        except Exception:
+            # Any exceptions, we want to stop using this socket:
+            local.sock.close(linger=0)
+            del local.sock
+            raise
+        response = deserialise([frame.buffer for frame in response_frames])
+        if isinstance(response, Exception):
+            raise response
+        return response
+
     def say_hello(self):
         """Ping the runmanager server for a response"""
         return self.request('hello')
@@ -34,24 +319,49 @@ class Client(ZMQClient):
         """Return the version of runmanager the server is running in"""
         return self.request('__version__')
 
-    def get_globals(self, raw=False):
+    def get_globals(self, raw=False, binary=False):
         """Return all active globals as a dict of the form: {'<global_name>': value}. If
         raw=True, then the global values are returned as their string representations,
         as stored in the runmanager GUI and globals HDF5 file, otherwise they are
-        evaluated as python objects and then returned."""
+        evaluated as python objects and then returned. If binary=True, the request is
+        made via the binary server, and numpy arrays are received as views of the
+        received message rather than being copied out of it."""
+        if binary:
+            return self.request_binary('get_globals', raw=raw)
         return self.request('get_globals', raw=raw)
 
-    def set_globals(self, globals, raw=False):
+    def set_globals(self, globals, raw=False, binary=False):
         """For a dict of the form {'<global_name>': value}, set the given globals to the
         given values. If raw=True, then global values will be treated as the string
         representations of Python objects rather than the objects themselves, and
         written directly to the HDF5 file and runmanager GUI without calling repr() on
-        them first."""
+        them first. Unless raw=True, numpy arrays of at least
+        runmanager.ARRAY_DATASET_THRESHOLD bytes are stored as HDF5 datasets rather than
+        as their repr(). If binary=True, the request is made via the binary server, and
+        the data of numpy arrays is sent without being copied."""
+        if binary:
+            return self.request_binary('set_globals', globals, raw=raw)
         return self.request('set_globals', globals, raw=raw)
 
-    def engage(self):
-        """Trigger shot compilation/submission"""
-        return self.request('engage')
+    def engage(self, overrides=None, scan=None, raw=False):
+        """Trigger shot compilation/submission. overrides, if given, is a dict
+        {'<global_name>': value} of globals to set to the given values for this sequence
+        only, and scan a dict {'<global_name>': values} of globals to scan over for this
+        sequence only, each on its own outer product axis. These are applied on top of
+        the current globals without modifying the globals files or the runmanager GUI,
+        and are recorded in the 'globals_overrides' group of the run files. raw has the
+        same meaning as for set_globals()."""
+        return self.request('engage', overrides=overrides, scan=scan, raw=raw)
+
+    def evaluate(self, proposed_globals, raw=False):
+        """Return the number of shots, expansion axis dimensions and evaluation errors
+        that would result from setting the globals in proposed_globals, a dict
+        {'<global_name>': value}, to the given values, without setting them. If a list
+        of such dicts is given, a list of results is returned, one for each, all
+        evaluated against the same current globals. raw has the same meaning as for
+        set_globals(). See runmanager.evaluate_proposed_globals() for the format of the
+        results."""
+        return self.request('evaluate', proposed_globals, raw=raw)
 
     def abort(self):
         """Trigger abort compilation/submission"""
@@ -113,6 +423,15 @@ class Client(ZMQClient):
         """Reset the shot output folder to the default path"""
         return self.request('reset_shot_output_folder')
 
+    def get_active_groups(self):
+        """Return the active groups in the format {group_name: globals_file}"""
+        return self.request('get_active_groups')
+
+    def set_active_groups(self, active_groups):
+        """Set the active groups, in the format {group_name: globals_file}. Only
+        supported by the headless server, runmanager.server"""
+        return self.request('set_active_groups', active_groups)
+
 
 _default_client = Client()
 
@@ -123,6 +442,7 @@ get_globals = _default_client.get_globals
 set_globals = _default_client.set_globals
 # set_globals_full = _default_client.set_globals_full
 engage = _default_client.engage
+evaluate = _default_client.evaluate
 abort = _default_client.abort
 get_run_shots = _default_client.get_run_shots
 set_run_shots = _default_client.set_run_shots
@@ -138,6 +458,8 @@ set_shot_output_folder = _default_client.set_shot_output_folder
 error_in_globals = _default_client.error_in_globals
 is_output_folder_default = _default_client.is_output_folder_default
 reset_shot_output_folder = _default_client.reset_shot_output_folder
+get_active_groups = _default_client.get_active_groups
+set_active_groups = _default_client.set_active_groups
 
 if __name__ == '__main__':
     # Test
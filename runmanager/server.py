@@ -0,0 +1,597 @@
+#####################################################################
+#                                                                   #
+# /server.py                                                        #
+#                                                                   #
+# Copyright 2013, Monash University                                 #
+#                                                                   #
+# This file is part of the program runmanager, in the labscript     #
+# suite (see http://labscriptsuite.org), and is licensed under the  #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+"""Headless runmanager server.
+
+Holds the active groups, labscript file and shot output folder as plain Python state
+and speaks the same remote protocol as the runmanager GUI, so that
+:mod:`runmanager.remote` clients can drive compilation on a machine without a display.
+It is run from the command prompt::
+
+$ python -m runmanager.server [config_file] [--port PORT]
+
+where ``config_file`` is an optional runmanager configuration file, as saved by the
+GUI, from which to load the initial state.
+"""
+
+import os
+import sys
+import queue
+import threading
+import traceback
+import logging
+import argparse
+
+import numpy as np
+
+from labscript_utils.ls_zprocess import zmq_get
+from labscript_utils.labconfig import LabConfig, load_appconfig
+from labscript_utils.setup_logging import setup_logging
+import labscript_utils.shared_drive as shared_drive
+from labscript_utils import dedent
+
+import runmanager
+import runmanager.remote
+from runmanager.staging import RunFileMover
+from runmanager.output_folder import DefaultOutputFolder
+
+runmanager_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class RunmanagerServer(runmanager.remote.Server):
+    """A runmanager remote server that does not depend on the GUI. State that the GUI
+    keeps in its widgets is kept here in instance attributes, protected by
+    ``self.lock``, and globals are parsed and compiled directly using the functions in
+    :mod:`runmanager`. Commands that do not modify state are handled concurrently, see
+    :class:`runmanager.remote.Server`.
+
+    Args:
+        port (int, optional): Port to listen on. Defaults to the ``runmanager`` port in
+            labconfig, or :data:`runmanager.remote.DEFAULT_PORT`.
+        config_file (str, optional): runmanager configuration file, as saved by the
+            GUI, to load the initial state from.
+        binary_port (int, optional): Port to listen on for requests with binary
+            array transport, see :class:`runmanager.remote.Server`. Defaults to the
+            ``runmanager_binary`` port in labconfig, or
+            :data:`runmanager.remote.DEFAULT_BINARY_PORT`.
+    """
+
+    # Commands handled concurrently. Their handlers read state only under self.lock,
+    # copying anything mutable:
+    read_only_commands = runmanager.remote.READ_ONLY_COMMANDS
+
+    def __init__(self, port=None, config_file=None, binary_port=None):
+        self.logger = logging.getLogger('runmanager_server')
+        self.exp_config = LabConfig()
+
+        self.lock = threading.RLock()
+        # Active groups, in the format {group_name: globals_file}:
+        self.active_groups = {}
+        self.labscript_file = ''
+        # None means the default output folder is in use:
+        self.shot_output_folder = None
+        self.send_to_BLACS = True
+        self.send_to_runviewer = False
+        self.shuffle = False
+        self.BLACS_host = 'localhost'
+        # Ordering and shuffle state of expansion axes, as in the GUI's axes tab:
+        self.expansion_config = {}
+        # Guesses expansion modes of globals as they change, as the GUI does. Guessing
+        # writes to the globals files, so is serialised with its own lock:
+        self.expansion_mode_guesser = runmanager.ExpansionModeGuesser()
+        self.expansion_lock = threading.Lock()
+
+        # Cache of the default output folder, recomputed when the date or sequence
+        # index changes:
+        self.default_output_folder = DefaultOutputFolder(self.exp_config)
+
+        if config_file is not None:
+            self.load_configuration(config_file)
+
+        # A flag telling the compilation thread to abort:
+        self.compilation_aborted = threading.Event()
+
+        # Start the compiler subprocess. Its output goes to our stdout:
+        self.to_child, self.from_child, self.child = runmanager.process_tree.subprocess(
+            os.path.join(runmanager_dir, 'batch_compiler.py')
+        )
+        self.logger.info('compiler subprocess started')
+
+        # If a staging directory is configured, run files are created and compiled
+        # there, and moved to the shot output folder in the background:
+        staging_dir = self.exp_config.get('runmanager', 'staging_dir', fallback='')
+        if staging_dir:
+            self.run_file_mover = RunFileMover(
+                staging_dir, on_error=self.on_run_file_move_error
+            )
+        else:
+            self.run_file_mover = None
+
+        # Start the loop that allows compilations to be queued up:
+        self.compile_queue = queue.Queue()
+        self.compile_queue_thread = threading.Thread(target=self.compile_loop)
+        self.compile_queue_thread.daemon = True
+        self.compile_queue_thread.start()
+
+        runmanager.remote.Server.__init__(self, port=port, binary_port=binary_port)
+        self.logger.info(
+            'listening on port %d, binary port %d', self.port, self.binary_port
+        )
+
+    def load_configuration(self, filename):
+        """Load state from a runmanager configuration file as saved by the GUI. Open
+        group tabs and other purely graphical state are ignored."""
+        runmanager_config = load_appconfig(filename).get('runmanager_state', {})
+        active_groups = {}
+        for globals_file, group_name in runmanager_config.get('active_groups', []):
+            if not os.path.exists(globals_file):
+                self.logger.warning('globals file %s no longer exists', globals_file)
+                continue
+            if group_name not in runmanager.get_grouplist(globals_file):
+                msg = "previously active group '%s' in %s no longer exists"
+                self.logger.warning(msg, group_name, globals_file)
+                continue
+            if group_name in active_groups:
+                msg = 'There are two active groups named %s. ' % group_name
+                msg += 'Active groups must have unique names.'
+                raise RuntimeError(msg)
+            active_groups[group_name] = globals_file
+
+        with self.lock:
+            self.active_groups = active_groups
+            current_labscript_file = runmanager_config.get('current_labscript_file')
+            if current_labscript_file:
+                self.labscript_file = current_labscript_file
+            if runmanager_config.get('is_using_default_shot_output_folder', True):
+                self.shot_output_folder = None
+            else:
+                self.shot_output_folder = runmanager_config.get('shot_output_folder')
+            send_to_runviewer = runmanager_config.get('send_to_runviewer')
+            if send_to_runviewer is not None:
+                self.send_to_runviewer = send_to_runviewer
+            send_to_blacs = runmanager_config.get('send_to_blacs')
+            if send_to_blacs is not None:
+                self.send_to_BLACS = send_to_blacs
+            self.shuffle = runmanager_config.get('shuffle', False)
+            axes = runmanager_config.get('axes')
+            if axes is not None and isinstance(axes, list):
+                self.expansion_config = {
+                    name: {'order': i, 'shuffle': bool(shuffle)}
+                    for i, (name, shuffle) in enumerate(axes)
+                }
+            blacs_host = runmanager_config.get('blacs_host')
+            if blacs_host is not None:
+                self.BLACS_host = blacs_host
+        self.logger.info('Loaded configuration %s', filename)
+
+    def get_default_output_folder(self):
+        """Returns what the default output folder would be right now, based on the
+        current date and labscript file. Returns empty string if no labscript file is
+        set."""
+        with self.lock:
+            labscript_file = self.labscript_file
+        if not labscript_file:
+            return ''
+        return self.default_output_folder.get(labscript_file)
+
+    def get_expansion_config(self, expansions):
+        """Return the expansion config for expand_globals(), with axes not previously
+        configured given the shuffle state of the master shuffle setting, as new axes
+        in the GUI are."""
+        with self.lock:
+            expansion_config = {k: dict(v) for k, v in self.expansion_config.items()}
+            shuffle = self.shuffle
+        for global_name, expansion in expansions.items():
+            if expansion == 'outer':
+                axis_name = 'outer ' + global_name
+            elif expansion:
+                axis_name = 'zip ' + expansion
+            else:
+                continue
+            if axis_name not in expansion_config:
+                expansion_config[axis_name] = {'shuffle': shuffle}
+        return expansion_config
+
+    def evaluate_globals(self, active_groups, raise_exceptions=True):
+        """Read and evaluate the globals of active_groups, first guessing their
+        expansion modes as the GUI does, see
+        runmanager.evaluate_globals_guessing_expansions()"""
+        with self.expansion_lock:
+            return runmanager.evaluate_globals_guessing_expansions(
+                active_groups, self.expansion_mode_guesser, raise_exceptions
+            )
+
+    def parse_globals(self, sequence_globals, raise_exceptions=True):
+        evaled_globals, global_hierarchy, expansions = runmanager.evaluate_globals(
+            sequence_globals, raise_exceptions
+        )
+        shots = runmanager.expand_globals(
+            sequence_globals, evaled_globals, self.get_expansion_config(expansions)
+        )
+        return shots, evaled_globals, global_hierarchy, expansions
+
+    def compile_loop(self):
+        while True:
+            try:
+                labscript_file, run_files, send_to_BLACS, BLACS_host, send_to_runviewer = self.compile_queue.get()
+
+                def submit(run_file):
+                    # Called in this thread, or in the run file mover's thread once the
+                    # run file has been moved out of the staging directory:
+                    if self.compilation_aborted.is_set():
+                        return
+                    try:
+                        if send_to_BLACS:
+                            self.submit_to_BLACS(run_file, BLACS_host)
+                        if send_to_runviewer:
+                            self.submit_to_runviewer(run_file)
+                    except Exception:
+                        self.compilation_aborted.set()
+                        raise
+
+                for run_file in run_files:
+                    if self.compilation_aborted.is_set():
+                        self.logger.warning('Compilation aborted.')
+                        break
+                    self.to_child.put(['compile', [labscript_file, run_file]])
+                    signal, success = self.from_child.get()
+                    assert signal == 'done'
+                    if not success:
+                        self.logger.error('Compilation of %s failed.', run_file)
+                        break
+                    if (
+                        self.run_file_mover is not None
+                        and self.run_file_mover.is_staged(run_file)
+                    ):
+                        self.run_file_mover.move(run_file, submit)
+                    else:
+                        submit(run_file)
+                else:
+                    self.logger.info('Ready.')
+            except Exception:
+                # Log it, but keep going so the thread keeps functioning:
+                self.logger.exception('Error in compilation')
+            finally:
+                if self.run_file_mover is not None:
+                    self.run_file_mover.finish()
+                self.compilation_aborted.clear()
+
+    def on_run_file_move_error(self, staged_path, final_path, error):
+        # Called from the run file mover's thread:
+        self.logger.error(
+            'Could not move %s to %s: %s. The file remains at %s, and was not submitted.',
+            os.path.basename(staged_path),
+            final_path,
+            str(error),
+            staged_path,
+        )
+        self.compilation_aborted.set()
+
+    def submit_to_BLACS(self, run_file, BLACS_hostname):
+        port = int(self.exp_config.get('ports', 'BLACS'))
+        agnostic_path = shared_drive.path_to_agnostic(run_file)
+        self.logger.info('Submitting run file %s.', os.path.basename(run_file))
+        response = zmq_get(port, BLACS_hostname, data=agnostic_path)
+        if 'added successfully' not in response:
+            raise Exception("Couldn't submit job to control server: %s" % response)
+        self.logger.info(response.strip())
+
+    def submit_to_runviewer(self, run_file):
+        # Unlike the GUI, we do not attempt to start runviewer if it is not running:
+        runviewer_port = int(self.exp_config.get('ports', 'runviewer'))
+        agnostic_path = shared_drive.path_to_agnostic(run_file)
+        try:
+            response = zmq_get(runviewer_port, 'localhost', data=agnostic_path, timeout=0.5)
+            if 'ok' not in response:
+                raise Exception(response)
+        except Exception as e:
+            self.logger.warning("Couldn't submit shot to runviewer: %s", str(e))
+        else:
+            self.logger.info('Shot %s sent to runviewer.', os.path.basename(run_file))
+
+    def handle_get_globals(self, raw=False):
+        with self.lock:
+            active_groups = self.active_groups.copy()
+        sequence_globals = runmanager.get_globals(active_groups)
+        all_globals = {}
+        if raw:
+            for group_globals in sequence_globals.values():
+                values_only = {name: val for name, (val, _, _) in group_globals.items()}
+                all_globals.update(values_only)
+        else:
+            evaled_globals, global_hierarchy, expansions = runmanager.evaluate_globals(
+                sequence_globals, raise_exceptions=False
+            )
+            for group_globals in evaled_globals.values():
+                all_globals.update(group_globals)
+        return all_globals
+
+    def handle_set_globals(self, globals, raw=False):
+        with self.lock:
+            active_groups = self.active_groups.copy()
+        sequence_globals = runmanager.get_globals(active_groups)
+        for global_name, new_value in globals.items():
+            # Unless raw=True, convert to str representation for saving to the file.
+            # If this does not result in an object the user can actually use,
+            # evaluation will error and the caller will find out about it later
+            if (
+                not raw
+                and isinstance(new_value, np.ndarray)
+                and new_value.nbytes >= runmanager.ARRAY_DATASET_THRESHOLD
+            ):
+                # Large arrays are stored as datasets rather than as text:
+                new_value = runmanager.ArrayExpression(new_value)
+            elif not raw:
+                new_value = repr(new_value)
+            elif not isinstance(new_value, (str, bytes)):
+                msg = "global %s must be a string if raw=True, not %s"
+                raise TypeError(msg % (global_name, new_value.__class__.__name__))
+
+            # Find the group this global is in:
+            groups_with_global = [
+                group_name
+                for group_name, group_globals in sequence_globals.items()
+                if global_name in group_globals
+            ]
+            if not groups_with_global:
+                msg = "Global %s not found in any active group" % global_name
+                raise ValueError(msg)
+            elif len(groups_with_global) > 1:
+                msg = """Cannot set global %s, it is defined in multiple active groups:
+                    %s and %s"""
+                msg = msg % (global_name, groups_with_global[0], groups_with_global[1])
+                raise RuntimeError(dedent(msg))
+            group_name = groups_with_global[0]
+            previous_value, _, _ = sequence_globals[group_name][global_name]
+
+            # Append expression-final comments in the previous expression to the new
+            # one:
+            comments = runmanager.find_comments(previous_value)
+            if comments:
+                # Only the final comment
+                comment_start, comment_end = comments[-1]
+                # Only if the comment is the last thing in the expression:
+                if comment_end == len(previous_value):
+                    new_value += previous_value[comment_start:comment_end]
+            runmanager.set_value(
+                active_groups[group_name], group_name, global_name, new_value
+            )
+        # Update expansion modes for the new values, as the GUI does. Any errors in
+        # the new values are reported when they are next evaluated:
+        self.evaluate_globals(active_groups, raise_exceptions=False)
+
+    def handle_get_active_groups(self):
+        with self.lock:
+            return self.active_groups.copy()
+
+    def handle_set_active_groups(self, active_groups):
+        # Validate before changing anything:
+        for group_name, globals_file in active_groups.items():
+            if group_name not in runmanager.get_grouplist(globals_file):
+                msg = "Group %s not found in %s" % (group_name, globals_file)
+                raise ValueError(msg)
+        with self.lock:
+            self.active_groups = dict(active_groups)
+
+    def handle_engage(self, overrides=None, scan=None, raw=False):
+        with self.lock:
+            active_groups = self.active_groups.copy()
+            labscript_file = self.labscript_file
+            shot_output_folder = self.shot_output_folder
+            send_to_BLACS = self.send_to_BLACS
+            send_to_runviewer = self.send_to_runviewer
+            shuffle = self.shuffle
+            BLACS_host = self.BLACS_host
+        if not labscript_file:
+            raise Exception('Error: No labscript file selected')
+        self.logger.info('Parsing globals...')
+        try:
+            sequence_globals, _, _, _ = self.evaluate_globals(active_groups)
+        except Exception as e:
+            raise Exception('Error parsing globals:\n%s\nCompilation aborted.' % str(e))
+        # Globals overridden or scanned for this sequence only:
+        sequence_globals, override_expressions = runmanager.apply_global_overrides(
+            sequence_globals, overrides, scan, raw
+        )
+        if override_expressions:
+            msg = 'Overriding globals: %s'
+            self.logger.info(msg, ', '.join(sorted(override_expressions)))
+        try:
+            if override_expressions:
+                # Guess the expansion modes of the overridden globals as they would be
+                # if set with set_globals(), without writing them to the globals files:
+                with self.expansion_lock:
+                    expansion_mode_guesser = self.expansion_mode_guesser.copy()
+                sequence_globals, _, _, _ = runmanager.evaluate_globals_guessing_expansions(
+                    active_groups, expansion_mode_guesser, sequence_globals=sequence_globals
+                )
+            shots, _, _, _ = self.parse_globals(sequence_globals)
+        except Exception as e:
+            raise Exception('Error parsing globals:\n%s\nCompilation aborted.' % str(e))
+        sequence_attrs, default_output_dir, filename_prefix = runmanager.new_sequence_details(
+            labscript_file, config=self.exp_config, increment_sequence_index=True
+        )
+        self.default_output_folder.invalidate()
+        if shot_output_folder is None:
+            output_folder = default_output_dir
+        else:
+            output_folder = shot_output_folder
+        if self.run_file_mover is not None:
+            # Create and compile the run files in the staging directory. They are
+            # moved to the output folder by the run file mover once compiled:
+            output_folder = self.run_file_mover.staged_folder(output_folder)
+        self.logger.info('Making h5 files')
+        run_files = runmanager.make_run_files(
+            output_folder,
+            sequence_globals,
+            shots,
+            sequence_attrs,
+            filename_prefix,
+            shuffle,
+            overrides=override_expressions,
+            manifest=self.exp_config.getboolean(
+                'runmanager', 'sequence_manifest', fallback=False
+            ),
+            sidecar=self.exp_config.getboolean(
+                'runmanager', 'sequence_globals_sidecar', fallback=False
+            ),
+            compression=self.exp_config.get(
+                'runmanager', 'global_dataset_compression', fallback=None
+            ),
+            private=self.exp_config.getboolean(
+                'runmanager', 'atomic_run_files', fallback=False
+            ),
+        )
+        self.compile_queue.put(
+            [labscript_file, run_files, send_to_BLACS, BLACS_host, send_to_runviewer]
+        )
+
+    def handle_evaluate(self, proposed_globals, raw=False):
+        with self.lock:
+            active_groups = self.active_groups.copy()
+        sequence_globals = runmanager.get_globals(active_groups)
+        return runmanager.evaluate_proposed_globals(sequence_globals, proposed_globals, raw)
+
+    def handle_abort(self):
+        self.compilation_aborted.set()
+
+    def handle_get_run_shots(self):
+        with self.lock:
+            return self.send_to_BLACS
+
+    def handle_set_run_shots(self, value):
+        with self.lock:
+            self.send_to_BLACS = bool(value)
+
+    def handle_get_view_shots(self):
+        with self.lock:
+            return self.send_to_runviewer
+
+    def handle_set_view_shots(self, value):
+        with self.lock:
+            self.send_to_runviewer = bool(value)
+
+    def handle_get_shuffle(self):
+        with self.lock:
+            return self.shuffle
+
+    def handle_set_shuffle(self, value):
+        with self.lock:
+            self.shuffle = bool(value)
+            # Like the GUI's master shuffle checkbox, this applies to all axes:
+            for axis_config in self.expansion_config.values():
+                axis_config['shuffle'] = self.shuffle
+
+    def handle_n_shots(self):
+        with self.lock:
+            active_groups = self.active_groups.copy()
+        # Errors evaluating globals are raised, and so returned to the client:
+        sequence_globals, evaled_globals, _, expansions = self.evaluate_globals(
+            active_groups
+        )
+        shots = runmanager.expand_globals(
+            sequence_globals, evaled_globals, self.get_expansion_config(expansions)
+        )
+        return len(shots)
+
+    def handle_get_labscript_file(self):
+        with self.lock:
+            return os.path.abspath(self.labscript_file)
+
+    def handle_set_labscript_file(self, value):
+        with self.lock:
+            self.labscript_file = os.path.abspath(value)
+
+    def handle_get_shot_output_folder(self):
+        with self.lock:
+            shot_output_folder = self.shot_output_folder
+        if shot_output_folder is None:
+            shot_output_folder = self.get_default_output_folder()
+        return os.path.abspath(shot_output_folder)
+
+    def handle_set_shot_output_folder(self, value):
+        shot_output_folder = os.path.abspath(value)
+        if shot_output_folder == self.get_default_output_folder():
+            shot_output_folder = None
+        with self.lock:
+            self.shot_output_folder = shot_output_folder
+
+    def handle_error_in_globals(self):
+        try:
+            with self.lock:
+                active_groups = self.active_groups.copy()
+            sequence_globals = runmanager.get_globals(active_groups)
+            # This will raise an exception if any of the globals can't be evaluated:
+            runmanager.evaluate_globals(sequence_globals, raise_exceptions=True)
+        except Exception:
+            return True
+        return False
+
+    def handle_is_output_folder_default(self):
+        with self.lock:
+            return self.shot_output_folder is None
+
+    def handle_reset_shot_output_folder(self):
+        with self.lock:
+            self.shot_output_folder = None
+
+    def handler(self, request_data):
+        cmd, args, kwargs = request_data
+        if cmd == 'hello':
+            return 'hello'
+        elif cmd == '__version__':
+            return runmanager.__version__
+        try:
+            return getattr(self, 'handle_' + cmd)(*args, **kwargs)
+        except Exception as e:
+            msg = traceback.format_exc()
+            msg = "Runmanager server returned an exception:\n" + msg
+            return e.__class__(msg)
+
+    def shutdown(self):
+        runmanager.remote.Server.shutdown(self)
+        self.default_output_folder.stop()
+        self.to_child.put(['quit', None])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python -m runmanager.server',
+        description='Run a runmanager remote server without the graphical interface.',
+    )
+    parser.add_argument(
+        'config_file',
+        nargs='?',
+        default=None,
+        help='runmanager configuration file, as saved by the GUI, to load state from',
+    )
+    parser.add_argument('--port', type=int, default=None, help='port to listen on')
+    parser.add_argument(
+        '--binary-port',
+        type=int,
+        default=None,
+        help='port to listen on for requests with binary array transport',
+    )
+    args = parser.parse_args()
+
+    logger = setup_logging('runmanager_server')
+    logger.info('\n\n===============starting===============\n')
+    # Set a meaningful name for zprocess.locking's client id:
+    runmanager.process_tree.zlock_client.set_process_name('runmanager_server')
+    server = RunmanagerServer(
+        port=args.port, config_file=args.config_file, binary_port=args.binary_port
+    )
+    server.shutdown_on_interrupt()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#####################################################################
+#                                                                   #
+# /staging.py                                                       #
+#                                                                   #
+# Copyright 2013, Monash University                                 #
+#                                                                   #
+# This file is part of the program runmanager, in the labscript     #
+# suite (see http://labscriptsuite.org), and is licensed under the  #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+"""Staging of run files in a local scratch directory.
+
+When shot storage is on a network share, creating and compiling run files there makes
+every HDF5 operation pay the network latency. Instead, run files can be created and
+compiled in a local staging directory, and then moved to the shot output folder by a
+:class:`RunFileMover` in a background thread, before they are submitted to BLACS.
+"""
+
+import os
+import time
+import queue
+import shutil
+import tempfile
+import threading
+import logging
+
+from runmanager import SEQUENCE_FILE_SUFFIXES
+
+
+class RunFileMover(object):
+    """Moves run files from a staging directory to their output folders in a
+    background thread, in the order they are given to move().
+
+    Output folders are mapped to folders within staging_dir by staged_folder(), which
+    should be used as the output folder when creating run files. Once a run file is
+    compiled, move() queues it to be moved to the output folder, after which callback
+    is called with its final path, in the mover's thread. Run files may be in
+    subfolders of the staged folder, as when sharded, and are moved to the same
+    subfolders of the output folder. Files in the staged folder with any of
+    runmanager.SEQUENCE_FILE_SUFFIXES, such as the sequence manifest, are copied
+    before the first run file is moved. Their staged copies are kept, since run files
+    still being compiled in the staging directory have external links to them, until
+    finish() is called once all run files of the sequence have been queued. If moving
+    a file fails, it is retried RETRIES times, RETRY_INTERVAL seconds apart. If it
+    still fails, on_error is called with the staged path, the final path and the
+    exception, and the file is left in the staging directory."""
+
+    RETRIES = 5
+    RETRY_INTERVAL = 2.0
+
+    def __init__(self, staging_dir, on_error=None):
+        self.staging_dir = os.path.abspath(staging_dir)
+        self.on_error = on_error
+        self.logger = logging.getLogger('runmanager.staging')
+        # {staged folder: output folder}:
+        self.output_folders = {}
+        # Staged sequence files copied to their output folders, to be deleted once the
+        # sequence is finished:
+        self.copied_sequence_files = set()
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.mainloop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def staged_folder(self, output_folder):
+        """Return the folder in the staging directory in which to create run files
+        destined for output_folder. The output folder's path is mirrored within the
+        staging directory."""
+        output_folder = os.path.abspath(output_folder)
+        drive, path = os.path.splitdrive(output_folder)
+        folder = os.path.join(
+            self.staging_dir, drive.replace(':', '').strip(os.sep), path.lstrip(os.sep)
+        )
+        with self.lock:
+            self.output_folders[folder] = output_folder
+        return folder
+
+    def _staged_and_output_folders(self, path):
+        # Return the staged folder containing path, which may be in a shard subfolder
+        # of it, and the output folder it maps to, or None, None:
+        folder = os.path.dirname(os.path.abspath(path))
+        with self.lock:
+            while True:
+                if folder in self.output_folders:
+                    return folder, self.output_folders[folder]
+                parent = os.path.dirname(folder)
+                if parent == folder:
+                    return None, None
+                folder = parent
+
+    def is_staged(self, path):
+        return self._staged_and_output_folders(path)[0] is not None
+
+    def move(self, path, callback=None):
+        """Queue the staged file at path to be moved to its output folder. If given,
+        callback(final_path) is called once it has been moved."""
+        self.queue.put((os.path.abspath(path), callback))
+
+    def join(self):
+        """Wait for all queued files to be moved"""
+        self.queue.join()
+
+    def finish(self):
+        """Wait for all queued files to be moved, and then delete the staged copies of
+        the sequence files copied to output folders. Call this once all run files of a
+        sequence have been queued, and not while any are still being compiled."""
+        self.queue.put((None, None))
+        self.join()
+
+    def mainloop(self):
+        while True:
+            path, callback = self.queue.get()
+            try:
+                if path is None:
+                    for staged_path in self.copied_sequence_files:
+                        self._remove_file(staged_path)
+                    self.copied_sequence_files.clear()
+                    continue
+                folder, output_folder = self._staged_and_output_folders(path)
+                # Copy any files for the sequence as a whole first:
+                for name in sorted(os.listdir(folder)):
+                    staged_path = os.path.join(folder, name)
+                    if (
+                        name.endswith(SEQUENCE_FILE_SUFFIXES)
+                        and staged_path not in self.copied_sequence_files
+                    ):
+                        if self.move_file(
+                            staged_path, os.path.join(output_folder, name), copy=True
+                        ):
+                            self.copied_sequence_files.add(staged_path)
+                final_path = os.path.join(output_folder, os.path.relpath(path, folder))
+                if self.move_file(path, final_path) and callback is not None:
+                    callback(final_path)
+            except Exception:
+                self.logger.exception('Error moving %s', path)
+            finally:
+                self.queue.task_done()
+
+    def move_file(self, path, final_path, copy=False):
+        """Move a file from path to final_path, retrying on failure. The file is
+        copied to a uniquely named temporary file in the same folder and then renamed,
+        so that it does not appear at final_path until it is complete. The temporary
+        file is deleted if moving fails. If copy is True, the file at path is kept.
+        Returns whether it was moved."""
+        for attempt in range(self.RETRIES + 1):
+            temp_path = None
+            try:
+                folder = os.path.dirname(final_path)
+                os.makedirs(folder, exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+                os.close(fd)
+                # Also copies permissions, as mkstemp() creates the file private:
+                shutil.copy(path, temp_path)
+                os.replace(temp_path, final_path)
+                temp_path = None
+                if not copy:
+                    os.remove(path)
+            except OSError as e:
+                self.logger.warning(
+                    'Failed to move %s to %s (attempt %d): %s',
+                    path,
+                    final_path,
+                    attempt + 1,
+                    str(e),
+                )
+                error = e
+                if temp_path is not None:
+                    self._remove_file(temp_path)
+                if attempt < self.RETRIES:
+                    time.sleep(self.RETRY_INTERVAL)
+            else:
+                self.logger.debug('Moved %s to %s', path, final_path)
+                return True
+        self.logger.error('Giving up moving %s to %s', path, final_path)
+        if self.on_error is not None:
+            self.on_error(path, final_path, error)
+        return False
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self.logger.warning('Failed to remove %s: %s', path, str(e))
@@ -0,0 +1,50 @@
+"""Tests that globals are saved in run files as attributes, unless they are too large
+for one, and that runmanager.load_shot_globals() reads them either way."""
+import warnings
+
+import labscript_utils.h5_lock
+import h5py
+import numpy as np
+
+import runmanager
+
+SEQUENCE_ATTRS = {
+    'script_basename': 'test',
+    'sequence_date': '2000-01-01',
+    'sequence_index': 0,
+    'sequence_id': '20000101T000000_test',
+}
+
+
+def test_arrays_that_fit_are_attributes(tmp_path):
+    run_file = str(tmp_path / 'test.h5')
+    # 40 kB, within the 64 kB attribute limit:
+    array = np.arange(5000.0)
+    runmanager.make_single_run_file(run_file, None, {'x': array}, SEQUENCE_ATTRS, 0, 1)
+    with h5py.File(run_file, 'r') as f:
+        assert runmanager.GLOBAL_DATASETS_GROUP not in f
+    np.testing.assert_array_equal(runmanager.load_shot_globals(run_file)['x'], array)
+
+
+def test_arrays_too_large_for_attributes_are_datasets(tmp_path):
+    run_file = str(tmp_path / 'test.h5')
+    array = np.arange(100000.0)
+    runmanager.make_single_run_file(run_file, None, {'x': array}, SEQUENCE_ATTRS, 0, 1)
+    with h5py.File(run_file, 'r') as f:
+        assert 'x' in f[runmanager.GLOBAL_DATASETS_GROUP]
+    value = runmanager.load_shot_globals(run_file)['x']
+    assert not isinstance(value, np.memmap)
+    np.testing.assert_array_equal(value, array)
+    value = runmanager.load_shot_globals(run_file, mmap=True)['x']
+    assert isinstance(value, np.memmap)
+    np.testing.assert_array_equal(value, array)
+
+
+def test_deprecated_get_shot_globals_loads_datasets(tmp_path):
+    run_file = str(tmp_path / 'test.h5')
+    array = np.arange(100000.0)
+    runmanager.make_single_run_file(run_file, None, {'x': array}, SEQUENCE_ATTRS, 0, 1)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        value = runmanager.get_shot_globals(run_file)['x']
+    np.testing.assert_array_equal(value, array)
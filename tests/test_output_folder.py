@@ -0,0 +1,57 @@
+"""Tests of caching of the default output folder."""
+import os
+import configparser
+
+import pytest
+
+import runmanager
+from runmanager.output_folder import DefaultOutputFolder
+
+
+@pytest.fixture
+def config(tmp_path):
+    config = configparser.ConfigParser(interpolation=None)
+    config['DEFAULT']['experiment_shot_storage'] = str(tmp_path)
+    config['runmanager'] = {'output_folder_format': '{sequence_index:05d}'}
+    return config
+
+
+@pytest.fixture
+def default_output_folder(config):
+    default_output_folder = DefaultOutputFolder(config)
+    yield default_output_folder
+    default_output_folder.stop()
+
+
+def test_cached_until_invalidated(tmp_path, default_output_folder, monkeypatch):
+    assert default_output_folder.get('') == ''
+    assert default_output_folder.get('test.py') == os.path.join(
+        str(tmp_path), 'test', '00000'
+    )
+    computed = []
+    compute = default_output_folder._compute
+    monkeypatch.setattr(
+        default_output_folder,
+        '_compute',
+        lambda labscript_file: computed.append(labscript_file) or compute(labscript_file),
+    )
+    assert default_output_folder.get('test.py').endswith('00000')
+    assert computed == []
+    default_output_folder.invalidate()
+    assert default_output_folder.get('test.py').endswith('00000')
+    assert computed == ['test.py']
+    assert default_output_folder.get('other.py') == os.path.join(
+        str(tmp_path), 'other', '00000'
+    )
+
+
+def test_recomputed_when_sequence_index_changes(tmp_path, config, default_output_folder):
+    assert default_output_folder.get('test.py').endswith('00000')
+    # As by another process, without invalidating the cache:
+    runmanager.new_sequence_details('test.py', config, increment_sequence_index=True)
+    assert default_output_folder.get('test.py').endswith('00001')
+    sequence_index_file = os.path.join(
+        str(tmp_path), 'test', runmanager.SEQUENCE_INDEX_FILENAME
+    )
+    assert sequence_index_file in default_output_folder.watched_paths('test.py')
+    assert default_output_folder.watched_paths('') == []
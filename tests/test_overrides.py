@@ -0,0 +1,44 @@
+"""Tests of overriding globals for a single sequence, guessing their expansion modes
+as the GUI would without modifying the globals files."""
+import pytest
+
+import runmanager
+
+
+@pytest.fixture
+def active_groups(tmp_path):
+    globals_file = str(tmp_path / 'globals.h5')
+    runmanager.new_globals_file(globals_file)
+    runmanager.new_group(globals_file, 'group')
+    for global_name, expression in [('x', '5'), ('y', 'x'), ('z', '2')]:
+        runmanager.new_global(globals_file, 'group', global_name)
+        runmanager.set_value(globals_file, 'group', global_name, expression)
+    return {'group': globals_file}
+
+
+def evaluate_overridden(active_groups, overrides=None, scan=None):
+    sequence_globals = runmanager.get_globals(active_groups)
+    guesser = runmanager.ExpansionModeGuesser()
+    guesser.prime(sequence_globals)
+    sequence_globals, _ = runmanager.apply_global_overrides(
+        sequence_globals, overrides, scan
+    )
+    sequence_globals, evaled_globals, _, expansions = (
+        runmanager.evaluate_globals_guessing_expansions(
+            active_groups, guesser, sequence_globals=sequence_globals
+        )
+    )
+    shots = runmanager.expand_globals(sequence_globals, evaled_globals)
+    return shots, expansions
+
+
+def test_dependents_of_scanned_global_are_zipped(active_groups):
+    shots, expansions = evaluate_overridden(active_groups, scan={'x': [1, 2, 3]})
+    assert expansions == {'x': 'x', 'y': 'x', 'z': ''}
+    assert [(shot['x'], shot['y']) for shot in shots] == [(1, 1), (2, 2), (3, 3)]
+
+
+def test_globals_files_not_modified(active_groups):
+    before = runmanager.get_globals(active_groups)
+    evaluate_overridden(active_groups, overrides={'x': [1, 2, 3]})
+    assert runmanager.get_globals(active_groups) == before
@@ -0,0 +1,45 @@
+"""Tests of evaluating proposed values of globals, which should give the same shot
+counts as setting them in the globals files would."""
+import pytest
+
+import runmanager
+
+
+@pytest.fixture
+def sequence_globals(tmp_path):
+    globals_file = str(tmp_path / 'globals.h5')
+    runmanager.new_globals_file(globals_file)
+    runmanager.new_group(globals_file, 'group')
+    for global_name, expression in [('x', '[1, 2, 3]'), ('y', 'x'), ('z', '2')]:
+        runmanager.new_global(globals_file, 'group', global_name)
+        runmanager.set_value(globals_file, 'group', global_name, expression)
+    active_groups = {'group': globals_file}
+    # Guess expansions as the GUI would, zipping y with x:
+    sequence_globals, _, _, expansions = runmanager.evaluate_globals_guessing_expansions(
+        active_groups, runmanager.ExpansionModeGuesser()
+    )
+    assert expansions == {'x': 'x', 'y': 'x', 'z': ''}
+    return sequence_globals
+
+
+@pytest.mark.parametrize(
+    'proposal, n_shots',
+    [
+        ({}, 3),
+        ({'x': [1, 2, 3, 4]}, 4),
+        ({'x': 5}, 1),
+        ({'z': [1, 2]}, 6),
+    ],
+)
+def test_n_shots(sequence_globals, proposal, n_shots):
+    result = runmanager.evaluate_proposed_globals(sequence_globals, proposal)
+    assert result['errors'] == {}
+    assert result['n_shots'] == n_shots
+
+
+def test_batch(sequence_globals):
+    results = runmanager.evaluate_proposed_globals(
+        sequence_globals, [{'x': 5}, {'x': [1, 2]}, {'w': 1}]
+    )
+    assert [result['n_shots'] for result in results] == [1, 2, 3]
+    assert list(results[2]['errors']) == ['w']
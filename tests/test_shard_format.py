@@ -0,0 +1,72 @@
+"""Tests of splitting run files between shard subfolders according to the
+output_folder_format labconfig setting."""
+import os
+import configparser
+
+import pytest
+
+import runmanager
+
+
+def make_config(shot_storage, output_folder_format, shard_size=None):
+    config = configparser.ConfigParser(interpolation=None)
+    config['DEFAULT']['experiment_shot_storage'] = str(shot_storage)
+    config['runmanager'] = {'output_folder_format': output_folder_format}
+    if shard_size is not None:
+        config['runmanager']['shard_size'] = str(shard_size)
+    return config
+
+
+@pytest.mark.parametrize(
+    'subdir_format, expected',
+    [
+        ('%Y/%m/%d/{sequence_index:05d}', ('%Y/%m/%d/{sequence_index:05d}', None)),
+        (
+            '%Y/%m/%d/{sequence_index:05d}/{shard:04d}',
+            (os.path.join('%Y', '%m', '%d', '{sequence_index:05d}'), '{shard:04d}'),
+        ),
+        (
+            '{sequence_index}/{shard}/sub',
+            ('{sequence_index}', os.path.join('{shard}', 'sub')),
+        ),
+        ('%Y\\{sequence_index}_{shard}', ('%Y', '{sequence_index}_{shard}')),
+        ('{shard}', ('', '{shard}')),
+        ('{shard}/%Y', ('', os.path.join('{shard}', '%Y'))),
+    ],
+)
+def test_split_shard_format(subdir_format, expected):
+    assert runmanager._split_shard_format(subdir_format) == expected
+
+
+def test_nested_shard_folders(tmp_path):
+    config = make_config(
+        tmp_path, '{sequence_index:05d}/shards/{shard:02d}/{sequence_index}', 2
+    )
+    sequence_attrs, output_folder, filename_prefix = runmanager.new_sequence_details(
+        'test.py', config, increment_sequence_index=False
+    )
+    assert output_folder == os.path.join(str(tmp_path), 'test', '00000', 'shards')
+    assert sequence_attrs['shard_size'] == 2
+    assert sequence_attrs['shard_folder_format'] == os.path.join('{shard:02d}', '0')
+    run_files = list(
+        runmanager.make_run_files(
+            output_folder, None, [{}] * 3, sequence_attrs, filename_prefix
+        )
+    )
+    assert [os.path.relpath(path, output_folder) for path in run_files] == [
+        os.path.join('00', '0', filename_prefix + '_0.h5'),
+        os.path.join('00', '0', filename_prefix + '_1.h5'),
+        os.path.join('01', '0', filename_prefix + '_2.h5'),
+    ]
+
+
+def test_leading_shard_folder(tmp_path):
+    config = make_config(tmp_path, '{shard}/%Y')
+    sequence_attrs, output_folder, _ = runmanager.new_sequence_details(
+        'test.py', config, increment_sequence_index=False
+    )
+    assert output_folder == os.path.join(str(tmp_path), 'test')
+    assert sequence_attrs['shard_size'] == runmanager.DEFAULT_SHARD_SIZE
+    assert sequence_attrs['shard_folder_format'].startswith(
+        os.path.join('{shard}', '')
+    )
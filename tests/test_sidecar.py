@@ -0,0 +1,138 @@
+"""Tests that run files made with a sequence globals sidecar file read the same as
+run files with the globals groups written out in full, as they always were."""
+import os
+import shutil
+
+import labscript_utils.h5_lock
+import h5py
+import numpy as np
+import pytest
+
+import runmanager
+from labscript_utils.shot_utils import get_shot_globals
+
+SEQUENCE_ATTRS = {
+    'script_basename': 'test',
+    'sequence_date': '2000-01-01',
+    'sequence_index': 0,
+    'sequence_id': '20000101T000000_test',
+}
+
+
+@pytest.fixture
+def sequence(tmp_path):
+    """The sequence globals and shots of a globals file with two groups"""
+    globals_file = str(tmp_path / 'globals.h5')
+    runmanager.new_globals_file(globals_file)
+    for group_name, expressions in [
+        ('group_a', {'x': '[1, 2, 3]', 'y': 'x * 2', 'name': "'abc'"}),
+        ('group_b', {'z': '1.5 # comment', 'none': 'None'}),
+    ]:
+        runmanager.new_group(globals_file, group_name)
+        for global_name, expression in expressions.items():
+            runmanager.new_global(globals_file, group_name, global_name)
+            runmanager.set_value(globals_file, group_name, global_name, expression)
+            runmanager.set_units(globals_file, group_name, global_name, 'V')
+    runmanager.set_expansion(globals_file, 'group_a', 'x', 'outer')
+    sequence_globals = runmanager.get_globals(
+        {'group_a': globals_file, 'group_b': globals_file}
+    )
+    evaled_globals, _, _ = runmanager.evaluate_globals(sequence_globals)
+    shots = runmanager.expand_globals(sequence_globals, evaled_globals)
+    return sequence_globals, shots
+
+
+def make_run_files(folder, sequence_globals, shots, sidecar):
+    return list(
+        runmanager.make_run_files(
+            folder,
+            sequence_globals,
+            [dict(shot) for shot in shots],
+            SEQUENCE_ATTRS,
+            'test',
+            sidecar=sidecar,
+        )
+    )
+
+
+def read_globals_groups(run_file):
+    """Return the attrs of each globals group and its units and expansion
+    subgroups"""
+    groups = {}
+    with h5py.File(run_file, 'r') as f:
+        for group_name, group in f['globals'].items():
+            groups[group_name] = {
+                'values': dict(group.attrs),
+                'units': dict(group['units'].attrs),
+                'expansion': dict(group['expansion'].attrs),
+            }
+    return groups
+
+
+def test_sidecar_run_files_match_full_run_files(tmp_path, sequence):
+    sequence_globals, shots = sequence
+    full_files = make_run_files(str(tmp_path / 'full'), sequence_globals, shots, False)
+    sidecar_files = make_run_files(
+        str(tmp_path / 'sidecar'), sequence_globals, shots, True
+    )
+    assert len(full_files) == len(sidecar_files) == 3
+    sidecar = os.path.join(str(tmp_path / 'sidecar'), 'test' + runmanager.SIDECAR_SUFFIX)
+    assert os.path.exists(sidecar)
+    for full_file, sidecar_file in zip(full_files, sidecar_files):
+        with h5py.File(sidecar_file, 'r') as f:
+            link = f['globals'].get('group_a', getlink=True)
+            assert isinstance(link, h5py.ExternalLink)
+            assert not os.path.isabs(link.filename)
+        assert read_globals_groups(sidecar_file) == read_globals_groups(full_file)
+        assert runmanager.get_globals(
+            runmanager.get_all_groups(sidecar_file)
+        ) == runmanager.get_globals(runmanager.get_all_groups(full_file))
+        full_globals = get_shot_globals(full_file)
+        sidecar_globals = get_shot_globals(sidecar_file)
+        assert full_globals.keys() == sidecar_globals.keys()
+        for name, value in full_globals.items():
+            np.testing.assert_equal(sidecar_globals[name], value)
+
+
+def test_sidecar_links_survive_moving_sequence_folder(tmp_path, sequence):
+    sequence_globals, shots = sequence
+    run_files = make_run_files(str(tmp_path / 'before'), sequence_globals, shots, True)
+    expected = read_globals_groups(run_files[0])
+    shutil.move(str(tmp_path / 'before'), str(tmp_path / 'after'))
+    moved_file = os.path.join(str(tmp_path / 'after'), os.path.basename(run_files[0]))
+    assert read_globals_groups(moved_file) == expected
+
+
+def test_no_sidecar_without_sequence_globals(tmp_path, sequence):
+    _, shots = sequence
+    run_files = make_run_files(str(tmp_path), None, shots, True)
+    assert not any(name.endswith(runmanager.SIDECAR_SUFFIX) for name in os.listdir(tmp_path))
+    with h5py.File(run_files[0], 'r') as f:
+        assert len(f['globals']) == 0
+        assert 'x' in f['globals'].attrs
+
+
+def test_private_run_files_take_no_zlock(tmp_path, sequence, monkeypatch):
+    sequence_globals, shots = sequence
+
+    def no_zlock(*args, **kwargs):
+        raise AssertionError('zlock acquired for a private file')
+
+    monkeypatch.setattr(labscript_utils.h5_lock, 'Lock', no_zlock)
+    run_files = list(
+        runmanager.make_run_files(
+            str(tmp_path),
+            sequence_globals,
+            [dict(shot) for shot in shots],
+            SEQUENCE_ATTRS,
+            'test',
+            manifest=True,
+            sidecar=True,
+            private=True,
+        )
+    )
+    monkeypatch.undo()
+    assert not any(name.endswith('.tmp') for name in os.listdir(tmp_path))
+    full_files = make_run_files(str(tmp_path / 'full'), sequence_globals, shots, False)
+    for run_file, full_file in zip(run_files, full_files):
+        assert read_globals_groups(run_file) == read_globals_groups(full_file)
@@ -0,0 +1,59 @@
+"""Tests that run files staged with a sequence globals sidecar file keep their links to
+it while they wait to be moved, and that the sidecar ends up with them once moved."""
+import os
+
+import labscript_utils.h5_lock
+import h5py
+
+import runmanager
+from runmanager.staging import RunFileMover
+
+SEQUENCE_ATTRS = {
+    'script_basename': 'test',
+    'sequence_date': '2000-01-01',
+    'sequence_index': 0,
+    'sequence_id': '20000101T000000_test',
+}
+
+
+def read_globals_group(run_file):
+    with h5py.File(run_file, 'r') as f:
+        return dict(f['globals']['group'].attrs)
+
+
+def test_staged_run_files_keep_sidecar_until_finished(tmp_path):
+    globals_file = str(tmp_path / 'globals.h5')
+    runmanager.new_globals_file(globals_file)
+    runmanager.new_group(globals_file, 'group')
+    runmanager.new_global(globals_file, 'group', 'x')
+    runmanager.set_value(globals_file, 'group', 'x', '[1, 2, 3]')
+    runmanager.set_expansion(globals_file, 'group', 'x', 'outer')
+    sequence_globals = runmanager.get_globals({'group': globals_file})
+    evaled_globals, _, _ = runmanager.evaluate_globals(sequence_globals)
+    shots = runmanager.expand_globals(sequence_globals, evaled_globals)
+
+    output_folder = str(tmp_path / 'output')
+    mover = RunFileMover(str(tmp_path / 'staging'))
+    staged_folder = mover.staged_folder(output_folder)
+    run_files = runmanager.make_run_files(
+        staged_folder, sequence_globals, shots, SEQUENCE_ATTRS, 'test', sidecar=True
+    )
+    moved = []
+    first_run_file = next(run_files)
+    mover.move(first_run_file, moved.append)
+    mover.join()
+    # Created after the first run file was moved, as when compiling:
+    staged_run_files = list(run_files)
+    expected = read_globals_group(staged_run_files[0])
+    assert expected == {'x': '[1, 2, 3]'}
+    for run_file in staged_run_files:
+        mover.move(run_file, moved.append)
+    mover.finish()
+
+    sidecar = 'test' + runmanager.SIDECAR_SUFFIX
+    assert not os.path.exists(os.path.join(staged_folder, sidecar))
+    assert os.path.exists(os.path.join(output_folder, sidecar))
+    assert len(moved) == 3
+    for run_file in moved:
+        assert os.path.dirname(run_file) == output_folder
+        assert read_globals_group(run_file) == expected